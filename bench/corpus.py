@@ -0,0 +1,189 @@
+"""
+Deterministic synthetic transcripts in the three formats the service accepts.
+"""
+
+import random
+
+WORDS = (
+    "the quick meeting notes lecture revenue project customer deadline design "
+    "question answer research model data energy system history market policy "
+    "student teacher review budget launch update feature release incident "
+    "summary agenda action item follow up decision risk plan team quarter "
+    "growth retention pipeline analysis report chapter theory example result"
+).split()
+
+PDF_LINES_PER_PAGE = 40
+PDF_CHARS_PER_LINE = 90
+
+
+def generate_paragraphs(rng: random.Random, word_count: int) -> list[str]:
+    paragraphs = []
+    sentences: list[str] = []
+    written = 0
+
+    while written < word_count:
+        length = rng.randint(6, 24)
+        words = [rng.choice(WORDS) for _ in range(length)]
+        sentences.append(" ".join(words).capitalize() + rng.choice(".!?"))
+        written += length
+
+        if len(sentences) >= rng.randint(3, 8):
+            paragraphs.append(" ".join(sentences))
+            sentences = []
+
+    if sentences:
+        paragraphs.append(" ".join(sentences))
+
+    return paragraphs
+
+
+def generate_boilerplate(seed: int, word_count: int = 400) -> list[str]:
+    """A block of paragraphs (a stand-in for intros and sponsor reads) repeated across documents."""
+
+    return generate_paragraphs(random.Random(f"boilerplate-{seed}"), word_count)
+
+
+def add_boilerplate(
+    rng: random.Random,
+    paragraphs: list[str],
+    boilerplate: list[str],
+    share: float,
+) -> list[str]:
+    """
+    Inserts copies of boilerplate until they make up about share of the
+    words. Every copy has one word changed, so copies are near-duplicates
+    rather than exact ones.
+    """
+
+    word_count = sum(len(paragraph.split()) for paragraph in paragraphs)
+    block_words = sum(len(paragraph.split()) for paragraph in boilerplate)
+    share = min(max(share, 0.0), 0.9)
+    copies = round(share * word_count / (block_words * (1 - share)))
+
+    paragraphs = list(paragraphs)
+
+    for _ in range(copies):
+        block = [paragraph.split() for paragraph in boilerplate]
+        changed = rng.choice(block)
+        changed[rng.randrange(len(changed))] = rng.choice(WORDS)
+
+        position = rng.randint(0, len(paragraphs))
+        paragraphs[position:position] = [" ".join(words) for words in block]
+
+    return paragraphs
+
+
+def _escape_pdf_text(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_pdf(paragraphs: list[str]) -> bytes:
+    """Writes a minimal multi-page PDF (Helvetica text, one line per Tj)."""
+
+    lines = []
+    for paragraph in paragraphs:
+        words = paragraph.split()
+        line = ""
+        for word in words:
+            if len(line) + len(word) + 1 > PDF_CHARS_PER_LINE:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+        lines.append("")
+
+    pages = [
+        lines[start : start + PDF_LINES_PER_PAGE]
+        for start in range(0, len(lines), PDF_LINES_PER_PAGE)
+    ] or [[""]]
+
+    page_count = len(pages)
+    font_object = 3 + 2 * page_count
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{3 + 2 * index} 0 R" for index in range(page_count)),
+            page_count,
+        ),
+    ]
+
+    for index, page_lines in enumerate(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * index} 0 R "
+            f"/Resources << /Font << /F1 {font_object} 0 R >> >> >>"
+        )
+        text_ops = " ".join(f"({_escape_pdf_text(line)}) Tj T*" for line in page_lines)
+        stream = f"BT /F1 10 Tf 14 TL 40 760 Td {text_ops} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        pdf += f"{offset:010d} 00000 n \n".encode("latin-1")
+    pdf += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref_offset}\n%%EOF\n"
+    ).encode("latin-1")
+
+    return bytes(pdf)
+
+
+def build_html(paragraphs: list[str]) -> bytes:
+    body = "\n".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+    html = (
+        "<!DOCTYPE html><html><head><title>Transcript</title>"
+        "<style>p { margin: 0 }</style><script>var x = 1;</script></head>"
+        f"<body><nav>Home | Notes</nav><h1>Transcript</h1>\n{body}\n</body></html>"
+    )
+    return html.encode("utf-8")
+
+
+def generate_corpus(
+    document_count: int,
+    words_per_document: int,
+    formats: list[str],
+    seed: int = 0,
+    key_prefix: str = "bench",
+    boilerplate_share: float = 0.0,
+) -> dict[str, bytes]:
+    """
+    Returns {s3_key: file bytes}, cycling through formats ("txt", "pdf",
+    "html"). boilerplate_share > 0 makes that share of every document's
+    words near-identical copies of one shared block.
+    """
+
+    rng = random.Random(seed)
+    boilerplate = generate_boilerplate(seed)
+    corpus = {}
+
+    for index in range(document_count):
+        file_format = formats[index % len(formats)]
+        # +/- 50% around the requested size so batches mix short and long files.
+        word_count = max(50, int(words_per_document * rng.uniform(0.5, 1.5)))
+        paragraphs = generate_paragraphs(rng, word_count)
+
+        if boilerplate_share > 0:
+            paragraphs = add_boilerplate(
+                rng, paragraphs, boilerplate, boilerplate_share
+            )
+
+        if file_format == "pdf":
+            file_bytes = build_pdf(paragraphs)
+        elif file_format == "html":
+            file_bytes = build_html(paragraphs)
+        else:
+            file_bytes = "\n\n".join(paragraphs).encode("utf-8")
+
+        corpus[f"{key_prefix}/{index:06d}/transcript.{file_format}"] = file_bytes
+
+    return corpus
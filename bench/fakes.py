@@ -0,0 +1,416 @@
+"""
+Local stand-ins for every external service the embedding service talks to.
+
+install_fakes() must run before any `services` module is imported: the SQS
+and SSM clients are created at import time, and forked worker processes
+inherit whatever is patched in the parent.
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+import uuid
+from typing import Any
+
+import boto3
+from botocore.exceptions import ClientError
+from qdrant_client import QdrantClient
+from qdrant_client.http.exceptions import UnexpectedResponse
+
+BENCH_QUEUE_URL = "https://sqs.bench.local/000000000000/embedding-push-queue"
+
+
+class BenchFinished(BaseException):
+    """
+    Raised by FakeSQS.receive_message once every message has been deleted.
+    It's a BaseException so the service's `except ValueError/Exception`
+    handlers let it unwind the service loop.
+    """
+
+
+def _client_error(code: str, message: str, operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class FakeSSM:
+    def __init__(self, parameters: dict[str, str]):
+        self.parameters = parameters
+
+    def get_parameter(self, Name: str, WithDecryption: bool = False) -> dict:
+        if Name not in self.parameters:
+            raise _client_error("ParameterNotFound", Name, "GetParameter")
+        return {"Parameter": {"Name": Name, "Value": self.parameters[Name]}}
+
+    def get_parameters(self, Names: list[str], WithDecryption: bool = False) -> dict:
+        return {
+            "Parameters": [
+                {"Name": name, "Value": self.parameters[name]}
+                for name in Names
+                if name in self.parameters
+            ],
+            "InvalidParameters": [
+                name for name in Names if name not in self.parameters
+            ],
+        }
+
+    def get_paginator(self, operation_name: str) -> "FakeSSM":
+        return self
+
+    def paginate(self, Path: str, **kwargs: Any) -> list[dict]:
+        return [
+            {
+                "Parameters": [
+                    {"Name": name, "Value": value}
+                    for name, value in self.parameters.items()
+                    if name.startswith(Path)
+                ]
+            }
+        ]
+
+
+class FakeS3:
+    def __init__(self, objects: dict[str, bytes]):
+        self.objects = objects
+        self._etags: dict[str, tuple[bytes, str]] = {}
+
+    def _get_response(
+        self, Key: str, Range: str | None = None, IfMatch: str | None = None
+    ) -> dict:
+        if Key not in self.objects:
+            raise _client_error("NoSuchKey", Key, "GetObject")
+
+        file_bytes = self.objects[Key]
+        cached_bytes, etag = self._etags.get(Key, (None, ""))
+
+        if cached_bytes is not file_bytes:
+            etag = f'"{hashlib.md5(file_bytes).hexdigest()}"'
+            self._etags[Key] = (file_bytes, etag)
+
+        if IfMatch is not None and IfMatch != etag:
+            raise _client_error("PreconditionFailed", Key, "GetObject")
+
+        response: dict[str, Any] = {"ETag": etag}
+
+        if Range is not None:
+            if len(file_bytes) == 0:
+                raise _client_error("InvalidRange", Key, "GetObject")
+
+            start, end = Range.removeprefix("bytes=").split("-")
+            end = min(int(end), len(file_bytes) - 1)
+            response["ContentRange"] = f"bytes {start}-{end}/{len(file_bytes)}"
+            file_bytes = file_bytes[int(start) : end + 1]
+
+        response["ContentLength"] = len(file_bytes)
+        response["Body"] = file_bytes
+
+        return response
+
+    def get_object(
+        self,
+        Bucket: str,
+        Key: str,
+        Range: str | None = None,
+        IfMatch: str | None = None,
+    ) -> dict:
+        response = self._get_response(Key, Range, IfMatch)
+        return dict(response, Body=io.BytesIO(response["Body"]))
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        return {"ContentLength": len(self._get_response(Key)["Body"])}
+
+
+class FakeSQS:
+    """
+    In-memory queue. Received messages stay in flight until deleted (no
+    visibility expiry), and receive/delete times are recorded per message
+    so the harness can compute message latency.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: list[dict] = []
+        self._in_flight: dict[str, dict] = {}
+        self.received_at: dict[str, float] = {}
+        self.deleted_at: dict[str, float] = {}
+        self.sent_at: dict[str, float] = {}
+        self.bodies: dict[str, str] = {}
+        self.failed_ids: set[str] = set()
+        self.sent_count = 0
+
+    def send(self, body: str) -> None:
+        with self._lock:
+            message_id = str(uuid.uuid4())
+            self._pending.append({"MessageId": message_id, "Body": body})
+            self.sent_at[message_id] = time.perf_counter()
+            self.bodies[message_id] = body
+            self.sent_count += 1
+
+    def receive_message(
+        self, QueueUrl: str, MaxNumberOfMessages: int = 1, **kwargs: Any
+    ) -> dict:
+        with self._lock:
+            if len(self._pending) == 0 and len(self._in_flight) == 0:
+                raise BenchFinished()
+
+            messages = self._pending[:MaxNumberOfMessages]
+            del self._pending[:MaxNumberOfMessages]
+
+            now = time.perf_counter()
+            received = []
+
+            for message in messages:
+                message = dict(message, ReceiptHandle=str(uuid.uuid4()))
+                self._in_flight[message["ReceiptHandle"]] = message
+                self.received_at.setdefault(message["MessageId"], now)
+                received.append(message)
+
+        if len(received) == 0:
+            # Stand-in for long polling while other messages are in flight.
+            time.sleep(0.05)
+            return {}
+
+        return {"Messages": received}
+
+    def _delete(self, ReceiptHandle: str) -> bool:
+        message = self._in_flight.pop(ReceiptHandle, None)
+
+        if message is None:
+            return False
+
+        self.deleted_at[message["MessageId"]] = time.perf_counter()
+        return True
+
+    def delete_message(self, QueueUrl: str, ReceiptHandle: str) -> dict:
+        with self._lock:
+            self._delete(ReceiptHandle)
+        return {}
+
+    def delete_message_batch(self, QueueUrl: str, Entries: list[dict]) -> dict:
+        with self._lock:
+            successful = [
+                {"Id": entry["Id"]}
+                for entry in Entries
+                if self._delete(entry["ReceiptHandle"])
+            ]
+
+        return {"Successful": successful, "Failed": []}
+
+    def mark_failed(self, ReceiptHandle: str) -> None:
+        """
+        Retires a message the service gave up on. Real SQS would redeliver it
+        after the visibility timeout; the benchmark counts it as failed.
+        """
+
+        with self._lock:
+            message = self._in_flight.pop(ReceiptHandle, None)
+
+            if message is not None:
+                self.failed_ids.add(message["MessageId"])
+
+    def change_message_visibility_batch(
+        self, QueueUrl: str, Entries: list[dict]
+    ) -> dict:
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+    def get_queue_attributes(self, QueueUrl: str, AttributeNames: list[str]) -> dict:
+        with self._lock:
+            return {
+                "Attributes": {
+                    "ApproximateNumberOfMessages": str(len(self._pending)),
+                    "ApproximateNumberOfMessagesNotVisible": str(len(self._in_flight)),
+                }
+            }
+
+
+class FakeAsyncBody:
+    def __init__(self, file_bytes: bytes):
+        self._stream = io.BytesIO(file_bytes)
+
+    async def __aenter__(self) -> "FakeAsyncBody":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        return None
+
+    async def read(self, amt: int | None = None) -> bytes:
+        return self._stream.read(amt)
+
+
+class FakeAsyncS3:
+    def __init__(self, s3: FakeS3):
+        self._s3 = s3
+
+    async def get_object(
+        self,
+        Bucket: str,
+        Key: str,
+        Range: str | None = None,
+        IfMatch: str | None = None,
+    ) -> dict:
+        response = self._s3._get_response(Key, Range, IfMatch)
+        return dict(response, Body=FakeAsyncBody(response["Body"]))
+
+    async def head_object(self, Bucket: str, Key: str) -> dict:
+        return self._s3.head_object(Bucket, Key)
+
+
+class FakeAsyncSES:
+    def __init__(self):
+        self.sent: list[dict] = []
+
+    async def send_email(self, **kwargs: Any) -> dict:
+        self.sent.append(kwargs)
+        return {"MessageId": str(uuid.uuid4())}
+
+
+class _AsyncClientContext:
+    def __init__(self, client: Any):
+        self._client = client
+
+    async def __aenter__(self) -> Any:
+        return self._client
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        return None
+
+
+class FakeAioSession:
+    def __init__(self, s3: FakeS3, ses: FakeAsyncSES):
+        self._clients = {"s3": FakeAsyncS3(s3), "ses": ses}
+
+    def client(self, service_name: str, **kwargs: Any) -> _AsyncClientContext:
+        return _AsyncClientContext(self._clients[service_name])
+
+
+class FakeMongoCollection:
+    async def find_one(self, query: dict, *args: Any, **kwargs: Any) -> dict:
+        return {"_id": query.get("_id"), "email": f"{query.get('_id')}@bench.local"}
+
+    def find(self, query: dict, *args: Any, **kwargs: Any) -> "FakeMongoCursor":
+        user_ids = query.get("_id", {}).get("$in", [])
+        return FakeMongoCursor(
+            [
+                {"_id": user_id, "email": f"{user_id}@bench.local"}
+                for user_id in user_ids
+            ]
+        )
+
+
+class FakeMongoCursor:
+    def __init__(self, documents: list[dict]):
+        self._documents = documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._documents:
+            yield document
+
+    async def to_list(self, length: int | None = None) -> list[dict]:
+        return list(self._documents)
+
+
+class FakeMongoDatabase:
+    def get_collection(self, name: str) -> FakeMongoCollection:
+        return FakeMongoCollection()
+
+
+class FakeMongoClient:
+    def __init__(self, *args: Any, **kwargs: Any):
+        pass
+
+    def get_database(self, name: str) -> FakeMongoDatabase:
+        return FakeMongoDatabase()
+
+
+class LockedQdrantClient:
+    """
+    Local-mode QdrantClient(":memory:") behind a lock, because local mode
+    isn't thread-safe and the service upserts from several threads. Missing
+    collections raise UnexpectedResponse 404 like a real server does.
+
+    Forked worker processes each get their own copy of the in-memory data.
+    Forks wait for the lock, so a thread of the parent (the spool flusher)
+    can't leave a child with a held lock or a half-written copy.
+    """
+
+    def __init__(self):
+        self._client = QdrantClient(":memory:")
+        self._lock = threading.RLock()
+
+        os.register_at_fork(
+            before=self._lock.acquire,
+            after_in_parent=self._lock.release,
+            after_in_child=self._lock.release,
+        )
+
+    def get_collection(self, collection_name: str) -> Any:
+        with self._lock:
+            if not self._client.collection_exists(collection_name):
+                raise UnexpectedResponse(
+                    404, "Not Found", b"collection not found", headers=None
+                )
+            return self._client.get_collection(collection_name)
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._client, name)
+
+        if not callable(attribute):
+            return attribute
+
+        def locked(*args: Any, **kwargs: Any) -> Any:
+            with self._lock:
+                return attribute(*args, **kwargs)
+
+        return locked
+
+
+class BenchEnvironment:
+    def __init__(self, objects: dict[str, bytes]):
+        self.s3 = FakeS3(objects)
+        self.sqs = FakeSQS()
+        self.ses = FakeAsyncSES()
+        self.qdrant = LockedQdrantClient()
+        self.ssm = FakeSSM(
+            {
+                "/alwayssaved/EMBEDDING_PUSH_QUEUE_URL": BENCH_QUEUE_URL,
+                "/alwayssaved/QDRANT_URL": "http://qdrant.bench.local:6333",
+                "/alwayssaved/QDRANT_API_KEY": "bench",
+                "/alwayssaved/MONGO_DB_USER": "bench",
+                "/alwayssaved/MONGO_DB_PASSWORD": "bench",
+                "/alwayssaved/MONGO_DB_BASE_URI": "mongo.bench.local",
+                "/alwayssaved/MONGO_DB_NAME": "alwayssaved",
+                "/alwayssaved/MONGO_DB_CLUSTER_NAME": "bench",
+            }
+        )
+
+
+def install_fakes(environment: BenchEnvironment) -> None:
+    """Routes boto3, aioboto3, Qdrant and MongoDB clients to the stand-ins."""
+
+    import aioboto3
+    import pymongo
+    import qdrant_client
+
+    fake_clients = {
+        "s3": environment.s3,
+        "sqs": environment.sqs,
+        "ssm": environment.ssm,
+    }
+
+    boto3.client = lambda service_name, *args, **kwargs: fake_clients[service_name]
+    aioboto3.Session = lambda *args, **kwargs: FakeAioSession(
+        environment.s3, environment.ses
+    )
+
+    # A class rather than a lambda, since the service uses QdrantClient in
+    # annotations like `QdrantClient | None`.
+    class QdrantClientStandIn:
+        def __new__(cls, *args: Any, **kwargs: Any) -> Any:
+            return environment.qdrant
+
+    pymongo.AsyncMongoClient = FakeMongoClient
+    qdrant_client.QdrantClient = QdrantClientStandIn
@@ -0,0 +1,291 @@
+"""
+Offline end-to-end benchmark of the embedding service.
+
+Runs the real service code against local stand-ins (bench/fakes.py) over a
+generated corpus and prints a JSON report: documents/sec, chunks/sec,
+per-stage time, peak RSS and message latency percentiles.
+
+    python -m bench.main --mode warm --documents 200 --output before.json
+
+--mode inline calls embed_and_upload() once per document in this process;
+every other mode sets EMBEDDING_EXECUTION_MODE and runs run_service() until
+the fake queue is drained. The embedding model is whatever EMBEDDING_MODEL
+points at, so it has to be available locally (or downloadable).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from bench.corpus import generate_corpus
+from bench.fakes import BenchEnvironment, BenchFinished, install_fakes
+from bench.timing import install_stage_timers, summarize_stages
+
+# Settings worth recording alongside the numbers.
+REPORTED_SETTINGS = [
+    "EMBEDDING_MODEL",
+    "EMBEDDING_BACKEND",
+    "EMBEDDING_CACHE_DIR",
+    "CHUNKER",
+    "PDF_EXTRACTION_BACKEND",
+    "PDF_EXTRACTION_WORKERS",
+    "HTML_EXTRACTION_BACKEND",
+    "TEXT_NORMALIZATION",
+    "S3_SPOOL_THRESHOLD_MB",
+    "SQS_MAX_MESSAGES",
+    "WORKER_POOL_SIZE",
+    "WORKER_TOPOLOGY",
+    "WORKER_CPUS",
+    "EMBEDDING_PRELOAD_MODEL",
+    "EMBED_MAX_BATCH_SIZE",
+    "EMBED_STREAM_BATCH_CHUNKS",
+    "AUTOSCALE_ENABLED",
+    "SCHEDULING_POLICY",
+    "CHUNK_DEDUP",
+    "CHUNK_DEDUP_THRESHOLD",
+    "QDRANT_UPSERT_BATCH_SIZE",
+    "QDRANT_SPOOL_DIR",
+]
+
+
+# Owner of every --heavy-documents document.
+HEAVY_USER_ID = "f" * 24
+
+
+def build_messages(
+    corpus: dict[str, bytes], heavy_keys: frozenset[str] = frozenset()
+) -> list[dict]:
+    messages = []
+
+    for index, s3_key in enumerate(corpus):
+        messages.append(
+            {
+                "note_id": f"{index:024x}",
+                "user_id": HEAVY_USER_ID
+                if s3_key in heavy_keys
+                else f"{index % 50:024x}",
+                "file_id": f"{index + 10**6:024x}",
+                "transcript_s3_key": s3_key,
+                "original_filename": os.path.basename(s3_key),
+            }
+        )
+
+    return messages
+
+
+def run_inline(messages: list[dict]) -> tuple[list[float], int]:
+    """Returns (per-message latencies in seconds, failed count)."""
+
+    from services.embedding.main import embed_and_upload
+    from services.embedding.utils.main import get_embedd_model
+    from services.qdrant.main import create_qdrant_collection, get_qdrant_client
+
+    embedding_model = get_embedd_model()
+    qdrant_client = get_qdrant_client()
+    create_qdrant_collection(
+        qdrant_client, embedding_model.get_sentence_embedding_dimension()
+    )
+
+    latencies = []
+    failed = 0
+
+    for index, message in enumerate(messages):
+        sqs_payload = dict(message, message_id=str(index), sqs_receipt_handle="")
+
+        started = time.perf_counter()
+        embed_status = embed_and_upload(
+            sqs_payload, embedding_model=embedding_model, qdrant_client=qdrant_client
+        )
+        latencies.append(time.perf_counter() - started)
+
+        if embed_status["process_status"] != "complete":
+            failed += 1
+
+    return latencies, failed
+
+
+def run_service_mode(
+    environment: BenchEnvironment, execution_mode: str
+) -> tuple[list[float], int]:
+    os.environ["EMBEDDING_EXECUTION_MODE"] = execution_mode
+
+    import service
+
+    handle_embed_results = service.handle_embed_results
+
+    async def handle_and_retire_failures(ses_client, raw_results):
+        for result in raw_results:
+            if result.get("process_status") != "complete":
+                environment.sqs.mark_failed(result.get("sqs_receipt_handle", ""))
+
+        await handle_embed_results(ses_client, raw_results)
+
+    service.handle_embed_results = handle_and_retire_failures
+
+    try:
+        asyncio.run(service.run_service())
+    except BenchFinished:
+        pass
+
+    sqs = environment.sqs
+    latencies = [
+        sqs.deleted_at[message_id] - sqs.received_at[message_id]
+        for message_id in sqs.deleted_at
+    ]
+
+    return latencies, len(sqs.failed_ids)
+
+
+def get_latency_percentiles(latencies: list[float]) -> dict[str, float]:
+    latencies_ms = np.array(latencies or [0.0]) * 1000
+
+    return {
+        "p50": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p95": round(float(np.percentile(latencies_ms, 95)), 2),
+        "p99": round(float(np.percentile(latencies_ms, 99)), 2),
+        "max": round(float(latencies_ms.max()), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--mode",
+        default="inline",
+        choices=["inline", "fresh", "warm", "batched", "pipeline"],
+    )
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument(
+        "--words", type=int, default=2000, help="mean words per document"
+    )
+    parser.add_argument("--formats", default="txt,pdf,html")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--heavy-documents",
+        type=int,
+        default=0,
+        help="extra large documents from one user, queued ahead of the rest",
+    )
+    parser.add_argument(
+        "--heavy-words", type=int, default=20000, help="mean words per heavy document"
+    )
+    parser.add_argument(
+        "--boilerplate",
+        type=float,
+        default=0.0,
+        help="share of each document made of near-identical copies of one shared block",
+    )
+    parser.add_argument(
+        "--output", default="", help="also write the report to this file"
+    )
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    os.environ.setdefault("AWS_BUCKET", "alwayssaved-bench")
+
+    corpus = generate_corpus(
+        args.documents,
+        args.words,
+        args.formats.split(","),
+        args.seed,
+        boilerplate_share=args.boilerplate,
+    )
+    heavy_corpus = generate_corpus(
+        args.heavy_documents,
+        args.heavy_words,
+        args.formats.split(","),
+        args.seed + 1,
+        key_prefix="bench-heavy",
+    )
+    corpus = {**heavy_corpus, **corpus}
+    messages = build_messages(corpus, frozenset(heavy_corpus))
+
+    environment = BenchEnvironment(corpus)
+    install_fakes(environment)
+
+    stage_log_path = os.path.join(
+        tempfile.mkdtemp(prefix="alwayssaved-bench-"), "stages.jsonl"
+    )
+    install_stage_timers(stage_log_path)
+
+    for message in messages:
+        environment.sqs.send(json.dumps(message))
+
+    started = time.perf_counter()
+
+    if args.mode == "inline":
+        latencies, failed = run_inline(messages)
+    else:
+        latencies, failed = run_service_mode(environment, args.mode)
+
+    elapsed = time.perf_counter() - started
+
+    from services.metrics.startup import get_startup_summary
+    from services.scheduling.main import get_size_class, get_size_class_bounds
+
+    stages, chunk_count, embedded_count = summarize_stages(stage_log_path)
+
+    # Enqueue-to-delete time per size class (the same classes as the
+    # service's embedding_completion_seconds). Unlike message latency, this
+    # includes the wait in the queue, which is what scheduling changes.
+    small_mb, large_mb = get_size_class_bounds()
+    completions_by_size_class: dict[str, list[float]] = {}
+    sqs = environment.sqs
+
+    for message_id, deleted_at in sqs.deleted_at.items():
+        s3_key = json.loads(sqs.bodies[message_id])["transcript_s3_key"]
+        size_class = get_size_class(len(corpus[s3_key]), small_mb, large_mb)
+        completions_by_size_class.setdefault(size_class, []).append(
+            deleted_at - sqs.sent_at[message_id]
+        )
+
+    report = {
+        "mode": args.mode,
+        "documents": len(messages),
+        "completed": len(messages) - failed,
+        "failed": failed,
+        "formats": args.formats.split(","),
+        "mean_words_per_document": args.words,
+        "corpus_mb": round(sum(map(len, corpus.values())) / 1024**2, 2),
+        "elapsed_seconds": round(elapsed, 3),
+        "documents_per_second": round(len(messages) / elapsed, 3),
+        "chunks": chunk_count,
+        "chunks_per_second": round(chunk_count / elapsed, 3),
+        "embedded_chunks": embedded_count,
+        "stages": stages,
+        "peak_rss_mb": {
+            "service_process": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+            ),
+            "largest_child_process": round(
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1
+            ),
+        },
+        "message_latency_ms": get_latency_percentiles(latencies),
+        "completion_ms_by_size_class": {
+            size_class: dict(
+                get_latency_percentiles(completions), count=len(completions)
+            )
+            for size_class, completions in sorted(completions_by_size_class.items())
+        },
+        "startup": get_startup_summary(),
+        "emails_sent": len(environment.ses.sent),
+        "settings": {name: os.getenv(name, "") for name in REPORTED_SETTINGS},
+    }
+
+    report_json = json.dumps(report, indent=2)
+    print(report_json)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            report_file.write(report_json + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Per-stage timers patched over the service's stage functions.
+
+Every timed call appends one JSON line to a shared log file (O_APPEND, one
+small write per record), so forked worker processes report into the same
+place as the service process.
+"""
+
+import functools
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Any, Callable, Iterator
+
+_stage_log_path = ""
+
+
+def record_stage(stage: str, seconds: float, items: int = 0) -> None:
+    if not _stage_log_path:
+        return
+
+    line = json.dumps({"stage": stage, "seconds": seconds, "items": items}) + "\n"
+    log_fd = os.open(_stage_log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    try:
+        os.write(log_fd, line.encode("utf-8"))
+    finally:
+        os.close(log_fd)
+
+
+def timed(function: Callable, stage: str, count_first_arg: bool = False) -> Callable:
+    """count_first_arg records len() of the first argument as the call's items."""
+
+    @functools.wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            items = len(args[0]) if count_first_arg and args else 0
+            record_stage(stage, time.perf_counter() - started, items)
+
+    return wrapper
+
+
+def timed_async(function: Callable, stage: str) -> Callable:
+    @functools.wraps(function)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            record_stage(stage, time.perf_counter() - started)
+
+    return wrapper
+
+
+def timed_iter(function: Callable, stage: str) -> Callable:
+    """Times only the work done inside the generator and counts its items."""
+
+    @functools.wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> Iterator:
+        iterator = iter(function(*args, **kwargs))
+        seconds = 0.0
+        items = 0
+
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - started
+
+                items += 1
+                yield item
+        finally:
+            record_stage(stage, seconds, items)
+
+    return wrapper
+
+
+def install_stage_timers(stage_log_path: str) -> None:
+    global _stage_log_path
+
+    _stage_log_path = stage_log_path
+
+    import services.embedding.main as embedding_main
+    import services.pipeline.main as pipeline_main
+
+    # PDF pages are extracted lazily while the chunker pulls them, so for
+    # the non-pipeline modes extraction is part of "extract_and_chunk".
+    embedding_main.download_file_from_s3 = timed(
+        embedding_main.download_file_from_s3, "download"
+    )
+    embedding_main.iter_chunks = timed_iter(
+        embedding_main.iter_chunks, "extract_and_chunk"
+    )
+    embedding_main.get_file_point_ids = timed(
+        embedding_main.get_file_point_ids, "qdrant_lookup"
+    )
+    embedding_main.encode_chunks = timed(
+        embedding_main.encode_chunks, "embed", count_first_arg=True
+    )
+    # The pipeline's upload stage goes through store_chunks() too.
+    embedding_main.upload_chunks = timed(embedding_main.upload_chunks, "upload")
+    embedding_main.spool_pending_upload = timed(
+        embedding_main.spool_pending_upload, "spool"
+    )
+
+    pipeline = pipeline_main.EmbeddingPipeline
+    pipeline._download = timed_async(pipeline._download, "download")
+    pipeline._extract = timed_async(pipeline._extract, "extract")
+    pipeline_main.iter_chunks = timed_iter(pipeline_main.iter_chunks, "chunk")
+
+
+def summarize_stages(stage_log_path: str) -> tuple[dict[str, dict], int, int]:
+    """Returns ({stage: totals}, chunks produced, chunks sent to encode)."""
+
+    totals: dict[str, dict] = defaultdict(lambda: {"calls": 0, "total_seconds": 0.0})
+    chunk_count = 0
+    embedded_count = 0
+
+    if not os.path.exists(stage_log_path):
+        return {}, 0, 0
+
+    with open(stage_log_path, encoding="utf-8") as stage_log:
+        for line in stage_log:
+            record = json.loads(line)
+            stage_totals = totals[record["stage"]]
+            stage_totals["calls"] += 1
+            stage_totals["total_seconds"] += record["seconds"]
+
+            if record["stage"] in ("extract_and_chunk", "chunk"):
+                chunk_count += record["items"]
+            elif record["stage"] == "embed":
+                embedded_count += record["items"]
+
+    all_seconds = sum(stage["total_seconds"] for stage in totals.values()) or 1.0
+
+    summary = {
+        stage: {
+            "calls": stage_totals["calls"],
+            "total_seconds": round(stage_totals["total_seconds"], 4),
+            "mean_ms": round(
+                1000 * stage_totals["total_seconds"] / stage_totals["calls"], 3
+            ),
+            "share": round(stage_totals["total_seconds"] / all_seconds, 4),
+        }
+        for stage, stage_totals in totals.items()
+    }
+
+    return summary, chunk_count, embedded_count
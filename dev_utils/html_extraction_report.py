@@ -0,0 +1,113 @@
+"""
+Speed and output-size report for the HTML extraction backends.
+
+Extracts every given saved page (or a generated one) with each
+HTML_EXTRACTION_BACKEND and reports the median time, throughput, and how
+much text and how many fixed-size chunks come out of it.
+
+    python -m dev_utils.html_extraction_report saved_pages/*.html --repeat 5
+    python -m dev_utils.html_extraction_report --generate-mb 20
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+from bench.corpus import generate_paragraphs
+from services.embedding.utils.main import chunk_text
+from services.extraction.html_text import extract_html_text
+
+REPORT_BACKENDS = ("bs4", "html.parser", "lxml")
+
+
+def generate_saved_page(target_mb: float, seed: int = 0) -> bytes:
+    """
+    A page shaped like a saved article: indented markup, inline scripts
+    and styles, a navigation menu, and nested divs and inline markup
+    around the paragraphs.
+    """
+
+    rng = random.Random(seed)
+    script = "var config = " + json.dumps({f"k{i}": "x" * 40 for i in range(200)})
+    style = " ".join(f".c{i} {{ margin: {i}px; color: #{i:06x} }}" for i in range(300))
+    menu = "".join(f'<li><a href="/p/{i}">Section {i}</a></li>' for i in range(60))
+
+    parts = [
+        f"<!DOCTYPE html><html><head><title>Saved page</title><style>{style}</style>"
+        f"<script>{script}</script></head><body><nav><ul>{menu}</ul></nav>"
+    ]
+    size = len(parts[0])
+
+    while size < target_mb * 1024**2:
+        paragraphs = "".join(
+            f'\n        <div class="c{rng.randrange(300)}">\n            <p>\n                {paragraph.replace(". ", ". <span>", 1)}</span>\n            </p>\n        </div>'
+            for paragraph in generate_paragraphs(rng, 400)
+        )
+        section = f"\n    <section>\n        <h2>Part</h2>{paragraphs}\n        <script>{script}</script>\n    </section>"
+        parts.append(section)
+        size += len(section)
+
+    parts.append(f"<footer><ul>{menu}</ul></footer></body></html>")
+
+    return "".join(parts).encode("utf-8")
+
+
+def run_report(pages: dict[str, bytes], repeat: int) -> list[dict]:
+    report = []
+
+    for name, page in pages.items():
+        for backend in REPORT_BACKENDS:
+            os.environ["HTML_EXTRACTION_BACKEND"] = backend
+            timings = []
+
+            for _ in range(repeat):
+                started = time.perf_counter()
+                text = extract_html_text(page)
+                timings.append(time.perf_counter() - started)
+
+            seconds = statistics.median(timings)
+            row = {
+                "page": name,
+                "backend": backend,
+                "page_mb": round(len(page) / 1024**2, 2),
+                "median_seconds": round(seconds, 4),
+                "mb_per_second": round(len(page) / 1024**2 / seconds, 2),
+                "text_chars": len(text),
+                "char_chunks": len(chunk_text(text)),
+            }
+            report.append(row)
+            print(f"✅ {json.dumps(row)}")
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pages", nargs="*", help="saved .html files")
+    parser.add_argument(
+        "--generate-mb",
+        type=float,
+        default=10.0,
+        help="size of the generated page used when no pages are given",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = {}
+
+        for path in args.pages:
+            with open(path, "rb") as page_file:
+                pages[os.path.basename(path)] = page_file.read()
+    else:
+        pages = {"generated": generate_saved_page(args.generate_mb)}
+
+    report = run_report(pages, max(1, args.repeat))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2)
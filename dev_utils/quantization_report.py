@@ -0,0 +1,228 @@
+"""
+Recall-vs-memory report for Qdrant collection settings.
+
+Copies a sample of real points (vectors + payloads) from the production
+collection into one temporary collection per setting, then runs the same
+queries against each and compares the top-k results with exact search on
+the float32 baseline. The queries are held-out points of the sample that
+aren't indexed, so no query finds itself as its own nearest neighbour.
+Temporary collections are dropped at the end.
+
+    python -m dev_utils.quantization_report --sample 20000 --queries 200
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from qdrant_client import QdrantClient, models
+
+from services.qdrant.main import (
+    QDRANT_COLLECTION_NAME,
+    get_qdrant_client,
+    get_quantization_config,
+)
+from services.qdrant.writer import QdrantBatchWriter
+
+HNSW_M = 16
+
+# name -> (quantization, originals on disk, search-time quantization params)
+REPORT_SETTINGS = {
+    "float32_ram": ("none", False, None),
+    "float32_disk": ("none", True, None),
+    "scalar_int8": (
+        "scalar",
+        True,
+        models.QuantizationSearchParams(rescore=True, oversampling=1.5),
+    ),
+    "binary": (
+        "binary",
+        True,
+        models.QuantizationSearchParams(rescore=True, oversampling=3.0),
+    ),
+}
+
+
+def sample_points(
+    q_client: QdrantClient, sample_size: int
+) -> tuple[list[str], np.ndarray, list[dict]]:
+    ids, vectors, payloads = [], [], []
+    offset = None
+
+    while len(ids) < sample_size:
+        records, offset = q_client.scroll(
+            collection_name=QDRANT_COLLECTION_NAME,
+            limit=min(1000, sample_size - len(ids)),
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+
+        for record in records:
+            ids.append(str(record.id))
+            vectors.append(record.vector)
+            payloads.append(record.payload or {})
+
+        if offset is None:
+            break
+
+    return ids, np.asarray(vectors, dtype=np.float32), payloads
+
+
+def estimate_ram_bytes(point_count: int, dimension: int, setting: str) -> int:
+    quantization, on_disk, _ = REPORT_SETTINGS[setting]
+
+    if quantization == "scalar":
+        vector_bytes = dimension
+    elif quantization == "binary":
+        vector_bytes = dimension / 8
+    else:
+        vector_bytes = 0 if on_disk else dimension * 4
+
+    # HNSW level-0 links: 2 * m neighbour ids (u32) per point.
+    return int(point_count * (vector_bytes + 2 * HNSW_M * 4))
+
+
+def wait_until_indexed(q_client: QdrantClient, collection_name: str) -> None:
+    while True:
+        info = q_client.get_collection(collection_name=collection_name)
+        if info.status == models.CollectionStatus.GREEN:
+            return
+        time.sleep(1)
+
+
+def search_ids(
+    q_client: QdrantClient,
+    collection_name: str,
+    query: np.ndarray,
+    limit: int,
+    search_params: models.SearchParams,
+) -> list[str]:
+    response = q_client.query_points(
+        collection_name=collection_name,
+        query=query.tolist(),
+        limit=limit,
+        search_params=search_params,
+        with_payload=False,
+    )
+
+    return [str(point.id) for point in response.points]
+
+
+def run_report(sample_size: int, query_count: int, top_k: int) -> list[dict]:
+    q_client = get_qdrant_client()
+
+    if q_client is None:
+        raise ValueError("Qdrant client could not be instantiated.")
+
+    sampled_ids, sampled_vectors, sampled_payloads = sample_points(
+        q_client, sample_size + query_count
+    )
+    dimension = sampled_vectors.shape[1]
+
+    # At most half the sample is held out, so a small collection still
+    # leaves something to search.
+    rng = np.random.default_rng(0)
+    query_positions = rng.choice(
+        len(sampled_ids), min(query_count, len(sampled_ids) // 2), replace=False
+    )
+    held_out = np.zeros(len(sampled_ids), dtype=bool)
+    held_out[query_positions] = True
+
+    queries = sampled_vectors[held_out]
+    ids = [point_id for point_id, out in zip(sampled_ids, held_out) if not out]
+    vectors = sampled_vectors[~held_out]
+    payloads = [payload for payload, out in zip(sampled_payloads, held_out) if not out]
+
+    print(
+        f"✅ Sampled {len(ids)} points ({dimension} dims), {len(queries)} held-out queries"
+    )
+
+    ground_truth: list[list[str]] = []
+    report = []
+
+    try:
+        for setting, (
+            quantization,
+            on_disk,
+            quantization_params,
+        ) in REPORT_SETTINGS.items():
+            collection_name = f"{QDRANT_COLLECTION_NAME}__report_{setting}"
+
+            if q_client.collection_exists(collection_name):
+                q_client.delete_collection(collection_name)
+
+            q_client.create_collection(
+                collection_name=collection_name,
+                vectors_config=models.VectorParams(
+                    size=dimension, distance=models.Distance.COSINE, on_disk=on_disk
+                ),
+                hnsw_config=models.HnswConfigDiff(m=HNSW_M),
+                quantization_config=get_quantization_config(quantization),
+            )
+
+            QdrantBatchWriter(q_client, collection_name).write(ids, vectors, payloads)
+            wait_until_indexed(q_client, collection_name)
+
+            if len(ground_truth) == 0:
+                ground_truth = [
+                    search_ids(
+                        q_client,
+                        collection_name,
+                        query,
+                        top_k,
+                        models.SearchParams(exact=True),
+                    )
+                    for query in queries
+                ]
+
+            recalls, latencies = [], []
+
+            for query, expected_ids in zip(queries, ground_truth):
+                started = time.perf_counter()
+                found_ids = search_ids(
+                    q_client,
+                    collection_name,
+                    query,
+                    top_k,
+                    models.SearchParams(quantization=quantization_params),
+                )
+                latencies.append((time.perf_counter() - started) * 1000)
+                recalls.append(len(set(found_ids) & set(expected_ids)) / top_k)
+
+            row = {
+                "setting": setting,
+                f"recall_at_{top_k}": round(statistics.mean(recalls), 4),
+                "p50_latency_ms": round(statistics.median(latencies), 2),
+                "estimated_ram_mb": round(
+                    estimate_ram_bytes(len(ids), dimension, setting) / 1024**2, 2
+                ),
+            }
+            report.append(row)
+            print(f"✅ {json.dumps(row)}")
+
+    finally:
+        for setting in REPORT_SETTINGS:
+            q_client.delete_collection(f"{QDRANT_COLLECTION_NAME}__report_{setting}")
+
+    return report
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sample", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    results = run_report(args.sample, args.queries, args.top_k)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            json.dump(results, report_file, indent=2)
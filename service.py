@@ -4,33 +4,85 @@ import os
 import time
 import traceback
 from concurrent.futures import ProcessPoolExecutor
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
 import aioboto3
 from dotenv import load_dotenv
 
-from services.aws.ses import send_user_email_notification
+from services.autoscaling.main import QueueAutoscaler, create_autoscaler
+from services.aws.ses import send_user_notifications
+from services.aws.ssm import prefetch_service_secrets
 from services.aws.sqs import (
+    SQS_BATCH_LIMIT,
+    WAIT_TIME,
+    create_visibility_heartbeat,
     delete_embedding_sqs_message,
     get_messages_from_extractor_service,
+    get_receive_batch_size,
     process_incoming_sqs_messages,
 )
 from services.embedding.main import embed_and_upload
+from services.embedding.scheduler import EmbeddingScheduler, create_embedding_scheduler
+from services.embedding.utils.main import (
+    get_embedd_model,
+    get_embedd_model_dimension,
+    import_embedding_modules,
+    preload_embedd_model,
+)
+from services.metrics.main import (
+    flush_metrics,
+    get_metrics_queue,
+    increment,
+    init_metrics_worker,
+    remove_gauges,
+    start_metrics_server,
+)
+from services.metrics.startup import mark_startup_phase, report_startup
+from services.pipeline.main import (
+    EmbeddingPipeline,
+    create_extract_executor,
+    create_pipeline,
+)
 from services.qdrant.main import (
     create_qdrant_collection,
+    get_collection_vector_size,
     get_qdrant_client,
     get_qdrant_collection,
+    get_qdrant_secret_generation,
+    refresh_qdrant_client,
 )
+from services.qdrant.spool import create_spool_flusher
+from services.query.main import (
+    get_query_threads,
+    is_query_endpoint_enabled,
+    lower_ingestion_priority,
+    start_query_server,
+)
+from services.scheduling.main import create_message_scheduler
 from services.utils.mongodb.main import create_mongodb_instance
-from services.utils.types.main import EmbedStatus
+from services.utils.types.main import EmbedStatus, SQSPayload, WorkerTopology
+from services.workers.main import (
+    BatchedEmbeddingRunner,
+    WarmWorkerPool,
+    create_batched_runner,
+    create_worker_pool,
+)
+from services.workers.topology import (
+    apply_thread_limits,
+    create_slot_counter,
+    init_topology_worker,
+    plan_worker_topology,
+)
 
-load_dotenv()
+mark_startup_phase("imports")
 
-qdrant_client = get_qdrant_client()
+load_dotenv()
 
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 
 if TYPE_CHECKING:
+    from pymongo import AsyncMongoClient
+    from qdrant_client import QdrantClient
     from types_aiobotocore_ses.client import SESClient
 
 # aioboto3 clients are async context managers, not plain objects you can
@@ -41,27 +93,131 @@ if TYPE_CHECKING:
 # where it's opened once and held open for the lifetime of the service loop.
 aws_session = aioboto3.Session()
 
-mongo_client = create_mongodb_instance()
+# Set by init_service_clients(). Extraction workers are started with
+# forkserver and import this module as __mp_main__, so nothing at module
+# level may call SSM, Qdrant or MongoDB.
+qdrant_client: "QdrantClient | None" = None
+qdrant_secret_generation = 0
+mongo_client: "AsyncMongoClient | None" = None
+
+# Keeps every received-but-unfinished SQS message invisible while it's being
+# processed, so SQS_VISIBILITY_TIMEOUT can stay short.
+visibility_heartbeat = create_visibility_heartbeat()
+
+# Uploads spooled points to Qdrant when QDRANT_SPOOL_DIR is set.
+spool_flusher = create_spool_flusher()
+
+# Reorders received messages by user and document size when
+# SCHEDULING_POLICY is set.
+message_scheduler = create_message_scheduler()
+
+
+def init_service_clients() -> None:
+    global qdrant_client, qdrant_secret_generation, mongo_client
+
+    # One bulk SSM call up front; everything below (and every forked worker)
+    # reads its secrets from the TTL cache instead of calling SSM per use.
+    prefetch_service_secrets()
+
+    mark_startup_phase("secrets")
+
+    qdrant_client = get_qdrant_client()
+    qdrant_secret_generation = get_qdrant_secret_generation()
+
+    mongo_client = create_mongodb_instance()
+
+    mark_startup_phase("clients")
+
+
+def init_fresh_worker(
+    metrics_queue: Any, topology: WorkerTopology, slot_counter: Any
+) -> None:
+    init_metrics_worker(metrics_queue)
+    lower_ingestion_priority()
+    init_topology_worker(topology, slot_counter)
 
 
 def executor_worker(json_payload: str) -> EmbedStatus:
     payload_dict = json.loads(json_payload)
-    return embed_and_upload(payload_dict)
+    embed_status = embed_and_upload(payload_dict)
+
+    flush_metrics()
+
+    return embed_status
+
+
+def embed_sqs_batch(
+    json_payloads: list[str],
+    worker_pool: WarmWorkerPool | BatchedEmbeddingRunner | None,
+    max_workers: int | None = None,
+) -> list[EmbedStatus]:
+
+    # EMBEDDING_EXECUTION_MODE=warm|batched keeps the model loaded between batches.
+    if worker_pool is not None:
+        return worker_pool.map_payloads(json_payloads)
+
+    topology = plan_worker_topology(max_workers)
+
+    # Ensures Fresh Worker Processes Each Batch
+    with ProcessPoolExecutor(
+        max_workers=topology["processes"],
+        initializer=init_fresh_worker,
+        initargs=(get_metrics_queue(), topology, create_slot_counter()),
+    ) as executor:
+        raw_results = list(executor.map(executor_worker, json_payloads))
+
+    remove_gauges("embedding_process_rss_bytes")
+    remove_gauges("embedding_process_private_bytes")
+
+    return raw_results
 
 
-# TODO: Pass entire payload to send_user_email_notification
 async def process_successful_results(
     ses_client: "SESClient", successful_results: list[EmbedStatus]
 ):
-    tasks = [
-        send_user_email_notification(ses_client, mongo_client, result)
-        for result in successful_results
-    ]
-    await asyncio.gather(*tasks)
+    # One email per user, listing every file of theirs in this batch.
+    await send_user_notifications(ses_client, mongo_client, successful_results)
+
+
+def prepare_worker_parent() -> None:
+    """
+    Fresh and warm workers are forked from this process and inherit what it
+    has already imported or loaded. With EMBEDDING_PRELOAD_MODEL=true the
+    model is loaded here once and shared copy-on-write; otherwise only torch
+    and sentence-transformers are imported, so no worker imports them again.
+    The query endpoint needs the model here anyway, so it implies a preload.
+    """
+
+    preload = os.getenv("EMBEDDING_PRELOAD_MODEL", "false").strip().lower() == "true"
+
+    if preload or is_query_endpoint_enabled():
+        if preload_embedd_model() is not None:
+            mark_startup_phase("model_preload")
+            return
+
+    import_embedding_modules()
+    mark_startup_phase("embedding_imports")
 
 
 async def run_service():
 
+    init_service_clients()
+
+    # Started before any worker pool exists, since pools are handed its queue.
+    start_metrics_server()
+
+    execution_mode = os.getenv("EMBEDDING_EXECUTION_MODE", "fresh").strip().lower()
+
+    # Before the dimension lookup below, whose child process then inherits
+    # the imports (or isn't needed with a preloaded model). Pipeline mode
+    # imports torch only after starting its extraction pool; set
+    # EMBEDDING_DIMENSION there to skip the lookup.
+    if execution_mode in ("fresh", "warm"):
+        prepare_worker_parent()
+    elif execution_mode == "batched":
+        import_embedding_modules()
+        mark_startup_phase("embedding_imports")
+
     # ✅ Validate Qdrant client and collection once before entering loop
     if qdrant_client is None:
         print(
@@ -69,7 +225,9 @@ async def run_service():
         )
         return
 
-    create_qdrant_collection(qdrant_client)
+    embedding_dimension = get_embedd_model_dimension()
+
+    create_qdrant_collection(qdrant_client, embedding_dimension)
 
     collection_info = get_qdrant_collection(qdrant_client)
 
@@ -79,12 +237,207 @@ async def run_service():
         )
         return
 
+    collection_vector_size = get_collection_vector_size(collection_info)
+
+    # A different vector size can't be migrated in place; it needs a new
+    # collection (QDRANT_COLLECTION_NAME) and a re-index.
+    if collection_vector_size != embedding_dimension:
+        print(
+            f"❌ App fails preliminary check where Qdrant collection vector size {collection_vector_size} doesn't match embedding model dimension {embedding_dimension}. Exiting."
+        )
+        return
+
     if mongo_client is None:
         print(
             "❌ App fails final preliminary check where the MongoDB client could not be instantiated. Exiting."
         )
         return
 
+    mark_startup_phase("preliminary_checks")
+
+    print(f"✅ Embedding execution mode: {execution_mode}")
+
+    visibility_heartbeat.start()
+
+    if spool_flusher is not None:
+        spool_flusher.start()
+
+    try:
+        if execution_mode == "pipeline":
+            await run_pipeline_service()
+        else:
+            await run_pool_service(execution_mode)
+    finally:
+        if spool_flusher is not None:
+            spool_flusher.stop()
+
+        visibility_heartbeat.stop()
+
+
+def create_query_scheduler() -> EmbeddingScheduler:
+    """
+    Fresh and warm modes encode in worker processes, so query embeddings get
+    their own EmbeddingScheduler over this process's (preloaded) model. It
+    is capped at QUERY_EMBEDDING_THREADS, 1 by default, which leaves the
+    CPUs to the workers and keeps torch in this process safe to fork from.
+    """
+
+    apply_thread_limits(get_query_threads())
+
+    return create_embedding_scheduler(get_embedd_model())
+
+
+async def run_pool_service(execution_mode: str):
+
+    worker_pool: WarmWorkerPool | BatchedEmbeddingRunner | None = None
+    query_scheduler: EmbeddingScheduler | None = None
+
+    if execution_mode == "batched":
+        worker_pool = create_batched_runner()
+    elif is_query_endpoint_enabled():
+        query_scheduler = create_query_scheduler()
+
+    if execution_mode == "warm":
+        worker_pool = create_worker_pool()
+        worker_pool.start()
+
+    query_server = None
+
+    # In batched mode queries share the runner's scheduler, and with it
+    # its encode() calls, ahead of the messages' chunks.
+    if isinstance(worker_pool, BatchedEmbeddingRunner):
+        query_server = start_query_server(worker_pool.embedding_scheduler)
+    elif query_scheduler is not None:
+        query_server = start_query_server(query_scheduler)
+
+    mark_startup_phase("worker_pool")
+
+    try:
+        await run_service_loop(worker_pool, create_autoscaler())
+    finally:
+        if query_server is not None:
+            query_server.shutdown()
+
+        if worker_pool is not None:
+            worker_pool.shutdown()
+
+        if query_scheduler is not None:
+            query_scheduler.stop()
+
+
+async def handle_embed_results(
+    ses_client: "SESClient", raw_results: list[EmbedStatus]
+) -> None:
+    for result in raw_results:
+        increment("embedding_messages_total", status=result.get("process_status"))
+
+    # Messages whose points are still in the write-ahead spool stay in
+    # flight until the flusher has them in Qdrant; release_flushed_results()
+    # finishes them then.
+    if spool_flusher is not None:
+        raw_results = spool_flusher.hold(raw_results)
+
+    if len(raw_results) > 0:
+        await finish_embed_results(ses_client, raw_results)
+
+
+async def release_flushed_results(ses_client: "SESClient") -> None:
+    if spool_flusher is None:
+        return
+
+    flushed_results = spool_flusher.take_flushed()
+
+    if len(flushed_results) > 0:
+        await finish_embed_results(ses_client, flushed_results)
+
+
+async def finish_embed_results(
+    ses_client: "SESClient", raw_results: list[EmbedStatus]
+) -> None:
+    # Finished messages are either deleted below or left for SQS to retry;
+    # either way they no longer need their visibility extended.
+    visibility_heartbeat.untrack(raw_results)
+
+    if message_scheduler is not None:
+        message_scheduler.record_completion(raw_results)
+
+    successful_results = [
+        res for res in raw_results if res.get("process_status") == "complete"
+    ]
+
+    # 3) Delete Successfully Embedded/Uploaded Messages From SQS.
+    if len(successful_results) == 0:
+        # Transcription embedding failed -> Don't delete -> Let SQS retry.
+        for failed_result in raw_results:
+            print(
+                f"❌ Transcript embedding failed for sqs_payload with message_id of {failed_result.get('message_id')} — skipping deletion."
+            )
+
+    else:
+        print("Start deleting successfully process messages from Embedding Push Queue.")
+        delete_embedding_sqs_message(successful_results)
+
+        # 4) Fire an SES Email For Each User With Successful Embedd/Upload Messages.
+        await process_successful_results(ses_client, successful_results)
+
+
+def receive_messages(max_messages: int | None = None) -> list[SQSPayload]:
+    """
+    Returns the next messages to process: straight from SQS, or with a
+    message scheduler, up to max_messages of the messages it holds, in its
+    order, after topping it up from SQS.
+    """
+
+    if message_scheduler is None:
+        return process_incoming_sqs_messages(
+            get_messages_from_extractor_service(max_messages)
+        )
+
+    capacity = message_scheduler.capacity()
+
+    if capacity > 0:
+        # Long polling would hold up messages that are already waiting.
+        sqs_payload = get_messages_from_extractor_service(
+            min(SQS_BATCH_LIMIT, capacity),
+            wait_seconds=0 if message_scheduler.queued_count > 0 else WAIT_TIME,
+        )
+        sqs_msg_list = process_incoming_sqs_messages(sqs_payload)
+
+        if len(sqs_msg_list) > 0:
+            # Tracked from receipt on, since they may wait here a while.
+            visibility_heartbeat.track(sqs_msg_list)
+            message_scheduler.add(sqs_msg_list)
+
+    return message_scheduler.take(max_messages or get_receive_batch_size())
+
+
+def apply_scaling_decision(
+    autoscaler: QueueAutoscaler | None,
+    worker_pool: WarmWorkerPool | BatchedEmbeddingRunner | None,
+) -> int | None:
+    """Resizes the pool to the autoscaler's worker count; returns that count."""
+
+    if autoscaler is None:
+        return None
+
+    decision = autoscaler.decide()
+
+    if worker_pool is not None:
+        worker_pool.resize(decision["workers"])
+
+    if isinstance(worker_pool, BatchedEmbeddingRunner):
+        worker_pool.embedding_scheduler.set_max_batch_size(
+            decision["encode_batch_size"]
+        )
+
+    return decision["workers"]
+
+
+async def run_service_loop(
+    worker_pool: WarmWorkerPool | BatchedEmbeddingRunner | None,
+    autoscaler: QueueAutoscaler | None = None,
+):
+
     # Opened ONCE here, held open for the entire lifetime of the service
     # loop below — NOT re-opened per-message. Re-opening per-message would
     # work but adds unnecessary connection setup/teardown on every single
@@ -92,54 +445,186 @@ async def run_service():
     async with aws_session.client("ses", region_name=AWS_REGION) as ses_client:
         while True:
             try:
+                await release_flushed_results(ses_client)
+
                 # 1) Get Extractor Queue Messages & Process.
 
-                # For MVP, will only dequee one SQS message at a time.
-                sqs_payload = get_messages_from_extractor_service()
+                workers = apply_scaling_decision(autoscaler, worker_pool)
 
-                sqs_msg_list = process_incoming_sqs_messages(sqs_payload)
+                # Dequeues up to SQS_MAX_MESSAGES (max 10) messages at a time,
+                # or as many as the autoscaler asks for.
+                sqs_msg_list = receive_messages(
+                    None
+                    if autoscaler is None
+                    else autoscaler.decision["receive_batch_size"]
+                )
 
                 if len(sqs_msg_list) == 0:
-                    time.sleep(2)
+                    time.sleep(
+                        2
+                        if autoscaler is None
+                        else autoscaler.decision["idle_sleep_seconds"]
+                    )
                     continue
 
+                visibility_heartbeat.track(sqs_msg_list)
+
                 # 2) Embed & Upload Every Message to Qdrant Database.
 
                 # Need to stingify each dictionary to avoid executor Pickle issue.
                 json_payloads = [json.dumps(msg) for msg in sqs_msg_list]
 
-                # Ensures Fresh Worker Processes Each Batch
-                with ProcessPoolExecutor() as executor:
-                    raw_results = list(executor.map(executor_worker, json_payloads))
-
-                successful_results = [
-                    res
-                    for res in raw_results
-                    if res.get("process_status") == "complete"
-                ]
-
-                # 3) Delete Successfully Embedded/Uploaded Messages From SQS.
-                if len(successful_results) == 0:
-                    # Transcription embedding failed -> Don't delete -> Let SQS retry.
-                    for failed_result in raw_results:
-                        print(
-                            f"❌ Transcript embedding failed for sqs_payload with message_id of {failed_result.get('message_id')} — skipping deletion."
-                        )
-
-                else:
-                    print(
-                        "Start deleting successfully process messages from Embedding Push Queue."
+                batch_started = time.monotonic()
+
+                raw_results = embed_sqs_batch(json_payloads, worker_pool, workers)
+
+                if autoscaler is not None:
+                    autoscaler.record_batch(
+                        len(json_payloads),
+                        time.monotonic() - batch_started,
+                        autoscaler.decision["workers"],
                     )
-                    delete_embedding_sqs_message(successful_results)
 
-                    # 4) Fire an SES Email For Each Successful Embedd/Upload Message.
-                    await process_successful_results(ses_client, successful_results)
+                await handle_embed_results(ses_client, raw_results)
+
+                report_startup(
+                    worker_pool.worker_memory
+                    if isinstance(worker_pool, WarmWorkerPool)
+                    else None
+                )
 
             except ValueError as e:
                 print(f"ValueError in run_service function: {e}")
                 traceback.print_exc()
 
 
+async def finalize_pipeline_batch(
+    ses_client: "SESClient", result_futures: list["asyncio.Future[EmbedStatus]"]
+) -> None:
+    try:
+        raw_results = await asyncio.gather(*result_futures)
+
+        await handle_embed_results(ses_client, raw_results)
+
+        report_startup()
+
+    except ValueError as e:
+        print(f"ValueError in finalize_pipeline_batch function: {e}")
+        traceback.print_exc()
+
+
+def get_service_qdrant_client() -> "QdrantClient | None":
+    """
+    The module-level Qdrant client, rebuilt if an auth error has invalidated
+    the cached credentials since it was created.
+    """
+
+    global qdrant_client, qdrant_secret_generation
+
+    qdrant_client, qdrant_secret_generation = refresh_qdrant_client(
+        qdrant_client, qdrant_secret_generation
+    )
+
+    return qdrant_client
+
+
+async def run_pipeline_service():
+
+    # Starts the extraction pool's forkserver before the model is loaded, so
+    # the first documents don't wait for it; see create_extract_executor().
+    extract_executor = create_extract_executor()
+
+    # The scheduler thread is the only encoder, so it gets every CPU.
+    init_topology_worker(plan_worker_topology(1))
+
+    embedding_scheduler = create_embedding_scheduler(get_embedd_model())
+
+    query_server = start_query_server(embedding_scheduler)
+
+    mark_startup_phase("worker_pool")
+
+    try:
+        async with (
+            aws_session.client("ses", region_name=AWS_REGION) as ses_client,
+            aws_session.client("s3", region_name=AWS_REGION) as s3_client,
+        ):
+            pipeline = create_pipeline(
+                s3_client,
+                get_service_qdrant_client(),
+                embedding_scheduler,
+                extract_executor,
+            )
+            pipeline.start()
+
+            try:
+                await run_pipeline_loop(
+                    ses_client,
+                    pipeline,
+                    embedding_scheduler,
+                    create_autoscaler(scale_workers=False),
+                )
+            finally:
+                await pipeline.stop()
+
+    finally:
+        if query_server is not None:
+            query_server.shutdown()
+
+        embedding_scheduler.stop()
+        extract_executor.shutdown(wait=True, cancel_futures=True)
+
+
+async def run_pipeline_loop(
+    ses_client: "SESClient",
+    pipeline: EmbeddingPipeline,
+    embedding_scheduler: EmbeddingScheduler,
+    autoscaler: QueueAutoscaler | None = None,
+):
+
+    # Batches are not awaited here: the loop goes straight back to SQS while
+    # earlier messages are still moving through the pipeline, and only
+    # blocks when the pipeline's bounded download queue is full.
+    finalize_tasks: set[asyncio.Task] = set()
+
+    while True:
+        try:
+            await release_flushed_results(ses_client)
+
+            receive_batch_size = None
+            idle_sleep_seconds = 2.0
+
+            # The pipeline's stage concurrency is fixed, so only the receive
+            # and encode batch sizes follow the autoscaler here.
+            if autoscaler is not None:
+                decision = await asyncio.to_thread(autoscaler.decide)
+                embedding_scheduler.set_max_batch_size(decision["encode_batch_size"])
+                receive_batch_size = decision["receive_batch_size"]
+                idle_sleep_seconds = decision["idle_sleep_seconds"]
+
+            sqs_msg_list = await asyncio.to_thread(receive_messages, receive_batch_size)
+
+            if len(sqs_msg_list) == 0:
+                await asyncio.sleep(idle_sleep_seconds)
+                continue
+
+            if autoscaler is not None:
+                autoscaler.note_activity()
+
+            visibility_heartbeat.track(sqs_msg_list)
+
+            result_futures = [await pipeline.submit(msg) for msg in sqs_msg_list]
+
+            finalize_task = asyncio.create_task(
+                finalize_pipeline_batch(ses_client, result_futures)
+            )
+            finalize_tasks.add(finalize_task)
+            finalize_task.add_done_callback(finalize_tasks.discard)
+
+        except ValueError as e:
+            print(f"ValueError in run_pipeline_loop function: {e}")
+            traceback.print_exc()
+
+
 if __name__ == "__main__":
     asyncio.run(run_service())
 
@@ -0,0 +1,268 @@
+import math
+import os
+import time
+from typing import Callable
+
+from services.aws.sqs import SQS_BATCH_LIMIT, get_queue_depth
+from services.metrics.main import increment, set_gauge
+from services.utils.types.main import ScalingDecision
+from services.workers.topology import get_cpu_budget
+
+AUTOSCALE_CHECK_INTERVAL_SECONDS = 15
+AUTOSCALE_TARGET_DRAIN_SECONDS = 60
+AUTOSCALE_IDLE_SECONDS = 120
+AUTOSCALE_SCALE_DOWN_COOLDOWN_SECONDS = 120
+AUTOSCALE_IDLE_SLEEP_SECONDS = 2
+
+# Weight of the newest batch in the per-message latency average.
+LATENCY_SMOOTHING = 0.3
+
+
+class QueueAutoscaler:
+    """
+    Sizes the service to the backlog on the embedding queue.
+
+    Every check_interval_seconds it reads ApproximateNumberOfMessages and,
+    with the recent per-message processing time, works out how many workers
+    would drain the backlog within target_drain_seconds. The SQS receive
+    size and the encode batch size grow with the backlog too. All three stay
+    within their configured bounds.
+
+    Scaling up happens as soon as the backlog calls for it. Scaling down
+    waits scale_down_cooldown_seconds after the last change, because
+    rebuilding a warm pool reloads the model in every worker. After
+    idle_seconds without messages the service drops to a single worker, the
+    smallest batches and the idle poll backoff.
+    """
+
+    def __init__(
+        self,
+        min_workers: int,
+        max_workers: int,
+        min_receive_batch_size: int,
+        max_receive_batch_size: int,
+        min_encode_batch_size: int,
+        max_encode_batch_size: int,
+        check_interval_seconds: float = AUTOSCALE_CHECK_INTERVAL_SECONDS,
+        target_drain_seconds: float = AUTOSCALE_TARGET_DRAIN_SECONDS,
+        idle_seconds: float = AUTOSCALE_IDLE_SECONDS,
+        scale_down_cooldown_seconds: float = AUTOSCALE_SCALE_DOWN_COOLDOWN_SECONDS,
+        idle_sleep_seconds: float = AUTOSCALE_IDLE_SLEEP_SECONDS,
+        queue_depth_reader: Callable[[], int | None] = get_queue_depth,
+    ):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.min_receive_batch_size = max(1, min_receive_batch_size)
+        self.max_receive_batch_size = min(
+            SQS_BATCH_LIMIT, max(self.min_receive_batch_size, max_receive_batch_size)
+        )
+        self.min_encode_batch_size = max(1, min_encode_batch_size)
+        self.max_encode_batch_size = max(
+            self.min_encode_batch_size, max_encode_batch_size
+        )
+        self.check_interval_seconds = check_interval_seconds
+        self.target_drain_seconds = target_drain_seconds
+        self.idle_seconds = idle_seconds
+        self.scale_down_cooldown_seconds = scale_down_cooldown_seconds
+        self.idle_sleep_seconds = idle_sleep_seconds
+        self._read_queue_depth = queue_depth_reader
+
+        # Seconds one worker spends on one message; None until a batch ran.
+        self.message_seconds: float | None = None
+        self.queue_depth = 0
+
+        now = time.monotonic()
+        self._last_check = -math.inf
+        self._last_message_at = now
+        self._last_worker_change = now
+
+        self.decision: ScalingDecision = {
+            "workers": self.min_workers,
+            "receive_batch_size": self.min_receive_batch_size,
+            "encode_batch_size": self.min_encode_batch_size,
+            "idle_sleep_seconds": self.idle_sleep_seconds,
+        }
+        self._report(self.decision, self.decision)
+
+    def note_activity(self) -> None:
+        """Marks messages as received, which postpones scaling down to idle."""
+
+        self._last_message_at = time.monotonic()
+
+    def record_batch(
+        self, message_count: int, elapsed_seconds: float, workers: int
+    ) -> None:
+        """Feeds back how long a batch of message_count messages took on `workers` workers."""
+
+        if message_count <= 0:
+            return
+
+        self.note_activity()
+
+        # Messages beyond the worker count queue behind each other, so this
+        # is the time one worker spent per message.
+        message_seconds = elapsed_seconds * min(workers, message_count) / message_count
+
+        if self.message_seconds is None:
+            self.message_seconds = message_seconds
+        else:
+            self.message_seconds += LATENCY_SMOOTHING * (
+                message_seconds - self.message_seconds
+            )
+
+    def _target_workers(self) -> int:
+        if self.queue_depth == 0:
+            return self.min_workers
+
+        if self.message_seconds is None:
+            # No latency yet: size to the backlog, one message per worker.
+            return min(self.max_workers, max(self.min_workers, self.queue_depth))
+
+        workers = math.ceil(
+            self.queue_depth * self.message_seconds / self.target_drain_seconds
+        )
+
+        return min(self.max_workers, max(self.min_workers, workers))
+
+    def _backlog_pressure(self) -> float:
+        # 0 with an empty queue, 1 once every worker has a full receive
+        # batch waiting.
+        return min(
+            1.0,
+            self.queue_depth / max(1, self.max_workers * self.max_receive_batch_size),
+        )
+
+    def decide(self) -> ScalingDecision:
+        now = time.monotonic()
+
+        if now - self._last_check < self.check_interval_seconds:
+            return self.decision
+
+        self._last_check = now
+
+        queue_depth = self._read_queue_depth()
+
+        if queue_depth is None:
+            return self.decision
+
+        self.queue_depth = queue_depth
+        set_gauge("embedding_queue_depth", queue_depth)
+
+        previous = self.decision
+
+        if queue_depth == 0 and now - self._last_message_at >= self.idle_seconds:
+            decision: ScalingDecision = {
+                "workers": self.min_workers,
+                "receive_batch_size": self.min_receive_batch_size,
+                "encode_batch_size": self.min_encode_batch_size,
+                "idle_sleep_seconds": self.idle_sleep_seconds,
+            }
+        else:
+            workers = self._target_workers()
+            pressure = self._backlog_pressure()
+
+            decision = {
+                "workers": workers,
+                "receive_batch_size": min(
+                    self.max_receive_batch_size,
+                    max(self.min_receive_batch_size, workers, queue_depth),
+                ),
+                "encode_batch_size": round(
+                    self.min_encode_batch_size
+                    + pressure
+                    * (self.max_encode_batch_size - self.min_encode_batch_size)
+                ),
+                # Messages are waiting, so go straight back to SQS.
+                "idle_sleep_seconds": 0.0
+                if queue_depth > 0
+                else self.idle_sleep_seconds,
+            }
+
+        if decision["workers"] < previous["workers"] and (
+            now - self._last_worker_change < self.scale_down_cooldown_seconds
+        ):
+            decision["workers"] = previous["workers"]
+
+        if decision["workers"] != previous["workers"]:
+            self._last_worker_change = now
+
+        self.decision = decision
+        self._report(previous, decision)
+
+        return decision
+
+    def _report(self, previous: ScalingDecision, decision: ScalingDecision) -> None:
+        changes = []
+
+        for setting in ("workers", "receive_batch_size", "encode_batch_size"):
+            set_gauge("embedding_autoscaler_target", decision[setting], setting=setting)
+
+            if decision[setting] != previous[setting]:
+                direction = "up" if decision[setting] > previous[setting] else "down"
+                increment(
+                    "embedding_autoscaler_decisions_total",
+                    setting=setting,
+                    direction=direction,
+                )
+                changes.append(f"{setting} {previous[setting]}→{decision[setting]}")
+
+        if changes:
+            latency = (
+                "n/a"
+                if self.message_seconds is None
+                else f"{self.message_seconds:.2f}s/message"
+            )
+            print(
+                f"📈 Autoscaler (queue depth {self.queue_depth}, {latency}): {', '.join(changes)}"
+            )
+
+
+def create_autoscaler(scale_workers: bool = True) -> QueueAutoscaler | None:
+    """
+    Returns None unless AUTOSCALE_ENABLED=true. With scale_workers=False
+    (pipeline mode, whose stage concurrency is fixed) the worker count is
+    pinned to 1 and only the batch sizes are scaled.
+    """
+
+    if os.getenv("AUTOSCALE_ENABLED", "false").strip().lower() != "true":
+        return None
+
+    min_workers = int(os.getenv("AUTOSCALE_MIN_WORKERS", "1"))
+    max_workers = int(os.getenv("AUTOSCALE_MAX_WORKERS", "0")) or get_cpu_budget()
+
+    if not scale_workers:
+        min_workers = max_workers = 1
+
+    return QueueAutoscaler(
+        min_workers=min_workers,
+        max_workers=max_workers,
+        min_receive_batch_size=int(os.getenv("AUTOSCALE_MIN_RECEIVE_BATCH", "1")),
+        max_receive_batch_size=int(
+            os.getenv("AUTOSCALE_MAX_RECEIVE_BATCH", str(SQS_BATCH_LIMIT))
+        ),
+        min_encode_batch_size=int(os.getenv("AUTOSCALE_MIN_ENCODE_BATCH", "16")),
+        max_encode_batch_size=int(os.getenv("AUTOSCALE_MAX_ENCODE_BATCH", "128")),
+        check_interval_seconds=float(
+            os.getenv(
+                "AUTOSCALE_CHECK_INTERVAL_SECONDS",
+                str(AUTOSCALE_CHECK_INTERVAL_SECONDS),
+            )
+        ),
+        target_drain_seconds=float(
+            os.getenv(
+                "AUTOSCALE_TARGET_DRAIN_SECONDS", str(AUTOSCALE_TARGET_DRAIN_SECONDS)
+            )
+        ),
+        idle_seconds=float(
+            os.getenv("AUTOSCALE_IDLE_SECONDS", str(AUTOSCALE_IDLE_SECONDS))
+        ),
+        scale_down_cooldown_seconds=float(
+            os.getenv(
+                "AUTOSCALE_SCALE_DOWN_COOLDOWN_SECONDS",
+                str(AUTOSCALE_SCALE_DOWN_COOLDOWN_SECONDS),
+            )
+        ),
+        idle_sleep_seconds=float(
+            os.getenv("AUTOSCALE_IDLE_SLEEP_SECONDS", str(AUTOSCALE_IDLE_SLEEP_SECONDS))
+        ),
+    )
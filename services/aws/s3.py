@@ -1,27 +1,237 @@
+import asyncio
+import mmap
 import os
-from io import BytesIO
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Iterator
 
 import boto3
 import botocore
-import pdfplumber
-from bs4 import BeautifulSoup
+from botocore.client import BaseClient
+from botocore.config import Config
 
+from services.extraction.html_text import extract_html_text
+from services.extraction.main import get_pdf_executor, iter_pdf_pages
+from services.extraction.normalize import is_text_normalization_enabled, normalize_text
+from services.metrics.main import timed_stage
 from services.utils.types.main import SQSPayload
 
+SUPPORTED_FILE_EXTENSIONS = {".txt", ".pdf", ".html"}
+
+S3_MAX_POOL_CONNECTIONS = 50
+
+# Objects larger than this are downloaded with parallel ranged GETs into a
+# temp file instead of memory. 0 keeps every download in memory.
+S3_SPOOL_THRESHOLD_MB = 16
+S3_RANGE_PART_MB = 8
+S3_RANGE_CONCURRENCY = 4
+
+# Response bodies are copied to the temp file this many bytes at a time.
+S3_READ_BLOCK_BYTES = 1024 * 1024
+
+# Ranged parts are pinned to the first response's ETag. When the object is
+# overwritten mid-download S3 answers 412, and the download starts over up
+# to this many times.
+S3_CHANGED_OBJECT_RETRIES = 2
+
+# One pooled client per process. boto3 clients are thread-safe but must not
+# be shared across a fork, so the owning pid is stored alongside it.
+_shared_s3_client: tuple[int, BaseClient] | None = None
+_shared_s3_client_lock = threading.Lock()
+
+
+def get_s3_client() -> BaseClient:
+    global _shared_s3_client
+
+    with _shared_s3_client_lock:
+        if _shared_s3_client is None or _shared_s3_client[0] != os.getpid():
+            aws_region = os.getenv("AWS_REGION", "us-east-1")
+            max_pool_connections = int(
+                os.getenv("S3_MAX_POOL_CONNECTIONS", str(S3_MAX_POOL_CONNECTIONS))
+            )
+
+            s3_client = boto3.client(
+                "s3",
+                region_name=aws_region,
+                config=Config(max_pool_connections=max_pool_connections),
+            )
+            _shared_s3_client = (os.getpid(), s3_client)
+
+        return _shared_s3_client[1]
+
+
+def get_spool_threshold_bytes() -> int:
+    return int(
+        float(os.getenv("S3_SPOOL_THRESHOLD_MB", str(S3_SPOOL_THRESHOLD_MB)))
+        * 1024
+        * 1024
+    )
+
+
+def get_range_part_bytes() -> int:
+    part_mb = float(os.getenv("S3_RANGE_PART_MB", str(S3_RANGE_PART_MB)))
+    return max(S3_READ_BLOCK_BYTES, int(part_mb * 1024 * 1024))
+
+
+_download_executor: tuple[int, ThreadPoolExecutor] | None = None
+_download_executor_lock = threading.Lock()
+
+
+def get_download_executor() -> ThreadPoolExecutor:
+    global _download_executor
+
+    with _download_executor_lock:
+        if _download_executor is None or _download_executor[0] != os.getpid():
+            concurrency = int(
+                os.getenv("S3_RANGE_CONCURRENCY", str(S3_RANGE_CONCURRENCY))
+            )
+            _download_executor = (
+                os.getpid(),
+                ThreadPoolExecutor(
+                    max_workers=max(1, concurrency),
+                    thread_name_prefix="s3-range-download",
+                ),
+            )
+
+        return _download_executor[1]
+
+
+def get_object_size(response: dict) -> int | None:
+    """Total object size from a ranged GET's ContentRange ("bytes 0-99/1234")."""
+
+    content_range = response.get("ContentRange")
+
+    if not content_range:
+        return None
+
+    return int(content_range.rsplit("/", 1)[1])
+
+
+def _head_object_size(s3_client: BaseClient, bucket: str, s3_key: str) -> int | None:
+    try:
+        return int(s3_client.head_object(Bucket=bucket, Key=s3_key)["ContentLength"])
+
+    except botocore.exceptions.ClientError as e:
+        print(f"⚠️ Could not HEAD s3 object {s3_key}: {e.response['Error'].get('Code')}")
+
+    except (botocore.exceptions.BotoCoreError, KeyError, ValueError) as e:
+        print(f"⚠️ Could not HEAD s3 object {s3_key}: {e}")
+
+    return None
+
+
+@timed_stage("s3_head")
+def get_object_sizes(s3_keys: list[str]) -> dict[str, int | None]:
+    """
+    Sizes of the given objects from parallel HEAD requests; None for an
+    object that could not be read.
+    """
+
+    s3_client = get_s3_client()
+    bucket = os.getenv("AWS_BUCKET", "alwayssaved")
+
+    sizes = get_download_executor().map(
+        lambda s3_key: _head_object_size(s3_client, bucket, s3_key), s3_keys
+    )
+
+    return dict(zip(s3_keys, sizes))
+
+
+def get_part_ranges(first_part_size: int, object_size: int) -> list[tuple[int, int]]:
+    """Inclusive byte ranges covering everything after the first ranged GET."""
+
+    part_bytes = get_range_part_bytes()
+
+    return [
+        (start, min(object_size, start + part_bytes) - 1)
+        for start in range(first_part_size, object_size, part_bytes)
+    ]
+
+
+def create_spool_file(object_size: int) -> tuple[int, str]:
+    """Creates a temp file of object_size bytes; returns (fd, path)."""
+
+    spool_fd, spool_path = tempfile.mkstemp(
+        prefix="alwayssaved-s3-", dir=os.getenv("S3_SPOOL_DIR") or None
+    )
+    os.ftruncate(spool_fd, object_size)
+
+    return spool_fd, spool_path
+
+
+def release_file_source(source: bytes | str | None) -> None:
+    """Removes a spooled download; in-memory downloads need nothing."""
+
+    if isinstance(source, str):
+        try:
+            os.unlink(source)
+        except FileNotFoundError:
+            pass
+
+
+def _write_body(body: Any, spool_fd: int, offset: int) -> None:
+    while True:
+        block = body.read(S3_READ_BLOCK_BYTES)
+
+        if not block:
+            return
+
+        os.pwrite(spool_fd, block, offset)
+        offset += len(block)
+
+
+def get_if_match_args(response: dict) -> dict:
+    # IfMatch makes a later part fail with 412 instead of mixing bytes of
+    # two versions of the object.
+    etag = response.get("ETag")
+
+    return {"IfMatch": etag} if etag else {}
+
+
+def is_object_changed_error(error: botocore.exceptions.ClientError) -> bool:
+    return error.response["Error"]["Code"] in ("PreconditionFailed", "412")
+
+
+def _download_range(
+    s3_client: BaseClient,
+    bucket: str,
+    s3_key: str,
+    spool_fd: int,
+    start: int,
+    end: int,
+    if_match_args: dict,
+) -> None:
+    response = s3_client.get_object(
+        Bucket=bucket, Key=s3_key, Range=f"bytes={start}-{end}", **if_match_args
+    )
+    _write_body(response["Body"], spool_fd, start)
+
+
+def _read_file_text(path: str) -> str:
+    # Decodes straight out of the page cache instead of reading a bytes copy first.
+    with open(path, "rb") as source_file:
+        with mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return str(mapped, "utf-8")
+
+
+def extract_text_from_s3_bytes(source: bytes | str, file_extension: str) -> str | None:
+    """source is the downloaded bytes, or the path of a spooled download."""
 
-def extract_text_from_s3_bytes(file_bytes: bytes, file_extension: str) -> str | None:
     try:
         if file_extension == ".txt":
-            return file_bytes.decode("utf-8")  # Simple text
-        elif file_extension == ".pdf":
-            text = ""
-            with pdfplumber.open(BytesIO(file_bytes)) as pdf:
-                for page in pdf.pages:
-                    text += page.extract_text() or ""
+            if isinstance(source, str):
+                text = _read_file_text(source)
+            else:
+                text = source.decode("utf-8")  # Simple text
+
+            if is_text_normalization_enabled():
+                return normalize_text(text)
             return text
+        elif file_extension == ".pdf":
+            return "\n".join(iter_pdf_pages(source, get_pdf_executor()))
         elif file_extension == ".html":
-            soup = BeautifulSoup(file_bytes, "html.parser")
-            return soup.get_text()
+            return extract_html_text(source)
         else:
             raise ValueError(f"Unsupported file extension: {file_extension}")
 
@@ -31,9 +241,70 @@ def extract_text_from_s3_bytes(file_bytes: bytes, file_extension: str) -> str |
     return None
 
 
+def iter_text_from_s3_bytes(
+    source: bytes | str, file_extension: str
+) -> Iterator[str] | None:
+    """
+    Streaming variant of extract_text_from_s3_bytes: PDFs yield one piece
+    per page as pages are extracted, so chunking can start before the last
+    page is parsed. Other formats yield their whole text as a single piece.
+    """
+
+    if file_extension not in SUPPORTED_FILE_EXTENSIONS:
+        print(
+            f"❌ Value Error in iter_text_from_s3_bytes: Unsupported file extension: {file_extension}"
+        )
+        return None
+
+    if file_extension == ".pdf":
+        return iter_pdf_pages(source, get_pdf_executor())
+
+    full_text = extract_text_from_s3_bytes(source, file_extension)
+
+    if full_text is None:
+        return None
+
+    return iter([full_text])
+
+
+@timed_stage("s3_download")
 def download_file_from_s3(
     s3_client: boto3.client, sqs_payload: SQSPayload
-) -> bytes | None:
+) -> bytes | str | None:
+    """
+    Returns the object's bytes, or, for objects above S3_SPOOL_THRESHOLD_MB,
+    the path of a temp file it was downloaded into with parallel ranged GETs
+    (S3_RANGE_PART_MB parts, S3_RANGE_CONCURRENCY at a time). Pass the result
+    to release_file_source() once it has been extracted.
+
+    The first GET asks for the threshold's worth of bytes, so objects under
+    it still take a single request and never touch the disk. The other
+    parts must match its ETag; if the object changes in between, the
+    download starts over (S3_CHANGED_OBJECT_RETRIES times at most).
+    """
+
+    s3_key = sqs_payload.get("transcript_s3_key", None)
+
+    attempts = S3_CHANGED_OBJECT_RETRIES + 1
+
+    for attempt in range(1, attempts + 1):
+        try:
+            return _download_file_from_s3(s3_client, sqs_payload)
+        except botocore.exceptions.ClientError as e:
+            # Only the 412 of an object that changed mid-download gets here.
+            print(
+                f"⚠️ s3 object {s3_key} changed during its download, attempt {attempt}/{attempts}: {e}"
+            )
+
+    return None
+
+
+def _download_file_from_s3(
+    s3_client: boto3.client, sqs_payload: SQSPayload
+) -> bytes | str | None:
+    """download_file_from_s3() without the retries; raises the 412 of a changed object."""
+
+    spool_path = None
 
     try:
         s3_key = sqs_payload.get("transcript_s3_key", None)
@@ -43,14 +314,196 @@ def download_file_from_s3(
         if s3_key is None or bucket is None:
             return None
 
-        response = s3_client.get_object(Bucket=bucket, Key=s3_key)
+        spool_threshold = get_spool_threshold_bytes()
+
+        if spool_threshold <= 0:
+            response = s3_client.get_object(Bucket=bucket, Key=s3_key)
+            return response["Body"].read()
+
+        response = s3_client.get_object(
+            Bucket=bucket, Key=s3_key, Range=f"bytes=0-{spool_threshold - 1}"
+        )
+        object_size = get_object_size(response)
+
+        if object_size is None or object_size <= spool_threshold:
+            return response["Body"].read()
+
+        spool_fd, spool_path = create_spool_file(object_size)
+        if_match_args = get_if_match_args(response)
+
+        try:
+            _write_body(response["Body"], spool_fd, 0)
+
+            futures = [
+                get_download_executor().submit(
+                    _download_range,
+                    s3_client,
+                    bucket,
+                    s3_key,
+                    spool_fd,
+                    start,
+                    end,
+                    if_match_args,
+                )
+                for start, end in get_part_ranges(spool_threshold, object_size)
+            ]
+
+            # Every part must be done with spool_fd before it's closed,
+            # even if one of them failed.
+            wait(futures)
+
+            for future in futures:
+                future.result()
+        finally:
+            os.close(spool_fd)
+
+        return spool_path
 
-        return response["Body"].read()
     except botocore.exceptions.ClientError as e:
+        release_file_source(spool_path)
+
+        if is_object_changed_error(e):
+            raise
+
         if e.response["Error"]["Code"] == "NoSuchKey":
             print(f"Object with key of {s3_key} does not exist! \n")
         elif e.response["Error"]["Code"] == "404":
             print(f"Object with key of {s3_key} does not exist! \n")
+        elif e.response["Error"]["Code"] == "InvalidRange":
+            # A ranged GET of an empty object.
+            return b""
         else:
             print("An error occurred: ", e)
+
+    except (OSError, botocore.exceptions.BotoCoreError) as e:
+        release_file_source(spool_path)
+        print(f"❌ Error spooling s3 object {s3_key} to disk: {e}")
+
+    return None
+
+
+async def _write_body_async(body: Any, spool_fd: int, offset: int) -> None:
+    async with body as stream:
+        while True:
+            block = await stream.read(S3_READ_BLOCK_BYTES)
+
+            if not block:
+                return
+
+            os.pwrite(spool_fd, block, offset)
+            offset += len(block)
+
+
+@timed_stage("s3_download")
+async def download_file_from_s3_async(
+    s3_client: Any, sqs_payload: SQSPayload
+) -> bytes | str | None:
+    """Same as download_file_from_s3, but for an aioboto3 s3 client."""
+
+    s3_key = sqs_payload.get("transcript_s3_key", None)
+
+    attempts = S3_CHANGED_OBJECT_RETRIES + 1
+
+    for attempt in range(1, attempts + 1):
+        try:
+            return await _download_file_from_s3_async(s3_client, sqs_payload)
+        except botocore.exceptions.ClientError as e:
+            # Only the 412 of an object that changed mid-download gets here.
+            print(
+                f"⚠️ s3 object {s3_key} changed during its download, attempt {attempt}/{attempts}: {e}"
+            )
+
+    return None
+
+
+async def _download_file_from_s3_async(
+    s3_client: Any, sqs_payload: SQSPayload
+) -> bytes | str | None:
+    spool_path = None
+
+    try:
+        s3_key = sqs_payload.get("transcript_s3_key", None)
+
+        bucket = os.getenv("AWS_BUCKET", "alwayssaved")
+
+        if s3_key is None or bucket is None:
+            return None
+
+        spool_threshold = get_spool_threshold_bytes()
+
+        if spool_threshold <= 0:
+            response = await s3_client.get_object(Bucket=bucket, Key=s3_key)
+
+            async with response["Body"] as stream:
+                return await stream.read()
+
+        response = await s3_client.get_object(
+            Bucket=bucket, Key=s3_key, Range=f"bytes=0-{spool_threshold - 1}"
+        )
+        object_size = get_object_size(response)
+
+        if object_size is None or object_size <= spool_threshold:
+            async with response["Body"] as stream:
+                return await stream.read()
+
+        spool_fd, spool_path = create_spool_file(object_size)
+        if_match_args = get_if_match_args(response)
+
+        try:
+            await _write_body_async(response["Body"], spool_fd, 0)
+
+            semaphore = asyncio.Semaphore(
+                max(
+                    1, int(os.getenv("S3_RANGE_CONCURRENCY", str(S3_RANGE_CONCURRENCY)))
+                )
+            )
+
+            async def download_range(start: int, end: int) -> None:
+                async with semaphore:
+                    part = await s3_client.get_object(
+                        Bucket=bucket,
+                        Key=s3_key,
+                        Range=f"bytes={start}-{end}",
+                        **if_match_args,
+                    )
+                    await _write_body_async(part["Body"], spool_fd, start)
+
+            # return_exceptions keeps every part running to completion before
+            # spool_fd is closed, even if one of them failed.
+            part_results = await asyncio.gather(
+                *(
+                    download_range(start, end)
+                    for start, end in get_part_ranges(spool_threshold, object_size)
+                ),
+                return_exceptions=True,
+            )
+
+            for part_result in part_results:
+                if isinstance(part_result, BaseException):
+                    raise part_result
+        finally:
+            os.close(spool_fd)
+
+        return spool_path
+
+    except botocore.exceptions.ClientError as e:
+        release_file_source(spool_path)
+
+        if is_object_changed_error(e):
+            raise
+
+        if e.response["Error"]["Code"] == "NoSuchKey":
+            print(f"Object with key of {s3_key} does not exist! \n")
+        elif e.response["Error"]["Code"] == "404":
+            print(f"Object with key of {s3_key} does not exist! \n")
+        elif e.response["Error"]["Code"] == "InvalidRange":
+            # A ranged GET of an empty object.
+            return b""
+        else:
+            print("An error occurred: ", e)
+
+    except (OSError, botocore.exceptions.BotoCoreError) as e:
+        release_file_source(spool_path)
+        print(f"❌ Error spooling s3 object {s3_key} to disk: {e}")
+
     return None
@@ -1,9 +1,14 @@
+import asyncio
 import os
+import time
 from typing import TYPE_CHECKING
 
 from botocore.exceptions import BotoCoreError, ParamValidationError
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
 from pymongo import AsyncMongoClient
+
+from services.metrics.main import increment, time_stage
 from services.utils.types.main import EmbedStatus
 
 if TYPE_CHECKING:
@@ -11,77 +16,194 @@ if TYPE_CHECKING:
 
 sender = os.getenv("AWS_SES_SENDER_EMAIL", "no-reply@alwayssaved.com").strip()
 
-# 7-12-26 TODO: Will have to fix how email body is created if embedding service process more than 1 media file.
-
 SUBJECT = "Your AlwaysSaved media files have been processed! 🥳"
 INTRO_TEXT = "We've finished processing your media files.\n\n"
 ENDING_TEXT = (
     "You may now ask the LLM questions about your files. Happy querying! 🎉🙌🏽"
 )
 
+USER_EMAIL_TTL_SECONDS = 300
 
-async def send_user_email_notification(
-    ses_client: "SESClient", mongo_client: AsyncMongoClient, embed_result: EmbedStatus
-) -> None:
+# SES accounts start at 14 sends/second; stay comfortably under that.
+SES_MAX_CONCURRENT_SENDS = 8
 
-    try:
-        user_id = embed_result.get("user_id", "")
+# user_id -> (email, monotonic expiry time), oldest expiry first; see
+# _cache_user_email().
+_user_email_cache: dict[str, tuple[str, float]] = {}
+
+_send_semaphore: asyncio.Semaphore | None = None
+
+
+def get_send_semaphore() -> asyncio.Semaphore:
+    # Shared by every notification batch, so batches finishing at the same
+    # time in pipeline mode don't each get their own SES_MAX_CONCURRENT_SENDS.
+    global _send_semaphore
+
+    if _send_semaphore is None:
+        _send_semaphore = asyncio.Semaphore(
+            int(os.getenv("SES_MAX_CONCURRENT_SENDS", str(SES_MAX_CONCURRENT_SENDS)))
+        )
+
+    return _send_semaphore
+
+
+def _cache_user_email(user_id: str, email: str, expires_at: float, now: float) -> None:
+    # Entries are moved to the end on every refresh, so the expired ones are
+    # always at the front and the cache never outgrows the users seen
+    # within one TTL.
+    while _user_email_cache:
+        oldest_user_id, (_, oldest_expiry) = next(iter(_user_email_cache.items()))
+
+        if oldest_expiry > now:
+            break
+
+        del _user_email_cache[oldest_user_id]
+
+    _user_email_cache.pop(user_id, None)
+    _user_email_cache[user_id] = (email, expires_at)
+
+
+def group_results_by_user(embed_results: list[EmbedStatus]) -> dict[str, list[str]]:
+    """Returns {user_id: [original_filename, ...]} in the order results arrived."""
+
+    filenames_by_user: dict[str, list[str]] = {}
+
+    for result in embed_results:
+        filenames_by_user.setdefault(result.get("user_id", ""), []).append(
+            result.get("original_filename", "")
+        )
+
+    return filenames_by_user
+
+
+async def get_user_emails(
+    mongo_client: AsyncMongoClient, user_ids: list[str]
+) -> dict[str, str]:
+    """
+    Resolves user_ids to emails with one `$in` query for every id that isn't
+    in the short-lived email cache (USER_EMAIL_CACHE_TTL_SECONDS). Users that
+    don't exist or have no email are left out.
+    """
+
+    now = time.monotonic()
+    emails = {}
+    # ObjectId() accepts any hex case but str() of one is lowercase, so
+    # found users are mapped back to the user_ids they were asked for.
+    user_ids_by_object_id: dict[ObjectId, list[str]] = {}
+
+    for user_id in user_ids:
+        cached = _user_email_cache.get(user_id)
+
+        if cached is not None and cached[1] > now:
+            emails[user_id] = cached[0]
+            continue
+
+        try:
+            user_ids_by_object_id.setdefault(ObjectId(user_id), []).append(user_id)
+        except (InvalidId, TypeError):
+            # Reported as a user without an email by send_user_notifications.
+            continue
+
+    if len(user_ids_by_object_id) == 0:
+        return emails
 
-        original_filename = embed_result.get("original_filename", "")
+    expires_at = now + float(
+        os.getenv("USER_EMAIL_CACHE_TTL_SECONDS", str(USER_EMAIL_TTL_SECONDS))
+    )
 
-        found_user = (
-            await mongo_client.get_database("alwayssaved")
+    with time_stage("mongo_lookup"):
+        cursor = (
+            mongo_client.get_database("alwayssaved")
             .get_collection("users")
-            .find_one({"_id": ObjectId(user_id)})
+            .find({"_id": {"$in": list(user_ids_by_object_id)}}, {"email": 1})
         )
 
-        if found_user is None:
-            raise ValueError(
-                f"User with id of {user_id} not found in database. Can't send a transcription notification email."
-            )
+        async for found_user in cursor:
+            email = (found_user.get("email") or "").strip()
 
-        email = found_user.get("email", "").strip()
+            if not email:
+                continue
 
-        print(f"plucked email from found_user {email}")
+            for user_id in user_ids_by_object_id.get(found_user["_id"], []):
+                emails[user_id] = email
+                _cache_user_email(user_id, email, expires_at, now)
 
-        if not email:
-            raise ValueError(
-                f"User with id of {user_id} has no email. Can't send a transcription notification email."
-            )
+    return emails
+
+
+def build_email_body(original_filenames: list[str]) -> str:
+    body_text = "".join(f" - {filename} \n" for filename in original_filenames)
+
+    return "".join([INTRO_TEXT, body_text, "\n", ENDING_TEXT])
+
+
+async def send_user_email_notification(
+    ses_client: "SESClient", user_id: str, email: str, original_filenames: list[str]
+) -> None:
+    """Sends one email listing every file of this user that finished processing."""
 
-        BODY_TEXT = f" - {original_filename} \n\n"
-
-        FINALIZED_BODY = "".join([INTRO_TEXT, BODY_TEXT, ENDING_TEXT])
-
-        # aioboto3's ses_client is a genuine async client (unlike plain
-        # boto3), so send_email here actually returns a coroutine and
-        # this await is doing real work, not a no-op.
-        await ses_client.send_email(
-            Source=sender,
-            Destination={
-                "ToAddresses": [email],
-            },
-            Message={
-                "Subject": {
-                    "Data": SUBJECT,
-                },
-                "Body": {
-                    "Text": {
-                        "Data": FINALIZED_BODY,
+    try:
+        async with get_send_semaphore():
+            with time_stage("ses_send"):
+                # aioboto3's ses_client is a genuine async client (unlike plain
+                # boto3), so send_email here actually returns a coroutine and
+                # this await is doing real work, not a no-op.
+                await ses_client.send_email(
+                    Source=sender,
+                    Destination={
+                        "ToAddresses": [email],
                     },
-                },
-            },
-        )
+                    Message={
+                        "Subject": {
+                            "Data": SUBJECT,
+                        },
+                        "Body": {
+                            "Text": {
+                                "Data": build_email_body(original_filenames),
+                            },
+                        },
+                    },
+                )
+
+        increment("embedding_emails_sent_total")
 
     except (ParamValidationError, BotoCoreError) as e:
         print(f"❌ SES error ({type(e).__name__}): {str(e)} — user_id: {user_id}")
 
-    except ValueError as e:
-        print(
-            f"❌ Unexpected ValueError in send_user_email_notification for user_id {user_id}: {str(e)}"
-        )
-
     except Exception as e:
         print(
             f"❌ Unexpected Exception in send_user_email_notification for user_id {user_id}: {str(e)}"
         )
+
+
+async def send_user_notifications(
+    ses_client: "SESClient",
+    mongo_client: AsyncMongoClient,
+    embed_results: list[EmbedStatus],
+) -> None:
+    """Groups embed_results by user and sends each user one combined email."""
+
+    filenames_by_user = group_results_by_user(embed_results)
+
+    try:
+        emails = await get_user_emails(mongo_client, list(filenames_by_user))
+
+    except Exception as e:
+        print(f"❌ Unexpected Exception looking up user emails in MongoDB: {str(e)}")
+        return
+
+    for user_id in filenames_by_user:
+        if user_id not in emails:
+            print(
+                f"❌ User with id of {user_id} not found or has no email. Can't send a transcription notification email."
+            )
+
+    await asyncio.gather(
+        *[
+            send_user_email_notification(
+                ses_client, user_id, emails[user_id], original_filenames
+            )
+            for user_id, original_filenames in filenames_by_user.items()
+            if user_id in emails
+        ]
+    )
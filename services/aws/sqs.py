@@ -1,11 +1,13 @@
 import json
 import os
+import threading
 from typing import Any, Dict, List
 
 import boto3
 from botocore.exceptions import BotoCoreError, ClientError
 
-from services.aws.ssm import get_secret
+from services.aws.ssm import get_secret, invalidate_secret
+from services.metrics.main import observe, set_gauge, timed_stage
 from services.utils.types.main import EmbedStatus, SQSPayload
 
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
@@ -13,10 +15,35 @@ sqs_client = boto3.client("sqs", region_name=AWS_REGION)
 
 MAX_MESSAGES = 1
 WAIT_TIME = 20
-VISIBILITY_TIMEOUT = 2700
+VISIBILITY_TIMEOUT = 300
 
+# Errors that mean the cached queue URL is stale (queue recreated/renamed
+# or the URL parameter was rotated), so it has to be re-read from SSM.
+STALE_QUEUE_URL_ERRORS = {
+    "AWS.SimpleQueueService.NonExistentQueue",
+    "QueueDoesNotExist",
+    "AccessDenied",
+    "AccessDeniedException",
+}
 
-def get_messages_from_extractor_service() -> Dict[str, Any]:
+# SQS caps ReceiveMessage, DeleteMessageBatch and ChangeMessageVisibilityBatch
+# at 10 messages/entries per call.
+SQS_BATCH_LIMIT = 10
+
+
+def get_receive_batch_size() -> int:
+    max_messages = int(os.getenv("SQS_MAX_MESSAGES", str(MAX_MESSAGES)))
+    return min(SQS_BATCH_LIMIT, max(1, max_messages))
+
+
+def get_visibility_timeout() -> int:
+    return int(os.getenv("SQS_VISIBILITY_TIMEOUT", str(VISIBILITY_TIMEOUT)))
+
+
+@timed_stage("sqs_receive")
+def get_messages_from_extractor_service(
+    max_messages: int | None = None, wait_seconds: int = WAIT_TIME
+) -> Dict[str, Any]:
 
     try:
         embedding_push_queue_url = get_secret("/alwayssaved/EMBEDDING_PUSH_QUEUE_URL")
@@ -24,11 +51,14 @@ def get_messages_from_extractor_service() -> Dict[str, Any]:
         if not embedding_push_queue_url:
             raise ValueError("⚠️ ERROR: SQS Embedding PushQueue URL not set!")
 
+        if max_messages is None:
+            max_messages = get_receive_batch_size()
+
         response = sqs_client.receive_message(
             QueueUrl=embedding_push_queue_url,
-            MaxNumberOfMessages=MAX_MESSAGES,  # Adjust this to batch process more users
-            WaitTimeSeconds=WAIT_TIME,  # Long polling to reduce API calls
-            VisibilityTimeout=VISIBILITY_TIMEOUT,
+            MaxNumberOfMessages=min(SQS_BATCH_LIMIT, max(1, max_messages)),
+            WaitTimeSeconds=wait_seconds,  # Long polling to reduce API calls
+            VisibilityTimeout=get_visibility_timeout(),
         )
 
         return response
@@ -38,6 +68,9 @@ def get_messages_from_extractor_service() -> Dict[str, Any]:
             f"❌ AWS Client Error getting SQS message in get_messages_from_extractor_service: {e.response['Error']['Message']}"
         )
 
+        if e.response["Error"]["Code"] in STALE_QUEUE_URL_ERRORS:
+            invalidate_secret("/alwayssaved/EMBEDDING_PUSH_QUEUE_URL")
+
     except BotoCoreError as e:
         print(
             f"❌ Boto3 Internal Error in get_messages_from_extractor_service: {str(e)}"
@@ -49,6 +82,33 @@ def get_messages_from_extractor_service() -> Dict[str, Any]:
     return {}
 
 
+def get_queue_depth() -> int | None:
+    """ApproximateNumberOfMessages (visible, not yet received) on the embedding queue."""
+
+    try:
+        embedding_push_queue_url = get_secret("/alwayssaved/EMBEDDING_PUSH_QUEUE_URL")
+
+        response = sqs_client.get_queue_attributes(
+            QueueUrl=embedding_push_queue_url,
+            AttributeNames=["ApproximateNumberOfMessages"],
+        )
+
+        return int(response["Attributes"]["ApproximateNumberOfMessages"])
+
+    except ClientError as e:
+        print(
+            f"❌ AWS Client Error getting SQS queue depth in get_queue_depth: {e.response['Error']['Message']}"
+        )
+
+        if e.response["Error"]["Code"] in STALE_QUEUE_URL_ERRORS:
+            invalidate_secret("/alwayssaved/EMBEDDING_PUSH_QUEUE_URL")
+
+    except (BotoCoreError, KeyError, ValueError) as e:
+        print(f"❌ Unexpected Error in get_queue_depth: {str(e)}")
+
+    return None
+
+
 def process_incoming_sqs_messages(
     incoming_payload: Dict[str, Any],
 ) -> List[SQSPayload]:
@@ -57,6 +117,8 @@ def process_incoming_sqs_messages(
     if len(sqs_msg_list) == 0:
         return sqs_msg_list
 
+    observe("embedding_sqs_batch_size", len(sqs_msg_list))
+
     processed_list: List[SQSPayload] = []
 
     for msg in sqs_msg_list:
@@ -90,25 +152,180 @@ def delete_embedding_sqs_message(processed_success_list: List[EmbedStatus]) -> N
         print("⚠️ ERROR: SQS Queue URL not set for delete_embedding_sqs_message!")
         return
 
-    try:
-        for msg in processed_success_list:
-            receipt_handle = msg.get("sqs_receipt_handle", None)
+    for start in range(0, len(processed_success_list), SQS_BATCH_LIMIT):
+        msg_batch = processed_success_list[start : start + SQS_BATCH_LIMIT]
+
+        try:
+            # Entry Ids only need to be unique within one request.
+            entries = [
+                {"Id": str(index), "ReceiptHandle": msg.get("sqs_receipt_handle", "")}
+                for index, msg in enumerate(msg_batch)
+            ]
 
-            sqs_client.delete_message(
-                QueueUrl=extractor_push_queue_url, ReceiptHandle=receipt_handle
+            response = sqs_client.delete_message_batch(
+                QueueUrl=extractor_push_queue_url, Entries=entries
             )
 
+            for success in response.get("Successful", []):
+                msg = msg_batch[int(success["Id"])]
+                print(
+                    f"✅ SQS Message Deleted from Extractor Push Queue: {msg['message_id']}"
+                )
+
+            for failure in response.get("Failed", []):
+                msg = msg_batch[int(failure["Id"])]
+                print(
+                    f"❌ SQS Message {msg['message_id']} could not be deleted from Extractor Push Queue ({failure.get('Code')}): {failure.get('Message', '')}"
+                )
+
+                # Receiver-side failures are transient, so retry that entry
+                # once. A failed retry is only logged, so the batch's other
+                # failures still get theirs.
+                if failure.get("SenderFault", False):
+                    continue
+
+                try:
+                    sqs_client.delete_message(
+                        QueueUrl=extractor_push_queue_url,
+                        ReceiptHandle=msg.get("sqs_receipt_handle", ""),
+                    )
+                    print(
+                        f"✅ SQS Message Deleted from Extractor Push Queue on retry: {msg['message_id']}"
+                    )
+
+                except ClientError as e:
+                    print(
+                        f"❌ AWS Client Error retrying the delete of SQS message {msg['message_id']}: {e.response['Error']['Message']}"
+                    )
+
+                except BotoCoreError as e:
+                    print(
+                        f"❌ Boto3 Internal Error retrying the delete of SQS message {msg['message_id']}: {str(e)}"
+                    )
+
+        except ClientError as e:
             print(
-                f"✅ SQS Message Deleted from Extractor Push Queue: {msg['message_id']}"
+                f"❌ AWS Client Error deleting SQS message in delete_embedding_sqs_message: {e.response['Error']['Message']}"
             )
 
-    except ClientError as e:
-        print(
-            f"❌ AWS Client Error deleting SQS message in delete_embedding_sqs_message: {e.response['Error']['Message']}"
+            if e.response["Error"]["Code"] in STALE_QUEUE_URL_ERRORS:
+                invalidate_secret("/alwayssaved/EMBEDDING_PUSH_QUEUE_URL")
+
+        except BotoCoreError as e:
+            print(f"❌ Boto3 Internal Error in delete_embedding_sqs_message: {str(e)}")
+
+        except Exception as e:
+            print(f"❌ Unexpected Error in delete_embedding_sqs_message: {str(e)}")
+
+
+class VisibilityHeartbeat:
+    """
+    Background thread that keeps in-flight SQS messages invisible.
+
+    Every interval_seconds it calls ChangeMessageVisibilityBatch for each
+    tracked receipt handle, pushing its visibility out by visibility_timeout
+    seconds. That lets the receive-time VisibilityTimeout stay short: if the
+    service crashes, the heartbeat stops and the message becomes visible
+    again within minutes instead of waiting out a worst-case processing time.
+    """
+
+    def __init__(self, visibility_timeout: int, interval_seconds: float):
+        self.visibility_timeout = visibility_timeout
+        self.interval_seconds = interval_seconds
+
+        self._in_flight: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def track(self, sqs_msg_list: List[SQSPayload]) -> None:
+        with self._lock:
+            for msg in sqs_msg_list:
+                self._in_flight[msg["sqs_receipt_handle"]] = msg["message_id"]
+
+            set_gauge("embedding_in_flight_messages", len(self._in_flight))
+
+    def untrack(self, sqs_msg_list: List[SQSPayload] | List[EmbedStatus]) -> None:
+        with self._lock:
+            for msg in sqs_msg_list:
+                self._in_flight.pop(msg.get("sqs_receipt_handle", ""), None)
+
+            set_gauge("embedding_in_flight_messages", len(self._in_flight))
+
+    def start(self) -> None:
+        # SQS_HEARTBEAT_INTERVAL=0 turns the heartbeat off.
+        if self._thread is not None or self.interval_seconds <= 0:
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="sqs-visibility-heartbeat", daemon=True
         )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval_seconds):
+            self.beat()
+
+    def beat(self) -> None:
+        with self._lock:
+            in_flight = list(self._in_flight.items())
+
+        if len(in_flight) == 0:
+            return
+
+        try:
+            queue_url = get_secret("/alwayssaved/EMBEDDING_PUSH_QUEUE_URL")
+
+            for start in range(0, len(in_flight), SQS_BATCH_LIMIT):
+                handle_batch = in_flight[start : start + SQS_BATCH_LIMIT]
+
+                response = sqs_client.change_message_visibility_batch(
+                    QueueUrl=queue_url,
+                    Entries=[
+                        {
+                            "Id": str(index),
+                            "ReceiptHandle": receipt_handle,
+                            "VisibilityTimeout": self.visibility_timeout,
+                        }
+                        for index, (receipt_handle, _) in enumerate(handle_batch)
+                    ],
+                )
+
+                for failure in response.get("Failed", []):
+                    receipt_handle, message_id = handle_batch[int(failure["Id"])]
+                    print(
+                        f"⚠️ Could not extend visibility for SQS message {message_id} ({failure.get('Code')}): {failure.get('Message', '')}"
+                    )
+
+                    # An invalid/expired receipt handle will never succeed again.
+                    if failure.get("SenderFault", False):
+                        with self._lock:
+                            self._in_flight.pop(receipt_handle, None)
+
+        except ClientError as e:
+            print(
+                f"❌ AWS Client Error extending SQS visibility in VisibilityHeartbeat: {e.response['Error']['Message']}"
+            )
 
-    except BotoCoreError as e:
-        print(f"❌ Boto3 Internal Error in delete_embedding_sqs_message: {str(e)}")
+        except BotoCoreError as e:
+            print(f"❌ Boto3 Internal Error in VisibilityHeartbeat: {str(e)}")
+
+
+def create_visibility_heartbeat() -> VisibilityHeartbeat:
+    visibility_timeout = get_visibility_timeout()
+
+    # Default to beating three times per timeout window so one slow or
+    # failed ChangeMessageVisibility call doesn't let a message reappear.
+    interval_seconds = float(
+        os.getenv("SQS_HEARTBEAT_INTERVAL", str(visibility_timeout / 3))
+    )
 
-    except Exception as e:
-        print(f"❌ Unexpected Error in delete_embedding_sqs_message: {str(e)}")
+    return VisibilityHeartbeat(visibility_timeout, interval_seconds)
@@ -1,14 +1,175 @@
 import os
+import threading
+import time
 
 import boto3
+from botocore.exceptions import BotoCoreError, ClientError
 
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 
 ssm_client = boto3.client("ssm", region_name=AWS_REGION)
 
+SECRET_TTL_SECONDS = 300
+
+# GetParameters accepts at most 10 names per call.
+GET_PARAMETERS_LIMIT = 10
+
+SERVICE_SECRET_NAMES = [
+    "/alwayssaved/EMBEDDING_PUSH_QUEUE_URL",
+    "/alwayssaved/QDRANT_URL",
+    "/alwayssaved/QDRANT_API_KEY",
+    "/alwayssaved/MONGO_DB_USER",
+    "/alwayssaved/MONGO_DB_PASSWORD",
+    "/alwayssaved/MONGO_DB_BASE_URI",
+    "/alwayssaved/MONGO_DB_NAME",
+    "/alwayssaved/MONGO_DB_CLUSTER_NAME",
+]
+
+# param_name -> (value, monotonic expiry time)
+_secret_cache: dict[str, tuple[str, float]] = {}
+_secret_cache_lock = threading.Lock()
+
+
+def _reset_secret_cache_lock() -> None:
+    # The SQS heartbeat and spool flusher threads read secrets too; a worker
+    # forked while one of them held the lock would otherwise deadlock on its
+    # first get_secret().
+    global _secret_cache_lock
+
+    _secret_cache_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_secret_cache_lock)
+
+# Per-parameter invalidation counts, so long-lived holders of clients built
+# from these secrets (e.g. warm workers) know to rebuild them. Invalidating
+# every secret bumps _all_secrets_generation instead.
+_secret_generations: dict[str, int] = {}
+_all_secrets_generation = 0
+
+
+def get_secret_ttl() -> float:
+    return float(os.getenv("SSM_CACHE_TTL_SECONDS", str(SECRET_TTL_SECONDS)))
+
+
+def _cache_secret(param_name: str, value: str) -> None:
+    with _secret_cache_lock:
+        _secret_cache[param_name] = (value, time.monotonic() + get_secret_ttl())
+
 
 def get_secret(param_name: str) -> str:
-    """Fetches secret from AWS Parameter Store."""
+    """Fetches secret from AWS Parameter Store, served from a TTL cache."""
+
+    with _secret_cache_lock:
+        cached = _secret_cache.get(param_name)
+
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
 
     response = ssm_client.get_parameter(Name=param_name, WithDecryption=True)
-    return response["Parameter"]["Value"].strip()
+    value = response["Parameter"]["Value"].strip()
+
+    _cache_secret(param_name, value)
+
+    return value
+
+
+def get_secret_generation(*param_names: str) -> int:
+    """
+    A number that changes whenever any of param_names (or every secret) is
+    invalidated; compare it to the one a client was built with.
+    """
+
+    with _secret_cache_lock:
+        return _all_secrets_generation + sum(
+            _secret_generations.get(param_name, 0) for param_name in param_names
+        )
+
+
+def invalidate_secret(*param_names: str) -> None:
+    """Drops the given secrets (or every secret if none given) from the cache."""
+
+    global _all_secrets_generation
+
+    with _secret_cache_lock:
+        if len(param_names) == 0:
+            _secret_cache.clear()
+            _all_secrets_generation += 1
+        else:
+            for param_name in param_names:
+                _secret_cache.pop(param_name, None)
+                _secret_generations[param_name] = (
+                    _secret_generations.get(param_name, 0) + 1
+                )
+
+    print(f"♻️ Invalidated cached SSM parameters: {list(param_names) or 'all'}")
+
+
+def prefetch_secrets_by_path(path: str) -> int:
+    """Loads every parameter under path into the cache with GetParametersByPath."""
+
+    fetched = 0
+    paginator = ssm_client.get_paginator("get_parameters_by_path")
+
+    for page in paginator.paginate(Path=path, Recursive=True, WithDecryption=True):
+        for parameter in page.get("Parameters", []):
+            _cache_secret(parameter["Name"], parameter["Value"].strip())
+            fetched += 1
+
+    return fetched
+
+
+def prefetch_secrets(param_names: list[str]) -> int:
+    """Loads the given parameters into the cache with batched GetParameters calls."""
+
+    fetched = 0
+
+    for start in range(0, len(param_names), GET_PARAMETERS_LIMIT):
+        response = ssm_client.get_parameters(
+            Names=param_names[start : start + GET_PARAMETERS_LIMIT],
+            WithDecryption=True,
+        )
+
+        for parameter in response.get("Parameters", []):
+            _cache_secret(parameter["Name"], parameter["Value"].strip())
+            fetched += 1
+
+        for invalid_name in response.get("InvalidParameters", []):
+            print(f"⚠️ SSM parameter {invalid_name} does not exist.")
+
+    return fetched
+
+
+def prefetch_service_secrets() -> None:
+    """
+    Warms the secret cache at startup. Tries one GetParametersByPath call for
+    the whole /alwayssaved/ tree first and falls back to GetParameters for the
+    known names if the role isn't allowed to list by path.
+    """
+
+    path = os.getenv("SSM_PREFETCH_PATH", "/alwayssaved/")
+
+    try:
+        fetched = prefetch_secrets_by_path(path)
+        print(f"✅ Prefetched {fetched} SSM parameters under {path}")
+        return
+
+    except ClientError as e:
+        print(
+            f"⚠️ AWS Client Error in prefetch_secrets_by_path, falling back to GetParameters: {e.response['Error']['Message']}"
+        )
+
+    except BotoCoreError as e:
+        print(f"⚠️ Boto3 Internal Error in prefetch_secrets_by_path: {str(e)}")
+
+    try:
+        fetched = prefetch_secrets(SERVICE_SECRET_NAMES)
+        print(f"✅ Prefetched {fetched} SSM parameters with GetParameters")
+
+    except ClientError as e:
+        print(
+            f"❌ AWS Client Error in prefetch_service_secrets: {e.response['Error']['Message']}"
+        )
+
+    except BotoCoreError as e:
+        print(f"❌ Boto3 Internal Error in prefetch_service_secrets: {str(e)}")
@@ -0,0 +1,265 @@
+import fcntl
+import json
+import os
+import platform
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+EMBEDDING_PARITY_MIN_COSINE = 0.99
+
+# Fixed sentences the backends are compared on; a mix of lengths and styles
+# close to what users upload (notes, transcripts, articles).
+PARITY_SENTENCES = [
+    "Meeting notes: we agreed to ship the billing migration next Tuesday.",
+    "So, um, what I was trying to say in the lecture is that entropy always increases.",
+    "The mitochondria is the powerhouse of the cell.",
+    "Q3 revenue grew 12% year over year, driven mostly by enterprise renewals.",
+    "Remember to call the dentist and reschedule the appointment for Friday.",
+    "In 1969, Apollo 11 landed on the Moon and Neil Armstrong took the first step.",
+    "Preheat the oven to 220°C and roast the vegetables for 25 minutes.",
+    "The defendant's motion to dismiss was denied on procedural grounds.",
+    "TODO: refactor the retry logic and add exponential backoff with jitter.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "ok",
+    "A much longer passage that keeps going, describing the background of the project, "
+    "the people involved, the decisions that were made along the way and the reasons "
+    "behind them, so that the comparison also covers inputs near the model's window.",
+]
+
+
+def get_embedding_backend() -> str:
+    backend = os.getenv("EMBEDDING_BACKEND", "torch").strip().lower()
+
+    if backend not in EMBEDDING_BACKENDS:
+        print(f"⚠️ Unknown EMBEDDING_BACKEND={backend}, using torch.")
+        return "torch"
+
+    return backend
+
+
+def get_model_artifact_dir(model_name: str) -> str:
+    cache_dir = os.getenv(
+        "EMBEDDING_MODEL_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "alwayssaved-embedding"),
+    )
+
+    return os.path.join(cache_dir, model_name.replace("/", "__"))
+
+
+def get_onnx_quantization_config() -> str:
+    """
+    EMBEDDING_ONNX_QUANTIZATION picks the int8 kernel target explicitly;
+    otherwise the best one this CPU supports is detected.
+    """
+
+    configured = os.getenv("EMBEDDING_ONNX_QUANTIZATION", "").strip().lower()
+
+    if configured:
+        return configured
+
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as cpuinfo:
+            cpu_flags = set(
+                next((line for line in cpuinfo if line.startswith("flags")), "").split()
+            )
+    except OSError:
+        cpu_flags = set()
+
+    if "avx512_vnni" in cpu_flags:
+        return "avx512_vnni"
+    if "avx512f" in cpu_flags:
+        return "avx512"
+
+    return "avx2"
+
+
+@contextmanager
+def _artifact_lock(artifact_dir: str):
+    # Several worker processes can start at once; only one should export.
+    os.makedirs(artifact_dir, exist_ok=True)
+
+    with open(os.path.join(artifact_dir, ".lock"), "w", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _load_onnx_model(
+    model_name: str, device: str, quantized: bool
+) -> tuple["SentenceTransformer", str]:
+    """
+    Exports the ONNX (and int8) artifacts into EMBEDDING_MODEL_CACHE_DIR on
+    first use and loads them from there afterwards. Returns the model and
+    the name of the ONNX file it runs.
+    """
+
+    from sentence_transformers import (
+        SentenceTransformer,
+        export_dynamic_quantized_onnx_model,
+    )
+
+    artifact_dir = get_model_artifact_dir(model_name)
+    onnx_file = "onnx/model.onnx"
+
+    with _artifact_lock(artifact_dir):
+        if not os.path.exists(os.path.join(artifact_dir, onnx_file)):
+            print(f"✅ Exporting {model_name} to ONNX in {artifact_dir}")
+            onnx_model = SentenceTransformer(model_name, device=device, backend="onnx")
+            onnx_model.save_pretrained(artifact_dir)
+
+        if quantized:
+            quantization_config = get_onnx_quantization_config()
+            file_suffix = f"qint8_{quantization_config}"
+            onnx_file = f"onnx/model_{file_suffix}.onnx"
+
+            if not os.path.exists(os.path.join(artifact_dir, onnx_file)):
+                print(f"✅ Quantizing {model_name} ONNX model ({quantization_config})")
+                export_dynamic_quantized_onnx_model(
+                    SentenceTransformer(artifact_dir, device=device, backend="onnx"),
+                    quantization_config,
+                    artifact_dir,
+                    file_suffix=file_suffix,
+                )
+
+    import onnxruntime
+    import torch
+
+    # ONNX Runtime would size its thread pool to every core; keep it to the
+    # share torch was given by the worker topology.
+    session_options = onnxruntime.SessionOptions()
+    session_options.intra_op_num_threads = torch.get_num_threads()
+    session_options.inter_op_num_threads = 1
+
+    embedding_model = SentenceTransformer(
+        artifact_dir,
+        device=device,
+        backend="onnx",
+        model_kwargs={"file_name": onnx_file, "session_options": session_options},
+    )
+
+    return embedding_model, onnx_file
+
+
+def check_backend_parity(
+    model_name: str, device: str, embedding_model: "SentenceTransformer"
+) -> float:
+    """Returns the lowest cosine similarity to the PyTorch model over PARITY_SENTENCES."""
+
+    from sentence_transformers import SentenceTransformer
+
+    reference_model = SentenceTransformer(model_name, device=device)
+
+    reference = reference_model.encode(PARITY_SENTENCES, normalize_embeddings=True)
+    candidate = embedding_model.encode(PARITY_SENTENCES, normalize_embeddings=True)
+
+    del reference_model
+
+    return float(np.min(np.sum(reference * candidate, axis=1)))
+
+
+def _parity_marker_path(model_name: str, backend: str, onnx_file: str) -> str:
+    # Named after the backend too, so an onnx and an onnx-int8 check of
+    # the same model never share a result.
+    marker_name = f"{backend}.{os.path.basename(onnx_file)}".replace(
+        ".onnx", ".parity.json"
+    )
+    return os.path.join(get_model_artifact_dir(model_name), marker_name)
+
+
+def _passes_parity(
+    model_name: str,
+    backend: str,
+    device: str,
+    embedding_model: "SentenceTransformer",
+    onnx_file: str,
+) -> bool:
+    min_cosine_required = float(
+        os.getenv("EMBEDDING_PARITY_MIN_COSINE", str(EMBEDDING_PARITY_MIN_COSINE))
+    )
+    artifact_dir = get_model_artifact_dir(model_name)
+    marker_path = _parity_marker_path(model_name, backend, onnx_file)
+
+    # The first process to check an artifact records the result, so forked
+    # workers loading the same artifact don't each load the reference model.
+    # The others wait on the lock and read the finished marker; it's
+    # written to a temp file and renamed, so it's never seen half-written.
+    with _artifact_lock(artifact_dir):
+        if os.path.exists(marker_path):
+            with open(marker_path, encoding="utf-8") as marker:
+                min_cosine = json.load(marker)["min_cosine"]
+        else:
+            min_cosine = check_backend_parity(model_name, device, embedding_model)
+
+            temp_path = f"{marker_path}.{os.getpid()}.tmp"
+
+            with open(temp_path, "w", encoding="utf-8") as marker:
+                json.dump({"min_cosine": min_cosine}, marker)
+
+            os.replace(temp_path, marker_path)
+
+    if min_cosine < min_cosine_required:
+        print(
+            f"⚠️ {onnx_file} parity check failed: min cosine {min_cosine:.5f} < {min_cosine_required}"
+        )
+        return False
+
+    print(f"✅ {onnx_file} parity check passed: min cosine {min_cosine:.5f}")
+    return True
+
+
+def get_loaded_backend(embedding_model: "SentenceTransformer") -> str:
+    """
+    The backend load_embedding_model() actually loaded, which is torch
+    after a fallback whatever EMBEDDING_BACKEND says.
+    """
+
+    return getattr(embedding_model, "embedding_backend", "torch")
+
+
+def load_embedding_model(model_name: str, device: str) -> "SentenceTransformer":
+    """
+    Loads model_name with the EMBEDDING_BACKEND inference backend: torch
+    (default), onnx (ONNX Runtime) or onnx-int8 (dynamically quantized ONNX).
+    ONNX backends must match the PyTorch model within
+    EMBEDDING_PARITY_MIN_COSINE on a fixed sentence set; if they don't, or
+    the optional onnx dependencies (sentence-transformers[onnx]) aren't
+    installed, the PyTorch model is used instead. The backend it ends up
+    with is recorded on the model; see get_loaded_backend().
+    """
+
+    from sentence_transformers import SentenceTransformer
+
+    backend = get_embedding_backend()
+
+    if backend == "torch":
+        return SentenceTransformer(model_name_or_path=model_name, device=device)
+
+    try:
+        embedding_model, onnx_file = _load_onnx_model(
+            model_name, device, quantized=backend == "onnx-int8"
+        )
+
+        if _passes_parity(model_name, backend, device, embedding_model, onnx_file):
+            print(f"✅ Using {backend} embedding backend ({onnx_file})")
+            setattr(embedding_model, "embedding_backend", backend)
+            return embedding_model
+
+    # sentence-transformers reports missing optimum/onnxruntime with a bare
+    # Exception, and a failed export shouldn't take the service down either.
+    except Exception as e:
+        print(f"⚠️ {backend} embedding backend unavailable: {e}")
+
+    print("⚠️ Falling back to the torch embedding backend.")
+
+    return SentenceTransformer(model_name_or_path=model_name, device=device)
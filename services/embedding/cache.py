@@ -0,0 +1,347 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+
+from services.metrics.main import increment
+
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+
+# Hits only touch last_used, so those writes are buffered and committed
+# together once this many keys are pending, after this many seconds, or
+# with the next store().
+CACHE_TOUCH_FLUSH_ENTRIES = 1000
+CACHE_TOUCH_FLUSH_SECONDS = 5.0
+
+KEY_SIZE = 16
+_EMPTY_KEY = bytes(KEY_SIZE)
+
+
+class EmbeddingCache:
+    """
+    Content-addressed on-disk cache of chunk embeddings.
+
+    Entries are keyed by a hash of (model key, chunk text), where the model
+    key names the backend too unless it's torch (see
+    get_embedd_model_key()). Vectors live in a fixed-capacity memory-mapped
+    float32 matrix (vectors.f32) and an SQLite index maps each key to its
+    row ("slot") and last-use time. When every slot is taken, the least
+    recently used entry is overwritten.
+
+    The cache directory can be shared by every worker process on a node.
+    SQLite serializes slot allocation, and a per-slot copy of the key
+    (keys.bin) is cleared before and rewritten after each vector write, so a
+    reader that races an eviction sees a key mismatch and treats the lookup
+    as a miss instead of returning another chunk's vector.
+
+    The capacity is recorded in the index. If EMBEDDING_CACHE_MAX_ENTRIES
+    is lowered, the entries in slots past the new limit are dropped when
+    the cache is opened.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        model_key: str,
+        dimension: int,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+    ):
+        # Each vector width gets its own files so switching models never
+        # mixes row sizes in one memory map.
+        cache_dir = os.path.join(cache_dir, f"dim_{dimension}")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.model_key = model_key
+        self.dimension = dimension
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(cache_dir, "index.sqlite3"),
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, slot INTEGER UNIQUE NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+
+        self._touched: dict[bytes, float] = {}
+        self._last_touch_flush = time.time()
+
+        self._apply_max_entries()
+
+        vector_path = os.path.join(cache_dir, "vectors.f32")
+        key_path = os.path.join(cache_dir, "keys.bin")
+
+        self._vectors = np.memmap(
+            vector_path,
+            dtype=np.float32,
+            mode="r+" if os.path.exists(vector_path) else "w+",
+            shape=(max_entries, dimension),
+        )
+        self._keys = np.memmap(
+            key_path,
+            dtype=np.uint8,
+            mode="r+" if os.path.exists(key_path) else "w+",
+            shape=(max_entries, KEY_SIZE),
+        )
+
+    def key_for(self, chunk: str) -> bytes:
+        digest = hashlib.blake2b(digest_size=KEY_SIZE)
+        digest.update(self.model_key.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(chunk.encode("utf-8"))
+        return digest.digest()
+
+    def _apply_max_entries(self) -> None:
+        self._db.execute("BEGIN IMMEDIATE")
+
+        try:
+            row = self._db.execute(
+                "SELECT value FROM stats WHERE name = 'max_entries'"
+            ).fetchone()
+            dropped = 0
+
+            if row is None or row[0] != self.max_entries:
+                dropped = self._db.execute(
+                    "DELETE FROM entries WHERE slot >= ?", (self.max_entries,)
+                ).rowcount
+
+            self._db.execute(
+                "INSERT INTO stats (name, value) VALUES ('max_entries', ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (self.max_entries,),
+            )
+            self._db.execute("COMMIT")
+
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+        if dropped > 0:
+            print(
+                f"♻️ Embedding cache limit is now {self.max_entries} entries (was {row[0] if row else 'unrecorded'}); dropped {dropped} entries past it."
+            )
+
+    def _write_touches(self) -> None:
+        # Runs inside the caller's transaction.
+        self._db.executemany(
+            "UPDATE entries SET last_used = ? WHERE key = ?",
+            [(used, key) for key, used in self._touched.items()],
+        )
+
+    def _clear_touches(self) -> None:
+        self._touched = {}
+        self._last_touch_flush = time.time()
+
+    def _flush_touches(self) -> None:
+        self._db.execute("BEGIN")
+
+        try:
+            self._write_touches()
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+        self._clear_touches()
+
+    def lookup(self, keys: list[bytes]) -> list[np.ndarray | None]:
+        results: list[np.ndarray | None] = [None] * len(keys)
+
+        with self._lock:
+            slots = {}
+            for start in range(0, len(keys), 500):
+                key_batch = list(set(keys[start : start + 500]))
+                placeholders = ",".join("?" * len(key_batch))
+                rows = self._db.execute(
+                    f"SELECT key, slot FROM entries WHERE key IN ({placeholders})",
+                    key_batch,
+                ).fetchall()
+                slots.update({bytes(key): slot for key, slot in rows})
+
+            hit_keys = []
+            for index, key in enumerate(keys):
+                slot = slots.get(key)
+
+                # A process still running with a larger limit may have
+                # written past ours.
+                if slot is None or slot >= self.max_entries:
+                    continue
+
+                vector = np.array(self._vectors[slot])
+
+                # Seqlock-style check: the slot still has our key after the copy.
+                if self._keys[slot].tobytes() != key:
+                    continue
+
+                results[index] = vector
+                hit_keys.append(key)
+
+            now = time.time()
+            self._touched.update((key, now) for key in hit_keys)
+
+            if (
+                len(self._touched) >= CACHE_TOUCH_FLUSH_ENTRIES
+                or now - self._last_touch_flush >= CACHE_TOUCH_FLUSH_SECONDS
+            ):
+                self._flush_touches()
+
+        return results
+
+    def store(self, keys: list[bytes], vectors: np.ndarray) -> None:
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so two processes can't
+            # hand out the same free/evicted slot.
+            self._db.execute("BEGIN IMMEDIATE")
+
+            try:
+                # Pending touches go first, so a just-hit entry isn't evicted
+                # as least recently used.
+                self._write_touches()
+
+                now = time.time()
+                entry_count = self._count_entries()
+
+                for key, vector in zip(keys, vectors):
+                    existing = self._db.execute(
+                        "SELECT slot FROM entries WHERE key = ?", (key,)
+                    ).fetchone()
+
+                    if existing is not None:
+                        continue
+
+                    slot = self._allocate_slot(entry_count)
+
+                    if slot == entry_count:
+                        entry_count += 1
+
+                    self._keys[slot] = np.frombuffer(_EMPTY_KEY, dtype=np.uint8)
+                    self._vectors[slot] = vector
+                    self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+
+                    self._db.execute(
+                        "INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                        (key, slot, now),
+                    )
+
+                self._vectors.flush()
+                self._keys.flush()
+                self._db.execute("COMMIT")
+
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+            self._clear_touches()
+
+    def _count_entries(self) -> int:
+        # Entries are only ever removed by eviction, which hands its slot
+        # straight to the new entry, or by lowering the limit, which drops
+        # the highest slots; so occupied slots are always 0..count-1, and
+        # the count is one past the highest slot, read off the slot index.
+        (entry_count,) = self._db.execute(
+            "SELECT COALESCE(MAX(slot) + 1, 0) FROM entries WHERE slot < ?",
+            (self.max_entries,),
+        ).fetchone()
+
+        return entry_count
+
+    def _allocate_slot(self, entry_count: int) -> int:
+        """
+        entry_count is _count_entries() as of this store(), kept up to date
+        by the caller; it only changes inside the store's write transaction.
+        """
+
+        if entry_count < self.max_entries:
+            return entry_count
+
+        # Full: evict the least recently used entry and take its slot.
+        key, slot = self._db.execute(
+            "SELECT key, slot FROM entries WHERE slot < ? ORDER BY last_used LIMIT 1",
+            (self.max_entries,),
+        ).fetchone()
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+        return slot
+
+
+def encode_with_cache(
+    chunks: list[str],
+    encode: Callable[[list[str]], np.ndarray],
+    embedding_cache: EmbeddingCache,
+) -> np.ndarray:
+    """Returns vectors for chunks, only sending cache misses through encode()."""
+
+    keys = [embedding_cache.key_for(chunk) for chunk in chunks]
+    cached_vectors = embedding_cache.lookup(keys)
+
+    vectors = np.empty((len(chunks), embedding_cache.dimension), dtype=np.float32)
+
+    # Identical chunks within one document are encoded once.
+    miss_positions: dict[bytes, list[int]] = {}
+
+    for index, (key, cached_vector) in enumerate(zip(keys, cached_vectors)):
+        if cached_vector is None:
+            miss_positions.setdefault(key, []).append(index)
+        else:
+            vectors[index] = cached_vector
+
+    if len(miss_positions) > 0:
+        miss_keys = list(miss_positions)
+        miss_vectors = encode([chunks[miss_positions[key][0]] for key in miss_keys])
+
+        for key, vector in zip(miss_keys, miss_vectors):
+            vectors[miss_positions[key]] = vector
+
+        embedding_cache.store(miss_keys, miss_vectors)
+
+    miss_count = sum(len(positions) for positions in miss_positions.values())
+
+    increment("embedding_cache_hits_total", len(chunks) - miss_count)
+    increment("embedding_cache_misses_total", miss_count)
+
+    return vectors
+
+
+_embedding_cache: tuple[int, EmbeddingCache] | None = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache(model_key: str, dimension: int) -> EmbeddingCache | None:
+    """
+    Returns this process's EmbeddingCache, or None when EMBEDDING_CACHE_DIR
+    isn't set. SQLite connections can't cross a fork, so each pid opens its own.
+    """
+
+    global _embedding_cache
+
+    cache_dir = os.getenv("EMBEDDING_CACHE_DIR", "").strip()
+
+    if not cache_dir:
+        return None
+
+    with _embedding_cache_lock:
+        if _embedding_cache is None or _embedding_cache[0] != os.getpid():
+            max_entries = int(
+                os.getenv(
+                    "EMBEDDING_CACHE_MAX_ENTRIES", str(EMBEDDING_CACHE_MAX_ENTRIES)
+                )
+            )
+            _embedding_cache = (
+                os.getpid(),
+                EmbeddingCache(cache_dir, model_key, dimension, max_entries),
+            )
+
+        return _embedding_cache[1]
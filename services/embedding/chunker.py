@@ -0,0 +1,238 @@
+import copy
+import os
+import re
+import threading
+from itertools import islice
+from typing import Any, Iterable, Iterator
+
+from services.embedding.utils.main import chunk_text
+
+CHUNK_OVERLAP_TOKENS = 32
+TOKENIZE_BATCH_SIZE = 256
+
+# A run of text with no sentence boundary at all (e.g. a minified page) is
+# cut at the last whitespace once the carried-over buffer grows this large.
+MAX_SENTENCE_BUFFER_CHARS = 20_000
+
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n\s*")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _iter_text_pieces(text: str | Iterable[str]) -> Iterator[str]:
+    if isinstance(text, str):
+        yield text
+    else:
+        yield from text
+
+
+def iter_sentences(text: str | Iterable[str]) -> Iterator[tuple[str, bool]]:
+    """
+    Splits text into (sentence, ends_paragraph) pairs.
+
+    text can be a single string or an iterable of pieces (e.g. PDF pages as
+    they're extracted). Whatever trails the last boundary of a piece is held
+    back and joined with the next piece, so sentences spanning pieces stay
+    whole.
+    """
+
+    buffer = ""
+
+    for piece in _iter_text_pieces(text):
+        buffer = f"{buffer}\n{piece}" if buffer else piece
+
+        paragraphs = _PARAGRAPH_BREAK.split(buffer)
+        buffer = paragraphs.pop()
+
+        for paragraph in paragraphs:
+            sentences = [s for s in _SENTENCE_END.split(paragraph.strip()) if s]
+            for position, sentence in enumerate(sentences):
+                yield sentence, position == len(sentences) - 1
+
+        sentences = _SENTENCE_END.split(buffer)
+        buffer = sentences.pop()
+
+        for sentence in sentences:
+            if sentence.strip():
+                yield sentence.strip(), False
+
+        if len(buffer) > MAX_SENTENCE_BUFFER_CHARS:
+            cut = buffer.rfind(" ", 0, MAX_SENTENCE_BUFFER_CHARS)
+            cut = cut if cut > 0 else MAX_SENTENCE_BUFFER_CHARS
+            if buffer[:cut].strip():
+                yield buffer[:cut].strip(), False
+            buffer = buffer[cut:]
+
+    if buffer.strip():
+        yield buffer.strip(), True
+
+
+class TokenChunker:
+    """
+    Groups sentences into chunks that fit the embedding model's token window.
+
+    Sentences are tokenized in batches of tokenize_batch_size with the
+    model's own (fast) tokenizer and packed into chunks of at most
+    max_tokens tokens without splitting a sentence. Consecutive chunks share
+    up to overlap_tokens worth of whole trailing sentences. A single sentence
+    longer than the window is split on token offsets instead. Chunks are
+    yielded as soon as they're full, so encoding can start before the whole
+    document has been split.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Any,
+        max_tokens: int,
+        overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+        tokenize_batch_size: int = TOKENIZE_BATCH_SIZE,
+    ):
+        self.tokenizer = tokenizer
+        self.max_tokens = max(1, max_tokens)
+        self.overlap_tokens = max(0, min(overlap_tokens, self.max_tokens // 2))
+        self.tokenize_batch_size = max(1, tokenize_batch_size)
+
+    def _split_long_sentence(
+        self, sentence: str, offsets: list[tuple[int, int]]
+    ) -> Iterator[str]:
+        step = self.max_tokens - self.overlap_tokens
+
+        for start in range(0, len(offsets), step):
+            window = offsets[start : start + self.max_tokens]
+            yield sentence[window[0][0] : window[-1][1]]
+
+            if start + self.max_tokens >= len(offsets):
+                return
+
+    def _overlap_tail(
+        self, current: list[tuple[str, int, bool]]
+    ) -> list[tuple[str, int, bool]]:
+        tail: list[tuple[str, int, bool]] = []
+        tail_tokens = 0
+
+        for sentence in reversed(current):
+            if tail_tokens + sentence[1] > self.overlap_tokens:
+                break
+            tail.insert(0, sentence)
+            tail_tokens += sentence[1]
+
+        return tail
+
+    @staticmethod
+    def _join(current: list[tuple[str, int, bool]]) -> str:
+        parts = []
+
+        for position, (sentence, _, ends_paragraph) in enumerate(current):
+            parts.append(sentence)
+            if position < len(current) - 1:
+                parts.append("\n\n" if ends_paragraph else " ")
+
+        return "".join(parts)
+
+    def iter_chunks(self, text: str | Iterable[str]) -> Iterator[str]:
+        sentences = iter_sentences(text)
+
+        # (sentence, token count, ends_paragraph)
+        current: list[tuple[str, int, bool]] = []
+        current_tokens = 0
+        has_new_content = False
+
+        while True:
+            sentence_batch = list(islice(sentences, self.tokenize_batch_size))
+
+            if len(sentence_batch) == 0:
+                break
+
+            encoded = self.tokenizer(
+                [sentence for sentence, _ in sentence_batch],
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+            )
+
+            for (sentence, ends_paragraph), offsets in zip(
+                sentence_batch, encoded["offset_mapping"]
+            ):
+                token_count = len(offsets)
+
+                if token_count > self.max_tokens:
+                    if has_new_content:
+                        yield self._join(current)
+
+                    yield from self._split_long_sentence(sentence, offsets)
+
+                    current, current_tokens, has_new_content = [], 0, False
+                    continue
+
+                if current_tokens + token_count > self.max_tokens and has_new_content:
+                    yield self._join(current)
+
+                    current = self._overlap_tail(current)
+                    current_tokens = sum(tokens for _, tokens, _ in current)
+                    has_new_content = False
+
+                    if current_tokens + token_count > self.max_tokens:
+                        current, current_tokens = [], 0
+
+                current.append((sentence, token_count, ends_paragraph))
+                current_tokens += token_count
+                has_new_content = True
+
+        if has_new_content:
+            yield self._join(current)
+
+
+_thread_tokenizers = threading.local()
+
+
+def get_thread_tokenizer(tokenizer: Any) -> Any:
+    """
+    Returns this thread's private copy of tokenizer. Fast (Rust) tokenizers
+    raise "Already borrowed" when two threads use one instance at once, and
+    the model tokenizes inside encode() on the scheduler thread while
+    message threads are chunking.
+    """
+
+    copies = getattr(_thread_tokenizers, "copies", None)
+
+    if copies is None:
+        copies = _thread_tokenizers.copies = {}
+
+    if id(tokenizer) not in copies:
+        copies[id(tokenizer)] = (tokenizer, copy.deepcopy(tokenizer))
+
+    return copies[id(tokenizer)][1]
+
+
+def iter_chunks(text: str | Iterable[str], embedding_model: Any) -> Iterator[str]:
+    """
+    Yields chunks for text. CHUNKER=token (default) uses TokenChunker with the
+    model's tokenizer; CHUNKER=char keeps the original fixed-size character
+    slicing of chunk_text().
+    """
+
+    tokenizer = getattr(embedding_model, "tokenizer", None)
+
+    # Offsets are needed to split over-long sentences, and only fast
+    # (Rust) tokenizers provide them.
+    if (
+        os.getenv("CHUNKER", "token").strip().lower() == "char"
+        or tokenizer is None
+        or not getattr(tokenizer, "is_fast", False)
+    ):
+        full_text = text if isinstance(text, str) else "\n".join(text)
+        yield from chunk_text(full_text)
+        return
+
+    # Leave room for the [CLS]/[SEP] tokens the model adds to every input.
+    model_max_tokens = embedding_model.max_seq_length - 2
+
+    max_tokens = int(os.getenv("CHUNK_MAX_TOKENS", str(model_max_tokens)))
+
+    chunker = TokenChunker(
+        get_thread_tokenizer(tokenizer),
+        max_tokens=min(max_tokens, model_max_tokens),
+        overlap_tokens=int(
+            os.getenv("CHUNK_OVERLAP_TOKENS", str(CHUNK_OVERLAP_TOKENS))
+        ),
+    )
+
+    yield from chunker.iter_chunks(text)
@@ -0,0 +1,249 @@
+import functools
+import hashlib
+import os
+import re
+import zlib
+
+import numpy as np
+from qdrant_client import QdrantClient
+
+from services.qdrant.main import get_user_points_by_minhash_band
+from services.utils.types.main import SQSPayload
+
+CHUNK_DEDUP_THRESHOLD = 0.85
+CHUNK_DEDUP_NUM_PERM = 64
+
+# Chunks are compared as sets of overlapping word n-grams ("shingles").
+SHINGLE_WORDS = 3
+
+# MinHash permutations are (a * x + b) mod p over 31-bit shingle hashes, so
+# a * x never overflows uint64. The fixed seed keeps signatures comparable
+# across processes and restarts, which the cross-file lookup relies on.
+_PRIME = (1 << 31) - 1
+_SEED = 0x5EED
+
+_WORD = re.compile(r"\w+")
+
+DEDUP_MODES = ("off", "drop", "reuse")
+
+
+@functools.lru_cache(maxsize=4)
+def _get_permutations(num_perm: int) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(_SEED)
+    a = rng.integers(1, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+    b = rng.integers(0, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+
+    return a, b
+
+
+def get_minhash_signature(text: str, num_perm: int) -> np.ndarray:
+    words = _WORD.findall(text.lower())
+    shingles = {
+        " ".join(words[start : start + SHINGLE_WORDS])
+        for start in range(max(1, len(words) - SHINGLE_WORDS + 1))
+    }
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) & _PRIME for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    a, b = _get_permutations(num_perm)
+
+    return ((a * hashes + b) % _PRIME).min(axis=1)
+
+
+def get_lsh_bands(threshold: float, num_perm: int) -> tuple[int, int]:
+    """
+    (bands, rows) with bands * rows == num_perm. Two signatures become
+    candidates when all rows of any band match, which happens most often
+    above a similarity of about (1 / bands) ** (1 / rows). The highest such
+    point that is still at or below threshold is used, so few true
+    near-duplicates are missed; candidates are checked against threshold
+    afterwards.
+    """
+
+    best = (num_perm, 1)
+
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows != 0:
+            continue
+
+        bands = num_perm // rows
+
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+
+    return best
+
+
+class MinHashIndex:
+    """
+    MinHash signatures bucketed by LSH band, for finding an already indexed
+    text whose estimated Jaccard similarity is at least threshold without
+    comparing against every entry.
+    """
+
+    def __init__(
+        self,
+        threshold: float = CHUNK_DEDUP_THRESHOLD,
+        num_perm: int = CHUNK_DEDUP_NUM_PERM,
+    ):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = get_lsh_bands(threshold, num_perm)
+
+        self._buckets: dict[str, list[int]] = {}
+        self._signatures: dict[int, np.ndarray] = {}
+
+    def signature(self, text: str) -> np.ndarray:
+        return get_minhash_signature(text, self.num_perm)
+
+    def band_keys(self, signature: np.ndarray) -> list[str]:
+        # The layout is part of the key, so changing CHUNK_DEDUP_NUM_PERM or
+        # the threshold never matches bands stored under the old settings.
+        return [
+            f"{self.num_perm}.{self.rows}.{band}:"
+            + hashlib.blake2b(
+                signature[band * self.rows : (band + 1) * self.rows].tobytes(),
+                digest_size=8,
+            ).hexdigest()
+            for band in range(self.bands)
+        ]
+
+    def add(self, key: int, signature: np.ndarray) -> None:
+        self._signatures[key] = signature
+
+        for band_key in self.band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(key)
+
+    def find(self, signature: np.ndarray) -> int | None:
+        """Key of the most similar entry at or above threshold, if any."""
+
+        best_key = None
+        best_similarity = self.threshold
+
+        for band_key in self.band_keys(signature):
+            for key in self._buckets.get(band_key, ()):
+                similarity = float(np.mean(self._signatures[key] == signature))
+
+                if similarity > best_similarity or (
+                    best_key is None and similarity >= best_similarity
+                ):
+                    best_key, best_similarity = key, similarity
+
+        return best_key
+
+
+class ChunkDeduplicator:
+    """
+    Finds near-duplicate chunks of one document before they're encoded.
+
+    Every chunk is checked against the chunks kept so far; one whose
+    estimated Jaccard similarity to a kept chunk reaches threshold is a
+    near-duplicate of it, and duplicate_of maps its index to the kept
+    chunk's index. With across_files, find_user_duplicates() also looks for
+    matching chunks in the user's other files through the minhash_bands
+    payload field of their points.
+    """
+
+    def __init__(
+        self,
+        chunks: list[str],
+        mode: str = "drop",
+        threshold: float = CHUNK_DEDUP_THRESHOLD,
+        num_perm: int = CHUNK_DEDUP_NUM_PERM,
+        across_files: bool = False,
+    ):
+        self.mode = mode
+        self.across_files = across_files
+        self._index = MinHashIndex(threshold, num_perm)
+
+        self.signatures = [self._index.signature(chunk) for chunk in chunks]
+        self.duplicate_of: dict[int, int] = {}
+
+        for chunk_index, signature in enumerate(self.signatures):
+            kept_index = self._index.find(signature)
+
+            if kept_index is None:
+                self._index.add(chunk_index, signature)
+            else:
+                self.duplicate_of[chunk_index] = kept_index
+
+    def band_keys(self, chunk_index: int) -> list[str]:
+        return self._index.band_keys(self.signatures[chunk_index])
+
+    def find_user_duplicates(
+        self,
+        q_client: QdrantClient,
+        sqs_payload: SQSPayload,
+        model_key: str,
+        chunk_indexes: list[int],
+    ) -> dict[int, tuple[str, np.ndarray]]:
+        """
+        Returns {chunk index: (point id, vector)} for the chunks that nearly
+        repeat a chunk already stored for another of the user's files. Only
+        points whose embedding_model_key is model_key are matched, so a
+        vector from another model or backend is never copied.
+        """
+
+        if not self.across_files or len(chunk_indexes) == 0:
+            return {}
+
+        band_keys = {key for index in chunk_indexes for key in self.band_keys(index)}
+
+        records = get_user_points_by_minhash_band(
+            q_client,
+            sqs_payload.get("user_id", ""),
+            sqs_payload.get("file_id", ""),
+            model_key,
+            sorted(band_keys),
+        )
+
+        # Candidates are re-checked against their own text, not trusted on
+        # a shared band alone.
+        stored_index = MinHashIndex(self._index.threshold, self._index.num_perm)
+
+        for position, record in enumerate(records):
+            stored_text = (record.payload or {}).get("original_chunk_text", "")
+            stored_index.add(position, stored_index.signature(stored_text))
+
+        user_duplicates = {}
+
+        for chunk_index in chunk_indexes:
+            position = stored_index.find(self.signatures[chunk_index])
+
+            if position is not None and isinstance(records[position].vector, list):
+                user_duplicates[chunk_index] = (
+                    str(records[position].id),
+                    np.asarray(records[position].vector, dtype=np.float32),
+                )
+
+        return user_duplicates
+
+
+def get_chunk_dedup_mode() -> str:
+    mode = os.getenv("CHUNK_DEDUP", "off").strip().lower()
+
+    if mode not in DEDUP_MODES:
+        print(f"⚠️ Unknown CHUNK_DEDUP {mode!r}; chunks are not deduplicated.")
+        return "off"
+
+    return mode
+
+
+def create_chunk_deduplicator(chunks: list[str]) -> ChunkDeduplicator | None:
+    """Returns None unless CHUNK_DEDUP is drop or reuse."""
+
+    mode = get_chunk_dedup_mode()
+
+    if mode == "off":
+        return None
+
+    return ChunkDeduplicator(
+        chunks,
+        mode=mode,
+        threshold=float(os.getenv("CHUNK_DEDUP_THRESHOLD", str(CHUNK_DEDUP_THRESHOLD))),
+        num_perm=int(os.getenv("CHUNK_DEDUP_NUM_PERM", str(CHUNK_DEDUP_NUM_PERM))),
+        across_files=os.getenv("CHUNK_DEDUP_ACROSS_FILES", "false").strip().lower()
+        == "true",
+    )
@@ -1,19 +1,54 @@
+import hashlib
 import os
+import time
 import traceback
 import uuid
+from typing import TYPE_CHECKING, Iterable
 
-import boto3
-from qdrant_client import QdrantClient, models
-from sentence_transformers import SentenceTransformer
+import numpy as np
+from botocore.client import BaseClient
+from qdrant_client import QdrantClient
 
-from services.aws.s3 import download_file_from_s3, extract_text_from_s3_bytes
+from services.aws.s3 import (
+    download_file_from_s3,
+    get_s3_client,
+    iter_text_from_s3_bytes,
+    release_file_source,
+)
+from services.embedding.cache import encode_with_cache, get_embedding_cache
+from services.embedding.chunker import iter_chunks
+from services.embedding.dedup import create_chunk_deduplicator, get_chunk_dedup_mode
+from services.embedding.scheduler import EmbeddingScheduler
 from services.embedding.utils.main import (
-    chunk_text,
     get_embedd_model,
+    get_embedd_model_key,
     handle_msg_feedback,
 )
-from services.qdrant.main import get_qdrant_client
-from services.utils.types.main import EmbedStatus, SQSPayload
+from services.metrics.main import (
+    TimedIterator,
+    increment,
+    observe,
+    observe_stage,
+    time_stage,
+    timed_stage,
+)
+from services.qdrant.main import (
+    delete_points,
+    get_file_point_ids,
+    get_qdrant_client,
+    invalidate_on_qdrant_auth_error,
+)
+from services.qdrant.spool import get_spool_dir, spool_pending_upload
+from services.qdrant.writer import create_qdrant_writer
+from services.utils.types.main import (
+    EmbedStatus,
+    PendingUpload,
+    SQSPayload,
+    StreamProgress,
+)
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 QDRANT_COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "alwayssaved_user_files")
 
@@ -26,19 +61,500 @@ def get_base_error_feedback(
     return f"❌ Unexpected {error_type} occurred for sqs_payload with message_id={message_id} and transcript_s3_key={transcript_s3_key}"
 
 
+@timed_stage("encode")
+def encode_chunks(
+    chunks: list[str],
+    embedding_model: "SentenceTransformer",
+    embedding_scheduler: EmbeddingScheduler | None = None,
+) -> np.ndarray:
+    """
+    Encodes chunks through the shared scheduler when there is one, and
+    checks the content-addressed embedding cache (EMBEDDING_CACHE_DIR) first
+    so only chunks that were never embedded before reach the model.
+    """
+
+    def encode(texts: list[str]) -> np.ndarray:
+        if embedding_scheduler is not None:
+            return embedding_scheduler.embed(texts)
+        return embedding_model.encode(texts, normalize_embeddings=True)
+
+    embedding_cache = get_embedding_cache(
+        get_embedd_model_key(embedding_model),
+        embedding_model.get_sentence_embedding_dimension(),
+    )
+
+    if embedding_cache is None:
+        return encode(chunks)
+
+    return encode_with_cache(chunks, encode, embedding_cache)
+
+
+# Fixed namespace so the same (file, chunk) always maps to the same point id.
+POINT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "alwayssaved/embedding-points")
+
+
+def get_chunk_hash(chunk: str) -> str:
+    return hashlib.blake2b(chunk.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get_point_id(
+    model_key: str, file_id: str, chunk_index: int, chunk_hash: str
+) -> str:
+    # The model (and a non-torch backend) is part of the id so switching
+    # either re-embeds every chunk instead of keeping the old vectors. See
+    # get_embedd_model_key().
+    return str(
+        uuid.uuid5(
+            POINT_ID_NAMESPACE,
+            f"{model_key}:{file_id}:{chunk_index}:{chunk_hash}",
+        )
+    )
+
+
+def build_qdrant_payload(
+    sqs_payload: SQSPayload, chunked_text: str, chunk_index: int, chunk_hash: str
+) -> dict:
+    return {
+        "note_id": sqs_payload.get("note_id", None),
+        "file_id": sqs_payload.get("file_id", None),
+        "user_id": sqs_payload.get("user_id", None),
+        "s3_key": sqs_payload.get("transcript_s3_key", None),
+        "original_chunk_text": chunked_text,
+        "chunk_index": chunk_index,
+        "chunk_hash": chunk_hash,
+    }
+
+
+def record_document_chunks(chunk_count: int) -> None:
+    increment("embedding_chunks_total", chunk_count)
+    observe("embedding_document_chunks", chunk_count)
+
+
+def get_existing_point_ids(
+    qdrant_client: QdrantClient, file_id: str
+) -> set[str] | None:
+    """
+    get_file_point_ids(), except that with the write-ahead spool on, a
+    failed lookup returns None instead of failing the message: every chunk
+    is then encoded and spooled, and the flusher works out the stale points
+    once Qdrant is back.
+    """
+
+    try:
+        return get_file_point_ids(qdrant_client, file_id)
+    except Exception as e:
+        if not get_spool_dir():
+            raise
+
+        print(
+            f"⚠️ Could not look up the stored points of file_id {file_id} ({type(e).__name__}: {e}); encoding every chunk for the spool."
+        )
+
+        return None
+
+
+def encode_changed_chunks(
+    qdrant_client: QdrantClient,
+    sqs_payload: SQSPayload,
+    chunks: list[str],
+    embedding_model: "SentenceTransformer",
+    embedding_scheduler: EmbeddingScheduler | None = None,
+) -> PendingUpload:
+    """
+    Point ids are derived from (file_id, chunk index, chunk hash), so a
+    chunk whose point already exists for this file_id is unchanged and is
+    neither re-embedded nor re-uploaded. Only new/changed chunks are
+    encoded, and points of this file_id that no longer match a chunk are
+    returned as stale.
+
+    With CHUNK_DEDUP=drop, near-duplicates of an earlier chunk get no point
+    of their own; the kept chunk lists their indexes in
+    duplicate_chunk_indexes and their texts in duplicate_chunk_texts, so a
+    hit on the kept chunk still returns what the dropped ones said. With
+    CHUNK_DEDUP=reuse they're stored with the kept chunk's vector instead
+    of being encoded. Either way, chunks that nearly repeat a chunk of the
+    user's other files reuse its vector when CHUNK_DEDUP_ACROSS_FILES=true.
+    Reused vectors are marked with the point id they came from in
+    duplicate_of.
+
+    With the write-ahead spool on, a failed lookup of the stored points
+    treats every chunk as changed; see get_existing_point_ids().
+    """
+
+    file_id = sqs_payload.get("file_id", "")
+    model_key = get_embedd_model_key(embedding_model)
+
+    looked_up_point_ids = get_existing_point_ids(qdrant_client, file_id)
+    existing_point_ids = looked_up_point_ids or set()
+
+    with time_stage("dedup"):
+        deduplicator = create_chunk_deduplicator(chunks)
+
+    duplicate_of = deduplicator.duplicate_of if deduplicator is not None else {}
+    drop_duplicates = deduplicator is not None and deduplicator.mode == "drop"
+
+    # Kept chunk index -> the near-duplicates dropped in its favour.
+    dropped_indexes: dict[int, list[int]] = {}
+
+    if drop_duplicates:
+        for chunk_index, kept_index in sorted(duplicate_of.items()):
+            dropped_indexes.setdefault(kept_index, []).append(chunk_index)
+
+    point_ids = []
+    payloads = []
+    changed_indexes = []
+    current_point_ids = set()
+    chunk_point_ids: dict[int, str] = {}
+
+    for chunk_index, chunked_text in enumerate(chunks):
+        if drop_duplicates and chunk_index in duplicate_of:
+            continue
+
+        chunk_hash = get_chunk_hash(chunked_text)
+        dropped = dropped_indexes.get(chunk_index, [])
+
+        # The dropped chunks are part of the point's identity, so their
+        # stored texts are rewritten when any of them changes.
+        point_hash = chunk_hash
+
+        if dropped:
+            point_hash = get_chunk_hash(
+                "\0".join(
+                    [chunked_text]
+                    + [f"{index}:{get_chunk_hash(chunks[index])}" for index in dropped]
+                )
+            )
+
+        point_id = get_point_id(model_key, file_id, chunk_index, point_hash)
+        current_point_ids.add(point_id)
+        chunk_point_ids[chunk_index] = point_id
+
+        if point_id in existing_point_ids:
+            continue
+
+        payload = build_qdrant_payload(
+            sqs_payload, chunked_text, chunk_index, chunk_hash
+        )
+
+        if dropped:
+            payload["duplicate_chunk_indexes"] = dropped
+            payload["duplicate_chunk_texts"] = [chunks[index] for index in dropped]
+
+        if deduplicator is not None and deduplicator.across_files:
+            payload["minhash_bands"] = deduplicator.band_keys(chunk_index)
+            payload["embedding_model_key"] = model_key
+
+        point_ids.append(point_id)
+        payloads.append(payload)
+        changed_indexes.append(chunk_index)
+
+    dimension = embedding_model.get_sentence_embedding_dimension()
+    vectors = np.empty((len(changed_indexes), dimension), dtype=np.float32)
+
+    # Each changed chunk takes its vector from its kept chunk (reuse mode),
+    # from a near-duplicate in another file, or from encoding its own text.
+    # A kept chunk that is unchanged has no vector at hand, so its changed
+    # near-duplicates stand for themselves.
+    changed_set = set(changed_indexes)
+    source_indexes = []
+
+    for chunk_index in changed_indexes:
+        kept_index = duplicate_of.get(chunk_index, chunk_index)
+        source_indexes.append(kept_index if kept_index in changed_set else chunk_index)
+
+    # Without the stored points there's no reaching Qdrant for other files'
+    # points either.
+    user_duplicates = (
+        deduplicator.find_user_duplicates(
+            qdrant_client,
+            sqs_payload,
+            model_key,
+            sorted(set(source_indexes)),
+        )
+        if deduplicator is not None and looked_up_point_ids is not None
+        else {}
+    )
+
+    encode_rows: dict[int, int] = {}
+    # Row in texts_to_encode for each changed chunk; None when reused.
+    encode_row_by_position: list[int | None] = []
+    texts_to_encode = []
+    reused_in_document = 0
+    reused_from_user = 0
+
+    for position, (chunk_index, source_index) in enumerate(
+        zip(changed_indexes, source_indexes)
+    ):
+        if source_index in user_duplicates:
+            source_point_id, vectors[position] = user_duplicates[source_index]
+            payloads[position]["duplicate_of"] = source_point_id
+            encode_row_by_position.append(None)
+            reused_from_user += 1
+            continue
+
+        if source_index != chunk_index:
+            payloads[position]["duplicate_of"] = chunk_point_ids[source_index]
+            reused_in_document += 1
+
+        if source_index not in encode_rows:
+            encode_rows[source_index] = len(texts_to_encode)
+            texts_to_encode.append(chunks[source_index])
+
+        encode_row_by_position.append(encode_rows[source_index])
+
+    if len(texts_to_encode) > 0:
+        encoded = np.asarray(
+            encode_chunks(texts_to_encode, embedding_model, embedding_scheduler)
+        )
+
+        for position, row in enumerate(encode_row_by_position):
+            if row is not None:
+                vectors[position] = encoded[row]
+
+    stale_point_ids = sorted(existing_point_ids - current_point_ids)
+
+    print(
+        f"♻️ file_id {file_id}: {len(current_point_ids) - len(changed_indexes)} unchanged, {len(changed_indexes)} new/changed, {len(stale_point_ids)} stale chunks"
+    )
+
+    # Only the drops recorded on points written this time.
+    dropped_count = sum(
+        len(payload.get("duplicate_chunk_indexes", [])) for payload in payloads
+    )
+
+    if dropped_count + reused_in_document + reused_from_user > 0:
+        increment(
+            "embedding_duplicate_chunks_total",
+            dropped_count,
+            scope="document",
+            action="dropped",
+        )
+        increment(
+            "embedding_duplicate_chunks_total",
+            reused_in_document,
+            scope="document",
+            action="reused",
+        )
+        increment(
+            "embedding_duplicate_chunks_total",
+            reused_from_user,
+            scope="user",
+            action="reused",
+        )
+        print(
+            f"♻️ file_id {file_id}: {dropped_count} near-duplicate chunks dropped, {reused_in_document + reused_from_user} reuse another chunk's vector ({reused_from_user} from other files)"
+        )
+
+    return {
+        "point_ids": point_ids,
+        "payloads": payloads,
+        "vectors": vectors,
+        "stale_point_ids": stale_point_ids,
+        "current_point_ids": sorted(current_point_ids),
+    }
+
+
+@timed_stage("qdrant_upsert")
+def upload_chunks(qdrant_client: QdrantClient, pending_upload: PendingUpload) -> int:
+    """
+    Upserts the new/changed points, then deletes the stale ones, and returns
+    how many points were written. Stale points are only removed after the
+    replacements are in, so the document stays searchable throughout; if
+    either step fails, redelivery repeats it idempotently.
+    """
+
+    qdrant_writer = create_qdrant_writer(qdrant_client, QDRANT_COLLECTION_NAME)
+
+    point_count = qdrant_writer.write(
+        pending_upload["point_ids"],
+        pending_upload["vectors"],
+        pending_upload["payloads"],
+    )
+
+    if len(pending_upload["stale_point_ids"]) > 0:
+        delete_points(qdrant_client, pending_upload["stale_point_ids"])
+
+    increment("embedding_points_upserted_total", point_count)
+
+    return point_count
+
+
+def store_chunks(
+    qdrant_client: QdrantClient, sqs_payload: SQSPayload, pending_upload: PendingUpload
+) -> int:
+    """
+    Hands the points to the write-ahead spool when QDRANT_SPOOL_DIR is set
+    (its flusher uploads them later), or uploads them right away.
+    """
+
+    if spool_pending_upload(sqs_payload, pending_upload):
+        return len(pending_upload["point_ids"])
+
+    return upload_chunks(qdrant_client, pending_upload)
+
+
+def get_stream_batch_chunks() -> int:
+    """EMBED_STREAM_BATCH_CHUNKS > 0 turns on stream_chunks_to_qdrant()."""
+
+    return int(os.getenv("EMBED_STREAM_BATCH_CHUNKS", "0"))
+
+
+def stream_chunks_to_qdrant(
+    qdrant_client: QdrantClient,
+    sqs_payload: SQSPayload,
+    chunks: Iterable[str],
+    embedding_model: "SentenceTransformer",
+    batch_chunks: int,
+    embedding_scheduler: EmbeddingScheduler | None = None,
+) -> StreamProgress:
+    """
+    Bounded-memory version of encode_changed_chunks() + upload_chunks(): new
+    or changed chunks are pulled from the chunks generator, encoded and
+    upserted batch_chunks at a time, so only one micro-batch of texts and
+    vectors is held no matter how long the document is. Point ids are still
+    O(chunks): the file's stored ids (shrinking to the stale ones as chunks
+    turn out unchanged), plus the ids this run uploads when
+    EMBED_STREAM_CLEANUP_ON_FAILURE=true.
+
+    Point ids are deterministic, so a failed run resumes on redelivery:
+    micro-batches already upserted are found as unchanged and skipped.
+    With EMBED_STREAM_CLEANUP_ON_FAILURE=true, the points this run wrote are
+    deleted instead, so a document that won't be retried doesn't stay
+    half-indexed. Stale points are only deleted once every chunk is in.
+
+    CHUNK_DEDUP doesn't apply here: finding near-duplicates needs every
+    chunk of the document at once.
+    """
+
+    file_id = sqs_payload.get("file_id", "")
+
+    if get_chunk_dedup_mode() != "off":
+        print(
+            f"⚠️ CHUNK_DEDUP is ignored in streaming mode (EMBED_STREAM_BATCH_CHUNKS); file_id {file_id} is stored without deduplication."
+        )
+
+    model_key = get_embedd_model_key(embedding_model)
+
+    # Unchanged chunks are removed as they're seen; what's left once every
+    # chunk is in is stale.
+    stale_candidate_ids = get_file_point_ids(qdrant_client, file_id)
+    cleanup_on_failure = (
+        os.getenv("EMBED_STREAM_CLEANUP_ON_FAILURE", "false").strip().lower() == "true"
+    )
+
+    qdrant_writer = create_qdrant_writer(qdrant_client, QDRANT_COLLECTION_NAME)
+
+    progress: StreamProgress = {
+        "file_id": file_id,
+        "chunks_seen": 0,
+        "chunks_unchanged": 0,
+        "batches_uploaded": 0,
+        "points_uploaded": 0,
+        "uploaded_point_ids": [],
+    }
+
+    point_ids: list[str] = []
+    payloads: list[dict] = []
+    changed_chunks: list[str] = []
+
+    def upload_batch() -> None:
+        vectors = np.asarray(
+            encode_chunks(changed_chunks, embedding_model, embedding_scheduler)
+        )
+
+        with time_stage("qdrant_upsert"):
+            point_count = qdrant_writer.write(point_ids, vectors, payloads)
+
+        increment("embedding_points_upserted_total", point_count)
+
+        progress["batches_uploaded"] += 1
+        progress["points_uploaded"] += point_count
+        if cleanup_on_failure:
+            progress["uploaded_point_ids"].extend(point_ids)
+
+        point_ids.clear()
+        payloads.clear()
+        changed_chunks.clear()
+
+    try:
+        for chunk_index, chunked_text in enumerate(chunks):
+            progress["chunks_seen"] += 1
+
+            chunk_hash = get_chunk_hash(chunked_text)
+            point_id = get_point_id(model_key, file_id, chunk_index, chunk_hash)
+
+            if point_id in stale_candidate_ids:
+                stale_candidate_ids.discard(point_id)
+                progress["chunks_unchanged"] += 1
+                continue
+
+            point_ids.append(point_id)
+            payloads.append(
+                build_qdrant_payload(sqs_payload, chunked_text, chunk_index, chunk_hash)
+            )
+            changed_chunks.append(chunked_text)
+
+            if len(changed_chunks) >= batch_chunks:
+                upload_batch()
+
+        if len(changed_chunks) > 0:
+            upload_batch()
+
+    except Exception:
+        print(
+            f"⚠️ Streaming upload for file_id {file_id} failed after {progress['chunks_seen']} chunks: {progress['points_uploaded']} points in {progress['batches_uploaded']} batches were uploaded."
+        )
+
+        if cleanup_on_failure and progress["uploaded_point_ids"]:
+            delete_points(qdrant_client, progress["uploaded_point_ids"])
+            print(
+                f"♻️ Deleted the {len(progress['uploaded_point_ids'])} points uploaded for file_id {file_id} before the failure."
+            )
+
+        raise
+
+    stale_point_ids = sorted(stale_candidate_ids)
+
+    if len(stale_point_ids) > 0:
+        delete_points(qdrant_client, stale_point_ids)
+
+    print(
+        f"♻️ file_id {file_id}: {progress['chunks_unchanged']} unchanged, {progress['points_uploaded']} new/changed in {progress['batches_uploaded']} batches, {len(stale_point_ids)} stale chunks"
+    )
+
+    return progress
+
+
 def embed_and_upload(
     sqs_payload: SQSPayload,
+    embedding_model: "SentenceTransformer | None" = None,
+    qdrant_client: QdrantClient | None = None,
+    s3_client: BaseClient | None = None,
+    embedding_scheduler: EmbeddingScheduler | None = None,
 ) -> EmbedStatus:
+    """
+    Downloads, chunks, embeds and uploads the transcript for one SQS message.
+
+    Warm workers pass in their already-loaded model and clients; anything
+    left as None is created here for this message only. When an
+    embedding_scheduler is given, chunks are encoded in batches shared with
+    every other in-flight message instead of a dedicated encode() call.
+    """
 
     message_id = sqs_payload.get("message_id", "")
+    file_source = None
 
     try:
-        aws_region = os.getenv("AWS_REGION", "us-east-1")
         transcript_bucket = os.getenv("AWS_BUCKET", "alwayssaved")
-        s3_client = boto3.client("s3", region_name=aws_region)
 
-        embedding_model: SentenceTransformer = get_embedd_model()
-        qdrant_client: QdrantClient = get_qdrant_client()
+        if s3_client is None:
+            s3_client = get_s3_client()
+
+        if embedding_model is None:
+            embedding_model = get_embedd_model()
+
+        if qdrant_client is None:
+            qdrant_client = get_qdrant_client()
 
         if embedding_model is None or qdrant_client is None or s3_client is None:
             raise ValueError(
@@ -61,9 +577,10 @@ def embed_and_upload(
                 "❌ Error in embed_and_upload due to missing file_id, note_id, user_id, or transcript_s3_key value in payload."
             )
 
-        file_bytes = download_file_from_s3(s3_client, sqs_payload)
+        # Bytes, or the path of a temp file for large objects.
+        file_source = download_file_from_s3(s3_client, sqs_payload)
 
-        if file_bytes is None:
+        if file_source is None:
             raise ValueError(
                 "❌ Error in embed_and_upload due to inability to fetch requested s3 file with given s3_key."
             )
@@ -75,37 +592,68 @@ def embed_and_upload(
             file_extension.lower()
         )  # TODO: Do we really need to lowercase this?
 
-        full_text = extract_text_from_s3_bytes(file_bytes, file_extension)
+        extract_started = time.perf_counter()
+
+        # PDF pages stream straight into the chunker as they're extracted.
+        text_pieces = iter_text_from_s3_bytes(file_source, file_extension)
+
+        extract_seconds = time.perf_counter() - extract_started
 
-        if full_text is None:
+        if text_pieces is None:
             raise ValueError(
                 "❌ Error in embed_and_upload due to inability to extract text from downloaded s3 file."
             )
 
-        chunks = chunk_text(full_text)
+        # Page extraction time is split out of the chunking time.
+        timed_text_pieces = TimedIterator(text_pieces)
 
-        vectors = embedding_model.encode(chunks, normalize_embeddings=True)
+        stream_batch_chunks = get_stream_batch_chunks()
 
-        points = []
+        if stream_batch_chunks > 0:
+            # Chunks are produced as the micro-batches consume them.
+            timed_chunks = TimedIterator(
+                iter_chunks(timed_text_pieces, embedding_model)
+            )
 
-        for _, (chunked_text, vector) in enumerate(zip(chunks, vectors)):
-            points.append(
-                models.PointStruct(
-                    id=str(uuid.uuid4()),  # unique ID per chunk
-                    vector=vector.tolist(),
-                    payload={
-                        "note_id": note_id,
-                        "file_id": file_id,
-                        "user_id": user_id,
-                        "s3_key": transcript_s3_key,
-                        "original_chunk_text": chunked_text,
-                    },
-                )
+            stream_progress = stream_chunks_to_qdrant(
+                qdrant_client,
+                sqs_payload,
+                timed_chunks,
+                embedding_model,
+                stream_batch_chunks,
+                embedding_scheduler,
+            )
+
+            observe_stage("extract", extract_seconds + timed_text_pieces.seconds)
+            observe_stage("chunk", timed_chunks.seconds - timed_text_pieces.seconds)
+            record_document_chunks(stream_progress["chunks_seen"])
+
+            point_count = stream_progress["points_uploaded"]
+
+        else:
+            chunk_started = time.perf_counter()
+
+            chunks = list(iter_chunks(timed_text_pieces, embedding_model))
+
+            observe_stage("extract", extract_seconds + timed_text_pieces.seconds)
+            observe_stage(
+                "chunk",
+                time.perf_counter() - chunk_started - timed_text_pieces.seconds,
             )
-        qdrant_client.upsert(collection_name=QDRANT_COLLECTION_NAME, points=points)
+            record_document_chunks(len(chunks))
+
+            pending_upload = encode_changed_chunks(
+                qdrant_client,
+                sqs_payload,
+                chunks,
+                embedding_model,
+                embedding_scheduler,
+            )
+
+            point_count = store_chunks(qdrant_client, sqs_payload, pending_upload)
 
         print(
-            f"✅ Uploaded {len(points)} chunks to Qdrant for user_id {user_id} file: {transcript_s3_key}"
+            f"✅ Uploaded {point_count} chunks to Qdrant for user_id {user_id} file: {transcript_s3_key}"
         )
 
         return handle_msg_feedback(sqs_payload, "complete")
@@ -129,4 +677,9 @@ def embed_and_upload(
         print(f"{feedback}: {e}")
         traceback.print_exc()
 
+        invalidate_on_qdrant_auth_error(e)
+
         return handle_msg_feedback(sqs_payload, "failed")
+
+    finally:
+        release_file_source(file_source)
@@ -0,0 +1,253 @@
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from services.embedding.chunker import get_thread_tokenizer
+from services.metrics.main import observe
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+class _DocumentRequest:
+    def __init__(self, chunk_count: int, dimension: int):
+        self.future: Future[np.ndarray] = Future()
+        self.vectors = np.empty((chunk_count, dimension), dtype=np.float32)
+        self.remaining = chunk_count
+
+
+class _PendingChunk:
+    __slots__ = ("request", "index", "text", "token_length", "enqueued_at")
+
+    def __init__(
+        self,
+        request: _DocumentRequest,
+        index: int,
+        text: str,
+        token_length: int,
+        enqueued_at: float,
+    ):
+        self.request = request
+        self.index = index
+        self.text = text
+        self.token_length = token_length
+        self.enqueued_at = enqueued_at
+
+
+class EmbeddingScheduler:
+    """
+    Pools chunks from every in-flight message into shared encode() calls.
+
+    Callers submit a document's chunks and get back a Future that resolves to
+    that document's (len(chunks), dim) vector matrix. A single background
+    thread owns the model: it waits until max_batch_size chunks are pending
+    or the oldest chunk has waited max_wait_ms, sorts everything pending by
+    token length so each forward pass pads as little as possible, encodes in
+    batches of max_batch_size and scatters the vectors back to their
+    documents.
+
+    Priority submissions (query embeddings) have their own queue and a
+    shorter wait budget, priority_max_wait_ms. They are encoded before any
+    pending ingestion chunks and between the batches of an ingestion window
+    that is already being encoded, so a query waits at most one ingestion
+    batch.
+    """
+
+    def __init__(
+        self,
+        embedding_model: "SentenceTransformer",
+        max_batch_size: int = 64,
+        max_wait_ms: int = 20,
+        priority_max_wait_ms: float = 2,
+    ):
+        self.embedding_model = embedding_model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_seconds = max(0, max_wait_ms) / 1000
+        self.priority_max_wait_seconds = max(0, priority_max_wait_ms) / 1000
+        self.dimension = embedding_model.get_sentence_embedding_dimension()
+
+        self._pending: deque[_PendingChunk] = deque()
+        self._priority_pending: deque[_PendingChunk] = deque()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name="embedding-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def _token_lengths(self, chunks: list[str]) -> list[int]:
+        tokenizer = getattr(self.embedding_model, "tokenizer", None)
+
+        if tokenizer is None:
+            return [len(chunk) for chunk in chunks]
+
+        encoded = get_thread_tokenizer(tokenizer)(
+            chunks,
+            add_special_tokens=True,
+            truncation=True,
+            max_length=self.embedding_model.max_seq_length,
+        )
+        return [len(input_ids) for input_ids in encoded["input_ids"]]
+
+    def submit(self, chunks: list[str], priority: bool = False) -> Future[np.ndarray]:
+        request = _DocumentRequest(len(chunks), self.dimension)
+
+        if len(chunks) == 0:
+            request.future.set_result(request.vectors)
+            return request.future
+
+        # Tokenizing here runs on the caller's thread, in parallel with
+        # whatever batch the scheduler thread is currently encoding.
+        token_lengths = self._token_lengths(chunks)
+        enqueued_at = time.monotonic()
+        pending = self._priority_pending if priority else self._pending
+
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("EmbeddingScheduler has been stopped.")
+
+            for index, (text, token_length) in enumerate(zip(chunks, token_lengths)):
+                pending.append(
+                    _PendingChunk(request, index, text, token_length, enqueued_at)
+                )
+            self._condition.notify()
+
+        return request.future
+
+    def set_max_batch_size(self, max_batch_size: int) -> None:
+        """Takes effect from the next batch window."""
+
+        with self._condition:
+            self.max_batch_size = max(1, max_batch_size)
+
+    def embed(self, chunks: list[str]) -> np.ndarray:
+        return self.submit(chunks).result()
+
+    def _take_window(self) -> list[_PendingChunk]:
+        with self._condition:
+            while True:
+                while (
+                    not self._pending
+                    and not self._priority_pending
+                    and not self._stopped
+                ):
+                    self._condition.wait()
+
+                if self._priority_pending:
+                    pending = self._priority_pending
+                    max_wait_seconds = self.priority_max_wait_seconds
+                elif self._pending:
+                    pending = self._pending
+                    max_wait_seconds = self.max_wait_seconds
+                else:
+                    return []
+
+                # Wait for more chunks to arrive until a full batch is pending
+                # or the oldest pending chunk has used up its wait budget.
+                deadline = pending[0].enqueued_at + max_wait_seconds
+
+                while len(pending) < self.max_batch_size and not self._stopped:
+                    # A priority chunk cuts an ingestion window's wait short.
+                    if pending is self._pending and self._priority_pending:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(timeout=remaining)
+
+                # Ingestion chunks stay pending until the priority ones are done.
+                if pending is self._pending and self._priority_pending:
+                    continue
+
+                window = list(pending)
+                pending.clear()
+
+                return window
+
+    def _take_priority_window(self) -> list[_PendingChunk]:
+        """Whatever priority chunks are pending, without waiting for more."""
+
+        with self._condition:
+            window = list(self._priority_pending)
+            self._priority_pending.clear()
+
+        return window
+
+    def _encode_batch(self, batch: list[_PendingChunk]) -> None:
+        observe("embedding_encode_batch_size", len(batch))
+
+        try:
+            vectors = self.embedding_model.encode(
+                [pending.text for pending in batch],
+                batch_size=len(batch),
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+            )
+        except Exception as e:
+            print(f"❌ Unexpected Exception in EmbeddingScheduler encode: {e}")
+            traceback.print_exc()
+
+            for pending in batch:
+                if not pending.request.future.done():
+                    pending.request.future.set_exception(e)
+            return
+
+        for pending, vector in zip(batch, vectors):
+            request = pending.request
+
+            if request.future.done():
+                continue
+
+            request.vectors[pending.index] = vector
+            request.remaining -= 1
+
+            if request.remaining == 0:
+                request.future.set_result(request.vectors)
+
+    def _encode_window(
+        self, window: list[_PendingChunk], preemptible: bool = True
+    ) -> None:
+        window.sort(key=lambda pending: pending.token_length)
+
+        # Read once: set_max_batch_size() may change it mid-window.
+        max_batch_size = self.max_batch_size
+
+        for start in range(0, len(window), max_batch_size):
+            # Priority chunks that arrived meanwhile go before the next batch.
+            if preemptible and self._priority_pending:
+                self._encode_window(self._take_priority_window(), preemptible=False)
+
+            self._encode_batch(window[start : start + max_batch_size])
+
+    def _run(self) -> None:
+        while True:
+            window = self._take_window()
+
+            if not window:
+                return
+
+            self._encode_window(window)
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+        self._thread.join()
+
+
+def create_embedding_scheduler(
+    embedding_model: "SentenceTransformer",
+) -> EmbeddingScheduler:
+    return EmbeddingScheduler(
+        embedding_model,
+        max_batch_size=int(os.getenv("EMBED_MAX_BATCH_SIZE", "64")),
+        max_wait_ms=int(os.getenv("EMBED_MAX_WAIT_MS", "20")),
+        priority_max_wait_ms=float(os.getenv("QUERY_EMBEDDING_MAX_WAIT_MS", "2")),
+    )
@@ -1,10 +1,24 @@
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
 
-import torch
-from sentence_transformers import SentenceTransformer
-
+from services.embedding.backend import (
+    get_embedding_backend,
+    get_loaded_backend,
+    load_embedding_model,
+)
 from services.utils.types.main import EmbedStatus, SQSPayload, process_status
 
+# torch and sentence-transformers take seconds to import, so they're only
+# imported once a process actually needs them (see import_embedding_modules).
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+# Set by preload_embedd_model() in the service process before worker pools
+# fork; the workers then share its weights copy-on-write.
+_preloaded_model: "SentenceTransformer | None" = None
+
 
 def handle_msg_feedback(
     sqs_payload: SQSPayload, process_result: process_status
@@ -29,18 +43,195 @@ def handle_msg_feedback(
     }
 
 
-def get_embedd_model() -> SentenceTransformer:
+def get_embedd_model_name() -> str:
+    return os.getenv("EMBEDDING_MODEL", "multi-qa-MiniLM-L6-cos-v1")
+
+
+def get_embedd_model_key(embedding_model: "SentenceTransformer") -> str:
+    """
+    The model name, tagged with the backend embedding_model actually runs
+    on unless that's torch. Embedding cache keys and point ids are built
+    from it, so vectors from the ONNX backends (the int8 one drifts
+    furthest) are never mixed with torch vectors of the same text, even
+    when a worker fell back to torch. torch keeps the plain name, so
+    existing points and cache entries stay valid.
+    """
+
+    model_name = get_embedd_model_name()
+    backend = get_loaded_backend(embedding_model)
+
+    if backend == "torch":
+        return model_name
+
+    return f"{model_name}@{backend}"
+
+
+def import_embedding_modules() -> None:
+    """
+    Imports torch and sentence-transformers in this process. Called before
+    a worker pool forks, so its workers inherit the modules instead of each
+    importing them again.
+    """
+
+    import sentence_transformers  # noqa: F401
+    import torch  # noqa: F401
+
+
+def preload_embedd_model() -> "SentenceTransformer | None":
+    """
+    Loads the model in the service process so forked workers share its
+    weights instead of each loading a copy. transformers memory-maps
+    model.safetensors, so those pages are also shared with the page cache.
+    Only the torch backend is preloaded: ONNX Runtime sessions don't
+    survive a fork.
+    """
+
+    global _preloaded_model
+
+    if get_embedding_backend() != "torch":
+        print(
+            "⚠️ EMBEDDING_PRELOAD_MODEL only applies to the torch backend; workers load their own model."
+        )
+        return None
+
+    _preloaded_model = get_embedd_model()
+
+    return _preloaded_model
+
+
+def get_embedd_model() -> "SentenceTransformer":
+    if _preloaded_model is not None:
+        return _preloaded_model
+
+    import torch
+
     device = "cuda" if torch.cuda.is_available() else "cpu"
 
     print(f"✅ Using device for embed model: {device}")
 
-    model_name = os.getenv("EMBEDDING_MODEL", "multi-qa-MiniLM-L6-cos-v1")
+    model_name = get_embedd_model_name()
 
-    embedding_model = SentenceTransformer(model_name_or_path=model_name, device=device)
+    embedding_model = load_embedding_model(model_name, device)
 
     return embedding_model
 
 
+def _load_model_dimension() -> int:
+    return get_embedd_model().get_sentence_embedding_dimension()
+
+
+def _read_model_json(model_name: str, path: str) -> dict | None:
+    # A local model directory, else the Hugging Face cache (or hub), where
+    # sentence-transformers looks bare model names up under its organization.
+    if os.path.isdir(model_name):
+        config_path = os.path.join(model_name, path)
+
+        if not os.path.exists(config_path):
+            return None
+    else:
+        from huggingface_hub import hf_hub_download
+
+        repo_id = (
+            model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        )
+
+        try:
+            config_path = hf_hub_download(repo_id, path)
+        except Exception:
+            return None
+
+    with open(config_path, encoding="utf-8") as config_file:
+        return json.load(config_file)
+
+
+def read_model_config_dimension(model_name: str) -> int | None:
+    """
+    The vector size a sentence-transformers model produces, read from its
+    module configs: the last Dense layer's out_features, else the Pooling
+    layer's width times its number of pooling modes, else the transformer's
+    hidden size. None when the configs can't be found or read.
+    """
+
+    try:
+        modules = _read_model_json(model_name, "modules.json")
+
+        for module in reversed(modules or []):
+            module_type = module.get("type", "")
+            module_dir = module.get("path", "")
+
+            if module_type.endswith("Dense"):
+                config = _read_model_json(
+                    model_name, os.path.join(module_dir, "config.json")
+                )
+                return int(config["out_features"]) if config else None
+
+            if module_type.endswith("Pooling"):
+                config = _read_model_json(
+                    model_name, os.path.join(module_dir, "config.json")
+                )
+
+                if config is None:
+                    return None
+
+                # Older configs flag each mode with a pooling_mode_* boolean.
+                pooling_mode = config.get("pooling_mode")
+
+                if isinstance(pooling_mode, str):
+                    mode_count = 1
+                elif isinstance(pooling_mode, list):
+                    mode_count = len(pooling_mode)
+                else:
+                    mode_count = sum(
+                        1
+                        for key, value in config.items()
+                        if key.startswith("pooling_mode_") and value is True
+                    )
+
+                width = config.get("embedding_dimension") or config.get(
+                    "word_embedding_dimension"
+                )
+                return int(width) * max(1, mode_count) if width else None
+
+            if module_type.endswith("Transformer"):
+                config = _read_model_json(
+                    model_name, os.path.join(module_dir, "config.json")
+                )
+                hidden_size = (config or {}).get("hidden_size")
+                return int(hidden_size) if hidden_size else None
+
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"⚠️ Could not read the dimension of {model_name} from its config: {e}")
+
+    return None
+
+
+def get_embedd_model_dimension() -> int:
+    """
+    Returns the embedding model's vector size. EMBEDDING_DIMENSION skips the
+    lookup, and a preloaded model is asked directly. Otherwise it's read
+    from the model's config files (see read_model_config_dimension()), and
+    only if that fails is the model loaded once in a short-lived child
+    process, so the service process stays model-free until it actually
+    needs the model (and can still fork small workers).
+    """
+
+    configured_dimension = os.getenv("EMBEDDING_DIMENSION", "").strip()
+
+    if configured_dimension:
+        return int(configured_dimension)
+
+    if _preloaded_model is not None:
+        return _preloaded_model.get_sentence_embedding_dimension()
+
+    config_dimension = read_model_config_dimension(get_embedd_model_name())
+
+    if config_dimension is not None:
+        return config_dimension
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_load_model_dimension).result()
+
+
 def chunk_text(text, chunk_size=1000, overlap=100):
     chunks = []
     start = 0
@@ -0,0 +1,270 @@
+import codecs
+import functools
+import os
+import re
+from html.parser import HTMLParser
+from typing import Any, Callable, Iterator
+
+from services.extraction.normalize import normalize_paragraph
+
+# The document is fed to the parser this many bytes at a time.
+HTML_READ_BYTES = 256 * 1024
+
+# Elements whose text is never part of the content.
+SKIPPED_TAGS = frozenset(
+    {
+        "script",
+        "style",
+        "noscript",
+        "template",
+        "svg",
+        "math",
+        "canvas",
+        "iframe",
+        "object",
+        "select",
+        "button",
+        "textarea",
+        "nav",
+        "footer",
+    }
+)
+
+# Elements whose start and end are paragraph breaks.
+BLOCK_TAGS = frozenset(
+    {
+        "address",
+        "article",
+        "aside",
+        "blockquote",
+        "br",
+        "caption",
+        "dd",
+        "details",
+        "div",
+        "dl",
+        "dt",
+        "figcaption",
+        "figure",
+        "form",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "header",
+        "hr",
+        "li",
+        "main",
+        "ol",
+        "p",
+        "pre",
+        "section",
+        "summary",
+        "table",
+        "title",
+        "tr",
+        "ul",
+    }
+)
+
+# Table cells are kept on one line, but never run into each other.
+CELL_TAGS = frozenset({"td", "th"})
+
+_META_CHARSET = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+
+
+def get_html_backend() -> str:
+    """
+    lxml (default) streams the page through libxml2's HTML parser, and
+    html.parser does the same extraction with the standard library's
+    parser (also used if lxml can't be imported). bs4 keeps the get_text()
+    output of BeautifulSoup that the service produced before.
+    """
+
+    return os.getenv("HTML_EXTRACTION_BACKEND", "lxml").strip().lower()
+
+
+class HTMLTextCollector:
+    """
+    Parser target that turns start/end/data events into normalized
+    paragraphs, skipping SKIPPED_TAGS and breaking paragraphs at BLOCK_TAGS.
+    It's used directly as an lxml parser target, and behind HTMLParser for
+    the html.parser backend.
+    """
+
+    def __init__(self):
+        self.paragraphs: list[str] = []
+        self._pieces: list[str] = []
+        self._skip_depth = 0
+
+    def _break(self) -> None:
+        if len(self._pieces) == 0:
+            return
+
+        paragraph = normalize_paragraph("".join(self._pieces))
+        self._pieces = []
+
+        if paragraph:
+            self.paragraphs.append(paragraph)
+
+    def start(self, tag: str, attrib: Any = None) -> None:
+        tag = tag.lower()
+
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._break()
+        elif tag in CELL_TAGS:
+            self._pieces.append(" ")
+
+    def end(self, tag: str) -> None:
+        tag = tag.lower()
+
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self._break()
+
+    def data(self, text: str) -> None:
+        if self._skip_depth == 0:
+            self._pieces.append(text)
+
+    def close(self) -> str:
+        self._break()
+
+        return "\n\n".join(self.paragraphs)
+
+
+class _StdlibHTMLParser(HTMLParser):
+    def __init__(self, target: HTMLTextCollector):
+        super().__init__(convert_charrefs=True)
+        self._target = target
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        self._target.start(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        self._target.end(tag)
+
+    def handle_data(self, data: str) -> None:
+        self._target.data(data)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_lxml_etree() -> Any:
+    try:
+        from lxml import etree
+
+        return etree
+    except ImportError:
+        print(
+            "⚠️ lxml can't be imported; HTML is parsed with the slower html.parser instead."
+        )
+        return None
+
+
+def sniff_html_encoding(head: bytes) -> str:
+    """The charset of a <meta> tag near the start of the page, else UTF-8."""
+
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8"
+
+    match = _META_CHARSET.search(head[:4096])
+
+    if match is not None:
+        try:
+            return codecs.lookup(match.group(1).decode("ascii")).name
+        except (LookupError, UnicodeDecodeError):
+            pass
+
+    return "utf-8"
+
+
+def _iter_html_blocks(source: bytes | str) -> Iterator[bytes]:
+    if isinstance(source, str):
+        with open(source, "rb") as html_file:
+            while block := html_file.read(HTML_READ_BYTES):
+                yield block
+        return
+
+    for start in range(0, len(source), HTML_READ_BYTES):
+        yield source[start : start + HTML_READ_BYTES]
+
+
+def _extract_with_bs4(source: bytes | str) -> str:
+    from bs4 import BeautifulSoup
+
+    if isinstance(source, str):
+        with open(source, "rb") as html_file:
+            soup = BeautifulSoup(html_file, "html.parser")
+    else:
+        soup = BeautifulSoup(source, "html.parser")
+
+    return soup.get_text()
+
+
+def extract_html_text(source: bytes | str) -> str:
+    """
+    source is the downloaded bytes, or the path of a spooled download.
+
+    The page is fed to the parser in HTML_READ_BYTES blocks and never built
+    into a tree. Text of script, style, navigation and other non-content
+    elements is skipped. Block elements become paragraphs separated by a
+    blank line, and each paragraph is normalized like
+    normalize_paragraph(). Raises ValueError when the page can't be parsed.
+    """
+
+    backend = get_html_backend()
+
+    if backend == "bs4":
+        return _extract_with_bs4(source)
+
+    blocks = _iter_html_blocks(source)
+    first_block = next(blocks, b"")
+
+    if not first_block:
+        return ""
+
+    encoding = sniff_html_encoding(first_block)
+    collector = HTMLTextCollector()
+    etree = _get_lxml_etree() if backend == "lxml" else None
+
+    feed: Callable[[bytes], Any]
+    finish: Callable[[], Any]
+
+    if etree is not None:
+        lxml_parser = etree.HTMLParser(
+            target=collector,
+            encoding=encoding,
+            no_network=True,
+            remove_comments=True,
+            remove_pis=True,
+        )
+        feed, finish = lxml_parser.feed, lxml_parser.close
+        parse_errors: tuple[type[Exception], ...] = (etree.LxmlError,)
+    else:
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        stdlib_parser = _StdlibHTMLParser(collector)
+
+        def feed(block: bytes) -> None:
+            stdlib_parser.feed(decoder.decode(block))
+
+        def finish() -> str:
+            stdlib_parser.feed(decoder.decode(b"", final=True))
+            stdlib_parser.close()
+            return collector.close()
+
+        parse_errors = ()
+
+    try:
+        feed(first_block)
+
+        for block in blocks:
+            feed(block)
+
+        return finish()
+
+    except parse_errors as e:
+        raise ValueError(f"Could not parse HTML: {e}") from e
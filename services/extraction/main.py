@@ -0,0 +1,429 @@
+import asyncio
+import os
+import signal
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Iterator
+
+from services.extraction.normalize import is_text_normalization_enabled, normalize_text
+
+PDF_PAGES_PER_TASK = 8
+PDF_PAGE_TIMEOUT_SECONDS = 30
+
+
+class PageTimeoutError(Exception):
+    pass
+
+
+class PageRangeTimeoutError(ValueError):
+    """A whole page range overran its budget, so the document is incomplete."""
+
+
+class PdfPoolBrokenError(ValueError):
+    """The extraction pool went down under a document's page ranges."""
+
+
+def get_pdf_backend() -> str:
+    """
+    pdfplumber (default) keeps the layout-aware text the service has always
+    produced; pdfium is pypdfium2's text-only extraction, which is much
+    faster when layout isn't needed.
+    """
+
+    return os.getenv("PDF_EXTRACTION_BACKEND", "pdfplumber").strip().lower()
+
+
+def get_pdf_page_timeout() -> float:
+    return float(os.getenv("PDF_PAGE_TIMEOUT_SECONDS", str(PDF_PAGE_TIMEOUT_SECONDS)))
+
+
+@contextmanager
+def _page_deadline(timeout_seconds: float):
+    # SIGALRM can only be handled on the main thread of a process; pool
+    # workers run tasks there, anything else just runs without a deadline.
+    if (
+        timeout_seconds <= 0
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+
+    def on_timeout(signum, frame):
+        raise PageTimeoutError()
+
+    previous_handler = signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout_seconds)
+
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def count_pdf_pages(source: bytes | str) -> int:
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(source)
+
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def extract_pdf_page_range(
+    source: bytes | str,
+    start: int,
+    end: int,
+    backend: str,
+    page_timeout: float,
+) -> list[str]:
+    """
+    Returns the text of pages [start, end). Runs in a worker process. A page
+    that takes longer than page_timeout seconds is logged and returned as
+    an empty string instead of stalling the whole document.
+    """
+
+    return list(iter_pdf_page_range(source, start, end, backend, page_timeout))
+
+
+def iter_pdf_page_range(
+    source: bytes | str,
+    start: int,
+    end: int,
+    backend: str,
+    page_timeout: float,
+) -> Iterator[str]:
+    """
+    Yields the text of pages [start, end) one page at a time from a single
+    open of the document; see extract_pdf_page_range().
+    """
+
+    page_texts = _iter_pdf_page_range(source, start, end, backend, page_timeout)
+
+    if is_text_normalization_enabled():
+        return (normalize_text(page_text) for page_text in page_texts)
+
+    return page_texts
+
+
+def _iter_pdf_page_range(
+    source: bytes | str,
+    start: int,
+    end: int,
+    backend: str,
+    page_timeout: float,
+) -> Iterator[str]:
+    if backend == "pdfium":
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(source)
+
+        try:
+            for page_index in range(start, end):
+                try:
+                    with _page_deadline(page_timeout):
+                        page = pdf[page_index]
+                        text_page = page.get_textpage()
+                        text = text_page.get_text_range()
+                        text_page.close()
+                        page.close()
+
+                    yield text.replace("\r\n", "\n")
+
+                except PageTimeoutError:
+                    print(
+                        f"⚠️ PDF page {page_index} timed out after {page_timeout}s — skipping."
+                    )
+                    yield ""
+        finally:
+            pdf.close()
+
+        return
+
+    import pdfplumber
+
+    pdf_source = source if isinstance(source, str) else BytesIO(source)
+
+    # pdfplumber page numbers are 1-indexed.
+    with pdfplumber.open(pdf_source, pages=list(range(start + 1, end + 1))) as pdf:
+        for page in pdf.pages:
+            try:
+                with _page_deadline(page_timeout):
+                    page_text = page.extract_text() or ""
+
+            except PageTimeoutError:
+                print(
+                    f"⚠️ PDF page {page.page_number - 1} timed out after {page_timeout}s — skipping."
+                )
+                page_text = ""
+
+            # Drop the page's parsed objects before moving to the next one.
+            page.close()
+
+            yield page_text
+
+
+_pdf_executor: tuple[int, ProcessPoolExecutor] | None = None
+_pdf_executor_lock = threading.Lock()
+
+
+def get_pdf_executor() -> ProcessPoolExecutor | None:
+    """
+    Returns this process's PDF extraction pool, or None when
+    PDF_EXTRACTION_WORKERS is 0 (the default) and pages are extracted inline.
+    """
+
+    global _pdf_executor
+
+    pdf_workers = int(os.getenv("PDF_EXTRACTION_WORKERS", "0"))
+
+    if pdf_workers <= 0:
+        return None
+
+    with _pdf_executor_lock:
+        if _pdf_executor is None or _pdf_executor[0] != os.getpid():
+            _pdf_executor = (os.getpid(), ProcessPoolExecutor(max_workers=pdf_workers))
+
+        return _pdf_executor[1]
+
+
+def discard_pdf_executor(executor: ProcessPoolExecutor) -> None:
+    """
+    Kills executor's workers and, if it's this process's PDF pool, forgets
+    it so get_pdf_executor() forks a fresh one. A task stuck in native
+    pdfium/pdfminer code can't be cancelled or interrupted by SIGALRM; only
+    killing its process frees the worker. Other documents' ranges still on
+    this pool fail with it.
+    """
+
+    global _pdf_executor
+
+    with _pdf_executor_lock:
+        if _pdf_executor is not None and _pdf_executor[1] is executor:
+            _pdf_executor = None
+
+    # ProcessPoolExecutor has no public way to stop running tasks. CPython
+    # (3.9 through 3.13) keeps the live workers in executor._processes, a
+    # pid -> Process dict that is None before the first submit. Killing
+    # them makes the pool's management thread fail every pending future
+    # with BrokenProcessPool.
+    for process in list((executor._processes or {}).values()):
+        process.terminate()
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_pdf_pages(
+    source: bytes | str, executor: ProcessPoolExecutor | None = None
+) -> Iterator[str]:
+    """
+    Yields the text of every page of a PDF, in order, as soon as it's ready.
+
+    With an executor, page ranges of PDF_PAGES_PER_TASK pages are extracted
+    in parallel. A sliding window keeps only a couple of ranges per worker in
+    flight, so the whole document's text is never held at once. Bytes are
+    spooled to a temp file first so each task gets a path, not a pickled
+    copy of the file. A range that overruns its budget discards the pool
+    (see discard_pdf_executor()) and raises PageRangeTimeoutError rather
+    than yielding the document without those pages.
+    """
+
+    backend = get_pdf_backend()
+    page_timeout = get_pdf_page_timeout()
+    pages_per_task = int(os.getenv("PDF_PAGES_PER_TASK", str(PDF_PAGES_PER_TASK)))
+
+    page_count = count_pdf_pages(source)
+
+    # Inline, the document is opened once and streamed page by page;
+    # opening it per range would re-parse its page tree every time.
+    if executor is None or page_count <= pages_per_task:
+        yield from iter_pdf_page_range(source, 0, page_count, backend, page_timeout)
+        return
+
+    temp_path = None
+
+    if not isinstance(source, str):
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
+            temp_file.write(source)
+            temp_path = temp_file.name
+
+    try:
+        yield from _iter_pdf_pages_parallel(
+            temp_path or source,
+            page_count,
+            executor,
+            backend,
+            page_timeout,
+            pages_per_task,
+        )
+    finally:
+        if temp_path is not None:
+            os.unlink(temp_path)
+
+
+def _iter_pdf_pages_parallel(
+    path: str,
+    page_count: int,
+    executor: ProcessPoolExecutor,
+    backend: str,
+    page_timeout: float,
+    pages_per_task: int,
+) -> Iterator[str]:
+    max_in_flight = 2 * max(1, int(os.getenv("PDF_EXTRACTION_WORKERS", "1")))
+    range_timeout = None
+    ranges = deque(
+        (start, min(page_count, start + pages_per_task))
+        for start in range(0, page_count, pages_per_task)
+    )
+    in_flight: deque[tuple[int, int, Future[list[str]]]] = deque()
+
+    def submit_next() -> None:
+        start, end = ranges.popleft()
+        future = executor.submit(
+            extract_pdf_page_range, path, start, end, backend, page_timeout
+        )
+        in_flight.append((start, end, future))
+
+    try:
+        while ranges and len(in_flight) < max_in_flight:
+            submit_next()
+
+        while in_flight:
+            start, end, future = in_flight.popleft()
+
+            try:
+                # The in-worker SIGALRM deadline can't interrupt native code,
+                # so the parent also gives up on a range that overruns its
+                # budget.
+                if page_timeout > 0:
+                    range_timeout = page_timeout * (end - start) + 5
+
+                page_texts = future.result(timeout=range_timeout)
+
+            except FutureTimeoutError:
+                print(
+                    f"⚠️ PDF pages {start}-{end - 1} timed out — restarting the PDF extraction pool."
+                )
+                discard_pdf_executor(executor)
+                raise PageRangeTimeoutError(
+                    f"PDF pages {start}-{end - 1} timed out after {range_timeout}s."
+                )
+
+            if ranges:
+                submit_next()
+
+            yield from page_texts
+
+    except BrokenProcessPool as e:
+        # Another document's timeout (or a crashed worker) took the pool down.
+        discard_pdf_executor(executor)
+        raise PdfPoolBrokenError(f"PDF extraction pool failed: {e}") from e
+
+    finally:
+        # Also reached when the caller stops reading early; ranges nobody
+        # will read shouldn't keep the pool's workers busy. Ranges already
+        # running finish on their own.
+        for _, _, future in in_flight:
+            future.cancel()
+
+
+async def extract_pdf_pages_async(
+    source: bytes | str, executor: ProcessPoolExecutor
+) -> list[str]:
+    """
+    Event-loop variant of iter_pdf_pages for the staged pipeline: page
+    ranges of one document are extracted concurrently on the pipeline's
+    extraction pool, so one long PDF spreads across its workers.
+
+    As in _iter_pdf_pages_parallel(), only a couple of ranges per worker are
+    in flight, and each is given page_timeout * pages + 5 seconds once it's
+    the next one awaited. A range that overruns that budget discards the
+    pool (the caller owns it and has to replace it) and raises
+    PageRangeTimeoutError.
+    """
+
+    backend = get_pdf_backend()
+    page_timeout = get_pdf_page_timeout()
+    pages_per_task = int(os.getenv("PDF_PAGES_PER_TASK", str(PDF_PAGES_PER_TASK)))
+    max_in_flight = 2 * max(1, executor._max_workers)
+
+    loop = asyncio.get_running_loop()
+    temp_path = None
+
+    # Spooled downloads are already files; only bytes need writing out.
+    if not isinstance(source, str):
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
+            temp_file.write(source)
+            temp_path = temp_file.name
+
+    pdf_path = temp_path or source
+    page_texts: list[str] = []
+    in_flight: deque[tuple[int, int, asyncio.Future[list[str]]]] = deque()
+
+    try:
+        page_count = await loop.run_in_executor(executor, count_pdf_pages, pdf_path)
+
+        ranges = deque(
+            (start, min(page_count, start + pages_per_task))
+            for start in range(0, page_count, pages_per_task)
+        )
+
+        def submit_next() -> None:
+            start, end = ranges.popleft()
+            future = loop.run_in_executor(
+                executor,
+                extract_pdf_page_range,
+                pdf_path,
+                start,
+                end,
+                backend,
+                page_timeout,
+            )
+            in_flight.append((start, end, future))
+
+        while ranges and len(in_flight) < max_in_flight:
+            submit_next()
+
+        while in_flight:
+            start, end, future = in_flight.popleft()
+            range_timeout = None
+
+            if page_timeout > 0:
+                range_timeout = page_timeout * (end - start) + 5
+
+            try:
+                page_texts.extend(await asyncio.wait_for(future, range_timeout))
+
+            except asyncio.TimeoutError:
+                print(
+                    f"⚠️ PDF pages {start}-{end - 1} timed out — restarting the pipeline's extraction pool."
+                )
+                discard_pdf_executor(executor)
+                raise PageRangeTimeoutError(
+                    f"PDF pages {start}-{end - 1} timed out after {range_timeout}s."
+                )
+
+            if ranges:
+                submit_next()
+
+    except BrokenProcessPool as e:
+        # Another document's timeout (or a crashed worker) took the pool down.
+        discard_pdf_executor(executor)
+        raise PdfPoolBrokenError(f"PDF extraction pool failed: {e}") from e
+
+    finally:
+        for _, _, future in in_flight:
+            future.cancel()
+
+        if temp_path is not None:
+            os.unlink(temp_path)
+
+    return page_texts
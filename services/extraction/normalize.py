@@ -0,0 +1,46 @@
+import os
+import re
+import unicodedata
+
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n\s*")
+_WHITESPACE = re.compile(r"\s+")
+
+# Zero-width characters, soft hyphens and the BOM survive NFKC but only
+# split words apart for the tokenizer.
+_INVISIBLE = re.compile("[\u00ad\u200b\u200c\u200d\u2060\ufeff]")
+_CONTROL = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
+
+
+def is_text_normalization_enabled() -> bool:
+    """TEXT_NORMALIZATION=true normalizes .txt and .pdf text too."""
+
+    return os.getenv("TEXT_NORMALIZATION", "false").strip().lower() == "true"
+
+
+def normalize_paragraph(text: str) -> str:
+    """
+    NFKC-normalizes text (ligatures, full-width and non-breaking
+    characters), drops invisible and control characters, and collapses
+    every run of whitespace, line breaks included, to one space.
+    """
+
+    text = unicodedata.normalize("NFKC", text)
+    text = _CONTROL.sub(" ", _INVISIBLE.sub("", text))
+
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def normalize_text(text: str) -> str:
+    """
+    normalize_paragraph() on every paragraph (separated by a blank line),
+    with empty paragraphs dropped and the rest joined by one blank line.
+    """
+
+    paragraphs = (
+        normalize_paragraph(paragraph)
+        for paragraph in _PARAGRAPH_BREAK.split(
+            text.replace("\r\n", "\n").replace("\r", "\n")
+        )
+    )
+
+    return "\n\n".join(paragraph for paragraph in paragraphs if paragraph)
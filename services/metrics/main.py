@@ -0,0 +1,535 @@
+import functools
+import inspect
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterable, Iterator
+
+METRICS_PORT = 9464
+
+# Seconds; covers a cached SQS poll up to a long PDF or a slow upsert.
+DURATION_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+# Seconds; a micro-batched query encode takes milliseconds.
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Seconds from SQS receive to delete; large documents can take minutes.
+COMPLETION_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+# name -> (type, help text, histogram buckets)
+METRICS: dict[str, tuple[str, str, tuple]] = {
+    "embedding_stage_duration_seconds": (
+        "histogram",
+        "Time spent in each processing stage.",
+        DURATION_BUCKETS,
+    ),
+    "embedding_stage_errors_total": (
+        "counter",
+        "Stage calls that raised an exception.",
+        (),
+    ),
+    "embedding_messages_total": (
+        "counter",
+        "SQS messages finished, by process_status.",
+        (),
+    ),
+    "embedding_chunks_total": ("counter", "Chunks produced from documents.", ()),
+    "embedding_points_upserted_total": (
+        "counter",
+        "Points written to Qdrant.",
+        (),
+    ),
+    "embedding_emails_sent_total": ("counter", "Notification emails sent.", ()),
+    "embedding_cache_hits_total": (
+        "counter",
+        "Chunks whose vector came from the embedding cache.",
+        (),
+    ),
+    "embedding_cache_misses_total": (
+        "counter",
+        "Chunks the embedding cache didn't have.",
+        (),
+    ),
+    "embedding_duplicate_chunks_total": (
+        "counter",
+        "Near-duplicate chunks that weren't encoded, by scope (document, user) and action (dropped, reused).",
+        (),
+    ),
+    "embedding_document_chunks": (
+        "histogram",
+        "Chunks per document.",
+        SIZE_BUCKETS,
+    ),
+    "embedding_encode_batch_size": (
+        "histogram",
+        "Chunks per EmbeddingScheduler encode() call.",
+        SIZE_BUCKETS,
+    ),
+    "embedding_sqs_batch_size": (
+        "histogram",
+        "Messages per non-empty SQS receive.",
+        SIZE_BUCKETS,
+    ),
+    "embedding_in_flight_messages": (
+        "gauge",
+        "Received SQS messages that are not finished yet.",
+        (),
+    ),
+    "embedding_queue_depth": (
+        "gauge",
+        "ApproximateNumberOfMessages on the embedding queue at the last check.",
+        (),
+    ),
+    "embedding_autoscaler_target": (
+        "gauge",
+        "Current autoscaler setting, by setting (workers, receive_batch_size, encode_batch_size).",
+        (),
+    ),
+    "embedding_autoscaler_decisions_total": (
+        "counter",
+        "Autoscaler changes, by setting and direction.",
+        (),
+    ),
+    "embedding_scheduled_messages": (
+        "gauge",
+        "Received messages waiting in the message scheduler, by size_class.",
+        (),
+    ),
+    "embedding_completion_seconds": (
+        "histogram",
+        "Seconds from SQS receive until a message was finished, by size_class.",
+        COMPLETION_BUCKETS,
+    ),
+    "embedding_completion_p95_seconds": (
+        "gauge",
+        "p95 of embedding_completion_seconds over the recent messages of each size_class.",
+        (),
+    ),
+    "embedding_query_requests_total": (
+        "counter",
+        "Requests to the query embedding endpoint, by HTTP status.",
+        (),
+    ),
+    "embedding_query_seconds": (
+        "histogram",
+        "Time to answer a query embedding request.",
+        QUERY_BUCKETS,
+    ),
+    "embedding_spool_segments": (
+        "gauge",
+        "Segments in the Qdrant write-ahead spool waiting to be flushed.",
+        (),
+    ),
+    "embedding_spool_bytes": (
+        "gauge",
+        "Disk space used by the Qdrant write-ahead spool.",
+        (),
+    ),
+    "embedding_spool_held_messages": (
+        "gauge",
+        "Finished SQS messages waiting for their spooled points to reach Qdrant.",
+        (),
+    ),
+    "embedding_process_rss_bytes": (
+        "gauge",
+        "Resident set size of the service process and its embedding workers.",
+        (),
+    ),
+    "embedding_process_private_bytes": (
+        "gauge",
+        "Memory not shared with any other process (USS), per process.",
+        (),
+    ),
+    "embedding_startup_seconds": (
+        "gauge",
+        "Time spent in each start-up phase of the service process.",
+        (),
+    ),
+    "embedding_time_to_first_message_seconds": (
+        "gauge",
+        "Seconds from process start until the first message was finished.",
+        (),
+    ),
+}
+
+LabelSet = tuple[tuple[str, str], ...]
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms keyed by (metric name, labels).
+
+    Worker processes record into their own registry and ship it to the main
+    process with flush_metrics(); merge() folds those snapshots in.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, LabelSet], float] = {}
+        self._gauges: dict[tuple[str, LabelSet], float] = {}
+        # [count per bucket..., +Inf count], sum
+        self._histograms: dict[tuple[str, LabelSet], list] = {}
+
+    def increment(self, name: str, amount: float, labels: LabelSet) -> None:
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    def set_gauge(self, name: str, value: float, labels: LabelSet) -> None:
+        with self._lock:
+            self._gauges[(name, labels)] = value
+
+    def remove_gauges(self, name: str) -> None:
+        with self._lock:
+            for key in [key for key in self._gauges if key[0] == name]:
+                del self._gauges[key]
+
+    def observe(self, name: str, value: float, labels: LabelSet) -> None:
+        buckets = METRICS[name][2]
+
+        with self._lock:
+            key = (name, labels)
+            histogram = self._histograms.get(key)
+
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+
+            for index, upper_bound in enumerate(buckets):
+                if value <= upper_bound:
+                    histogram[0][index] += 1
+                    break
+            else:
+                histogram[0][-1] += 1
+
+            histogram[1] += value
+
+    def snapshot_and_reset(self) -> dict:
+        with self._lock:
+            snapshot = {
+                "counters": self._counters,
+                "gauges": self._gauges,
+                "histograms": self._histograms,
+            }
+            self._counters, self._gauges, self._histograms = {}, {}, {}
+
+        return snapshot
+
+    def reset_after_fork(self) -> None:
+        # Another thread of the parent (the metrics server, the collector,
+        # the SQS heartbeat) may have held the lock when a worker was forked;
+        # the child's copy would then stay locked forever. Whatever the
+        # registry held is dropped by init_metrics_worker() anyway.
+        self._lock = threading.Lock()
+
+    def merge(self, snapshot: dict) -> None:
+        with self._lock:
+            for key, amount in snapshot["counters"].items():
+                self._counters[key] = self._counters.get(key, 0.0) + amount
+
+            self._gauges.update(snapshot["gauges"])
+
+            for key, (bucket_counts, total) in snapshot["histograms"].items():
+                histogram = self._histograms.get(key)
+
+                if histogram is None:
+                    self._histograms[key] = [list(bucket_counts), total]
+                    continue
+
+                histogram[0] = [a + b for a, b in zip(histogram[0], bucket_counts)]
+                histogram[1] += total
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+
+        with self._lock:
+            samples: dict[str, list[str]] = {}
+
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append(_sample(name, labels, value))
+
+            for (name, labels), value in self._gauges.items():
+                samples.setdefault(name, []).append(_sample(name, labels, value))
+
+            for (name, labels), (bucket_counts, total) in self._histograms.items():
+                lines = samples.setdefault(name, [])
+                cumulative = 0
+
+                for upper_bound, count in zip(
+                    (*METRICS[name][2], math.inf), bucket_counts
+                ):
+                    cumulative += count
+                    le = "+Inf" if upper_bound == math.inf else repr(upper_bound)
+                    lines.append(
+                        _sample(f"{name}_bucket", (*labels, ("le", le)), cumulative)
+                    )
+
+                lines.append(_sample(f"{name}_sum", labels, total))
+                lines.append(_sample(f"{name}_count", labels, cumulative))
+
+        output = []
+
+        for name in sorted(samples):
+            metric_type, help_text, _ = METRICS.get(name, ("untyped", "", ()))
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(samples[name])
+
+        return "\n".join(output) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _sample(name: str, labels: Iterable[tuple[str, str]], value: float) -> str:
+    label_text = ",".join(f'{key}="{_escape_label(label)}"' for key, label in labels)
+
+    if label_text:
+        return f"{name}{{{label_text}}} {value}"
+
+    return f"{name} {value}"
+
+
+_registry = MetricsRegistry()
+
+os.register_at_fork(after_in_child=_registry.reset_after_fork)
+
+# Set in worker processes by init_metrics_worker(); None in the main process.
+_worker_metrics_queue: Any = None
+
+# Created by the main process in start_metrics_server().
+_metrics_queue: Any = None
+
+
+def _labels(labels: dict[str, Any]) -> LabelSet:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def increment(name: str, amount: float = 1, **labels: Any) -> None:
+    _registry.increment(name, amount, _labels(labels))
+
+
+def set_gauge(name: str, value: float, **labels: Any) -> None:
+    _registry.set_gauge(name, value, _labels(labels))
+
+
+def remove_gauges(name: str) -> None:
+    _registry.remove_gauges(name)
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    _registry.observe(name, value, _labels(labels))
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    observe("embedding_stage_duration_seconds", seconds, stage=stage)
+
+
+@contextmanager
+def time_stage(stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+
+    try:
+        yield
+    except Exception:
+        increment("embedding_stage_errors_total", stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def timed_stage(stage: str) -> Callable[[Callable], Callable]:
+    """Decorator version of time_stage() for plain and async functions."""
+
+    def decorator(function: Callable) -> Callable:
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with time_stage(stage):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with time_stage(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TimedIterator:
+    """
+    Wraps a lazy iterator and adds up only the time spent producing its
+    items, so work interleaved with the consumer (PDF pages extracted while
+    the chunker pulls them) can be timed apart from the consumer's own.
+    """
+
+    def __init__(self, iterable: Iterable):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self) -> "TimedIterator":
+        return self
+
+    def __next__(self) -> Any:
+        started = time.perf_counter()
+
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+def get_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def get_private_bytes() -> int:
+    """
+    Memory only this process maps. For a worker forked after the model was
+    preloaded, that excludes the weights it still shares with the parent.
+    """
+
+    try:
+        with open("/proc/self/smaps_rollup", encoding="utf-8") as smaps:
+            return sum(
+                int(line.split()[1]) * 1024
+                for line in smaps
+                if line.startswith(("Private_Clean:", "Private_Dirty:"))
+            )
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def init_metrics_worker(metrics_queue: Any) -> None:
+    """
+    Run in each worker process (as, or from, the pool initializer). Drops
+    whatever the registry held when the worker was forked and makes
+    flush_metrics() send to metrics_queue.
+    """
+
+    global _worker_metrics_queue
+
+    _registry.snapshot_and_reset()
+    _worker_metrics_queue = metrics_queue
+
+
+def flush_metrics() -> None:
+    """Sends what this worker recorded since the last flush to the main process."""
+
+    if _worker_metrics_queue is None:
+        return
+
+    set_gauge("embedding_process_rss_bytes", get_rss_bytes(), process=os.getpid())
+    set_gauge(
+        "embedding_process_private_bytes", get_private_bytes(), process=os.getpid()
+    )
+
+    try:
+        _worker_metrics_queue.put_nowait(_registry.snapshot_and_reset())
+    except (OSError, ValueError, queue.Full) as e:
+        print(f"⚠️ Could not send worker metrics to the main process: {e}")
+
+
+def get_metrics_queue() -> Any:
+    """Queue worker pools pass to init_metrics_worker(); None when metrics are off."""
+
+    return _metrics_queue
+
+
+def _collect_worker_metrics(metrics_queue: Any) -> None:
+    while True:
+        try:
+            _registry.merge(metrics_queue.get())
+        except (EOFError, OSError):
+            return
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        set_gauge("embedding_process_rss_bytes", get_rss_bytes(), process="main")
+        set_gauge(
+            "embedding_process_private_bytes", get_private_bytes(), process="main"
+        )
+
+        body = _registry.render().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Scrapes every few seconds would drown out the service's own logs.
+        return
+
+
+def start_metrics_server() -> ThreadingHTTPServer | None:
+    """
+    Serves /metrics on METRICS_PORT (0 turns metrics export off) and starts
+    the thread that merges metrics sent by worker processes. Call it before
+    any worker pool is created so the pools can be handed the queue.
+    """
+
+    global _metrics_queue
+
+    port = int(os.getenv("METRICS_PORT", str(METRICS_PORT)))
+
+    if port <= 0:
+        return None
+
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    except OSError as e:
+        print(f"❌ Could not start the metrics server on port {port}: {e}")
+        return None
+
+    server.daemon_threads = True
+
+    _metrics_queue = multiprocessing.Queue()
+
+    threading.Thread(
+        target=_collect_worker_metrics,
+        args=(_metrics_queue,),
+        name="metrics-collector",
+        daemon=True,
+    ).start()
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+
+    print(f"✅ Serving Prometheus metrics on :{port}/metrics")
+
+    return server
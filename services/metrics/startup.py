@@ -0,0 +1,83 @@
+import os
+import time
+
+from services.metrics.main import get_private_bytes, get_rss_bytes, set_gauge
+
+# Fallback clock for platforms without /proc.
+_IMPORTED_AT = time.monotonic()
+
+_phases: dict[str, float] = {}
+_last_mark = 0.0
+_first_message_seconds: float | None = None
+
+
+def get_process_uptime_seconds() -> float:
+    """Seconds since this process started, interpreter start-up included."""
+
+    try:
+        with open("/proc/self/stat", encoding="utf-8") as stat:
+            # starttime is field 22; split after the command name, which
+            # may itself contain spaces.
+            start_ticks = int(stat.read().rsplit(")", 1)[1].split()[19])
+
+        with open("/proc/uptime", encoding="utf-8") as uptime:
+            system_uptime = float(uptime.read().split()[0])
+
+        return system_uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _IMPORTED_AT
+
+
+def mark_startup_phase(phase: str) -> None:
+    """Records the time since the previous mark (or process start) as `phase`."""
+
+    global _last_mark
+
+    now = get_process_uptime_seconds()
+    _phases[phase] = _phases.get(phase, 0.0) + now - _last_mark
+    _last_mark = now
+
+    set_gauge("embedding_startup_seconds", _phases[phase], phase=phase)
+
+
+def get_startup_summary() -> dict:
+    return {
+        "phases": {phase: round(seconds, 3) for phase, seconds in _phases.items()},
+        "time_to_first_message_seconds": None
+        if _first_message_seconds is None
+        else round(_first_message_seconds, 3),
+    }
+
+
+def report_startup(worker_memory: dict[int, tuple[int, int]] | None = None) -> None:
+    """
+    Prints the start-up report once, when the first message has finished:
+    time per phase, time to first message and memory per process.
+    worker_memory maps worker pid to (RSS, private bytes).
+    """
+
+    global _first_message_seconds
+
+    if _first_message_seconds is not None:
+        return
+
+    mark_startup_phase("first_message")
+
+    _first_message_seconds = get_process_uptime_seconds()
+    set_gauge("embedding_time_to_first_message_seconds", _first_message_seconds)
+
+    phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in _phases.items())
+    print(
+        f"✅ Startup: first message finished {_first_message_seconds:.2f}s after process start ({phases})"
+    )
+
+    memory = {"service": (get_rss_bytes(), get_private_bytes())}
+    memory.update(
+        {f"worker {pid}": usage for pid, usage in (worker_memory or {}).items()}
+    )
+
+    for process, (rss_bytes, private_bytes) in memory.items():
+        print(
+            f"✅ Startup memory, {process}: RSS {rss_bytes // 1024**2}MB, private {private_bytes // 1024**2}MB"
+        )
@@ -0,0 +1,343 @@
+import asyncio
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterable
+
+from qdrant_client import QdrantClient
+
+from services.aws.s3 import (
+    download_file_from_s3_async,
+    extract_text_from_s3_bytes,
+    release_file_source,
+)
+from services.embedding.main import (
+    encode_changed_chunks,
+    record_document_chunks,
+    store_chunks,
+)
+from services.embedding.scheduler import EmbeddingScheduler
+from services.embedding.chunker import iter_chunks
+from services.embedding.utils.main import handle_msg_feedback
+from services.extraction.main import (
+    PageRangeTimeoutError,
+    PdfPoolBrokenError,
+    extract_pdf_pages_async,
+)
+from services.metrics.main import time_stage, timed_stage
+from services.qdrant.main import (
+    get_qdrant_secret_generation,
+    invalidate_on_qdrant_auth_error,
+    refresh_qdrant_client,
+)
+from services.query.main import lower_ingestion_priority
+from services.utils.types.main import EmbedStatus, PendingUpload, SQSPayload
+from services.workers.topology import get_cpu_budget
+
+
+def chunk_and_encode(
+    text: str | Iterable[str],
+    embedding_scheduler: EmbeddingScheduler,
+    qdrant_client: QdrantClient,
+    sqs_payload: SQSPayload,
+) -> PendingUpload:
+    embedding_model = embedding_scheduler.embedding_model
+
+    with time_stage("chunk"):
+        chunks = list(iter_chunks(text, embedding_model))
+
+    record_document_chunks(len(chunks))
+
+    return encode_changed_chunks(
+        qdrant_client, sqs_payload, chunks, embedding_model, embedding_scheduler
+    )
+
+
+class PipelineJob:
+    def __init__(self, sqs_payload: SQSPayload, result: "asyncio.Future[EmbedStatus]"):
+        self.sqs_payload = sqs_payload
+        self.result = result
+        # Downloaded bytes, or the path of a spooled download.
+        self.file_source: bytes | str | None = None
+        # Extracted text, one piece per PDF page (or a single piece).
+        self.text_pieces: list[str] = []
+        self.pending_upload: PendingUpload | None = None
+
+
+class EmbeddingPipeline:
+    """
+    Staged download → extract → chunk/embed → upload pipeline.
+
+    Every stage runs its own pool of asyncio tasks and hands jobs to the next
+    stage through a bounded asyncio.Queue, so a full downstream queue blocks
+    the upstream stage (and ultimately submit()) instead of piling documents
+    up in memory. s3 downloads and Qdrant upserts are I/O on the event loop,
+    PDF/HTML parsing runs in a process pool, and all encoding goes through
+    the EmbeddingScheduler's single inference thread.
+    """
+
+    def __init__(
+        self,
+        s3_client: Any,
+        qdrant_client: QdrantClient,
+        embedding_scheduler: EmbeddingScheduler,
+        extract_executor: ProcessPoolExecutor,
+        download_concurrency: int = 4,
+        extract_concurrency: int = 2,
+        embed_concurrency: int = 4,
+        upload_concurrency: int = 2,
+        queue_size: int = 4,
+    ):
+        self.s3_client = s3_client
+        self.qdrant_client = qdrant_client
+        self._secret_generation = get_qdrant_secret_generation()
+        self.embedding_scheduler = embedding_scheduler
+        self.extract_executor = extract_executor
+        # Pools forked to replace one whose workers had to be killed; the
+        # caller only owns (and shuts down) the one it passed in.
+        self._replacement_executors: list[ProcessPoolExecutor] = []
+
+        self._stage_concurrency = {
+            "download": download_concurrency,
+            "extract": extract_concurrency,
+            "embed": embed_concurrency,
+            "upload": upload_concurrency,
+        }
+        self._queues: dict[str, asyncio.Queue[PipelineJob]] = {
+            stage: asyncio.Queue(maxsize=queue_size)
+            for stage in self._stage_concurrency
+        }
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        stage_handlers = {
+            "download": self._download,
+            "extract": self._extract,
+            "embed": self._embed,
+            "upload": self._upload,
+        }
+        stage_order = list(stage_handlers)
+
+        for position, stage in enumerate(stage_order):
+            next_stage = (
+                stage_order[position + 1] if position + 1 < len(stage_order) else None
+            )
+
+            for _ in range(max(1, self._stage_concurrency[stage])):
+                self._tasks.append(
+                    asyncio.create_task(
+                        self._run_stage(stage, stage_handlers[stage], next_stage)
+                    )
+                )
+
+    async def submit(self, sqs_payload: SQSPayload) -> "asyncio.Future[EmbedStatus]":
+        """Waits for room in the download queue, then returns the job's result future."""
+
+        job = PipelineJob(sqs_payload, asyncio.get_running_loop().create_future())
+
+        await self._queues["download"].put(job)
+
+        return job.result
+
+    async def _run_stage(self, stage: str, handler, next_stage: str | None) -> None:
+        queue = self._queues[stage]
+
+        while True:
+            job = await queue.get()
+
+            try:
+                await handler(job)
+
+                if next_stage is None:
+                    job.result.set_result(
+                        handle_msg_feedback(job.sqs_payload, "complete")
+                    )
+                else:
+                    await self._queues[next_stage].put(job)
+
+            except Exception as e:
+                message_id = job.sqs_payload.get("message_id", "")
+                print(
+                    f"❌ Unexpected {type(e).__name__} in pipeline {stage} stage for sqs_payload with message_id={message_id}: {e}"
+                )
+                traceback.print_exc()
+
+                invalidate_on_qdrant_auth_error(e)
+
+                release_file_source(job.file_source)
+                job.file_source = None
+
+                if not job.result.done():
+                    job.result.set_result(
+                        handle_msg_feedback(job.sqs_payload, "failed")
+                    )
+
+            finally:
+                queue.task_done()
+
+    async def _download(self, job: PipelineJob) -> None:
+        job.file_source = await download_file_from_s3_async(
+            self.s3_client, job.sqs_payload
+        )
+
+        if job.file_source is None:
+            raise ValueError(
+                "❌ Error in pipeline download stage due to inability to fetch requested s3 file with given s3_key."
+            )
+
+    @timed_stage("extract")
+    async def _extract(self, job: PipelineJob) -> None:
+        transcript_s3_key = job.sqs_payload.get("transcript_s3_key", "")
+        _, file_extension = os.path.splitext(transcript_s3_key)
+
+        try:
+            if file_extension.lower() == ".pdf":
+                extract_executor = self.extract_executor
+
+                try:
+                    job.text_pieces = await extract_pdf_pages_async(
+                        job.file_source, extract_executor
+                    )
+                except (PageRangeTimeoutError, PdfPoolBrokenError):
+                    self._replace_extract_executor(extract_executor)
+                    raise
+
+                return
+
+            # A spooled download crosses to the worker as just its path.
+            full_text = await asyncio.get_running_loop().run_in_executor(
+                self.extract_executor,
+                extract_text_from_s3_bytes,
+                job.file_source,
+                file_extension.lower(),
+            )
+
+        finally:
+            # The download (bytes or temp file) isn't needed once the text is extracted.
+            release_file_source(job.file_source)
+            job.file_source = None
+
+        if full_text is None:
+            raise ValueError(
+                "❌ Error in pipeline extract stage due to inability to extract text from downloaded s3 file."
+            )
+
+        job.text_pieces = [full_text]
+
+    def _replace_extract_executor(self, failed: ProcessPoolExecutor) -> None:
+        """
+        Starts a new extraction pool once failed, whose workers were killed
+        after a PDF range timed out, is discarded. Every job still on the
+        old pool fails with it; only the first one swaps the pool. Its
+        workers come from the same forkserver as the first pool's, so they
+        never copy this process's model or threads, and they start on
+        demand rather than blocking the event loop here.
+        """
+
+        if self.extract_executor is not failed:
+            return
+
+        print("🔁 Replacing the pipeline's PDF extraction pool.")
+
+        self.extract_executor = create_extract_executor(start_workers=False)
+        self._replacement_executors.append(self.extract_executor)
+
+    def _get_qdrant_client(self) -> QdrantClient:
+        # A stage that hit a Qdrant auth error invalidated the cached
+        # credentials; later jobs get a client built from the rotated ones.
+        self.qdrant_client, self._secret_generation = refresh_qdrant_client(
+            self.qdrant_client, self._secret_generation
+        )
+
+        return self.qdrant_client
+
+    async def _embed(self, job: PipelineJob) -> None:
+        # Chunking needs the model's tokenizer, which lives in this process,
+        # and looking up the file's existing points plus encoding the changed
+        # chunks both block, so all of it runs on a thread to keep the event
+        # loop free.
+        job.pending_upload = await asyncio.to_thread(
+            chunk_and_encode,
+            job.text_pieces,
+            self.embedding_scheduler,
+            self._get_qdrant_client(),
+            job.sqs_payload,
+        )
+        job.text_pieces = []
+
+    async def _upload(self, job: PipelineJob) -> None:
+        point_count = await asyncio.to_thread(
+            store_chunks,
+            self._get_qdrant_client(),
+            job.sqs_payload,
+            job.pending_upload,
+        )
+
+        print(
+            f"✅ Uploaded {point_count} chunks to Qdrant for user_id {job.sqs_payload.get('user_id')} file: {job.sqs_payload.get('transcript_s3_key')}"
+        )
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        for executor in self._replacement_executors:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        self._replacement_executors = []
+
+
+def get_extract_worker_count() -> int:
+    return int(os.getenv("PIPELINE_EXTRACT_WORKERS", "0")) or get_cpu_budget()
+
+
+def create_extract_executor(start_workers: bool = True) -> ProcessPoolExecutor:
+    """
+    Builds the extraction process pool.
+
+    Workers are forked by a forkserver, a fresh interpreter with only the
+    extraction modules imported, never by this process: a pool that has to
+    be replaced mid-run (see EmbeddingPipeline._replace_extract_executor())
+    would otherwise copy the model weights and whatever locks the scheduler,
+    metrics and heartbeat threads held. With start_workers, the forkserver
+    and a first worker are started now rather than on the first document.
+    """
+
+    mp_context = multiprocessing.get_context("forkserver")
+    mp_context.set_forkserver_preload(
+        ["services.extraction.main", "services.aws.s3", "services.query.main"]
+    )
+
+    executor = ProcessPoolExecutor(
+        max_workers=get_extract_worker_count(),
+        mp_context=mp_context,
+        initializer=lower_ingestion_priority,
+    )
+
+    if start_workers:
+        executor.submit(os.getpid).result()
+
+    return executor
+
+
+def create_pipeline(
+    s3_client: Any,
+    qdrant_client: QdrantClient,
+    embedding_scheduler: EmbeddingScheduler,
+    extract_executor: ProcessPoolExecutor,
+) -> EmbeddingPipeline:
+    return EmbeddingPipeline(
+        s3_client,
+        qdrant_client,
+        embedding_scheduler,
+        extract_executor,
+        download_concurrency=int(os.getenv("PIPELINE_DOWNLOAD_CONCURRENCY", "4")),
+        extract_concurrency=get_extract_worker_count(),
+        embed_concurrency=int(os.getenv("PIPELINE_EMBED_CONCURRENCY", "4")),
+        upload_concurrency=int(os.getenv("PIPELINE_UPLOAD_CONCURRENCY", "2")),
+        queue_size=int(os.getenv("PIPELINE_QUEUE_SIZE", "4")),
+    )
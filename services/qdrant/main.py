@@ -6,17 +6,139 @@ from qdrant_client.conversions.common_types import CollectionInfo
 from qdrant_client.http.exceptions import UnexpectedResponse
 from qdrant_client.http.models import Distance, VectorParams
 
-from services.aws.ssm import get_secret
+from services.aws.ssm import get_secret, get_secret_generation, invalidate_secret
+from services.metrics.main import timed_stage
 
 QDRANT_COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "alwayssaved_user_files")
 
+SCROLL_PAGE_SIZE = 1000
+
+QDRANT_SECRET_NAMES = ("/alwayssaved/QDRANT_URL", "/alwayssaved/QDRANT_API_KEY")
+
+
+def invalidate_on_qdrant_auth_error(error: Exception) -> bool:
+    """
+    Drops the cached Qdrant URL/API key when Qdrant rejects our credentials,
+    so the next get_qdrant_client() call picks up a rotated key.
+    """
+
+    if isinstance(error, UnexpectedResponse) and error.status_code in (401, 403):
+        invalidate_secret(*QDRANT_SECRET_NAMES)
+        return True
+
+    return False
+
+
+@timed_stage("qdrant_lookup")
+def get_file_point_ids(q_client: QdrantClient, file_id: str) -> set[str]:
+    """Returns the ids of every point already stored for file_id."""
+
+    point_ids: set[str] = set()
+    offset = None
+
+    while True:
+        records, offset = q_client.scroll(
+            collection_name=QDRANT_COLLECTION_NAME,
+            scroll_filter=rest.Filter(
+                must=[
+                    rest.FieldCondition(
+                        key="file_id", match=rest.MatchValue(value=file_id)
+                    )
+                ]
+            ),
+            limit=SCROLL_PAGE_SIZE,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
+        )
+
+        point_ids.update(str(record.id) for record in records)
+
+        if offset is None:
+            return point_ids
+
+
+@timed_stage("qdrant_lookup")
+def get_user_points_by_minhash_band(
+    q_client: QdrantClient,
+    user_id: str,
+    exclude_file_id: str,
+    model_key: str,
+    band_keys: list[str],
+) -> list[rest.Record]:
+    """
+    Returns the points of user_id's other files that were embedded with
+    model_key and share at least one minhash_bands key with band_keys, with
+    their chunk text and vector.
+    """
+
+    records: dict[str, rest.Record] = {}
+
+    for start in range(0, len(band_keys), SCROLL_PAGE_SIZE):
+        offset = None
+
+        while True:
+            page, offset = q_client.scroll(
+                collection_name=QDRANT_COLLECTION_NAME,
+                scroll_filter=rest.Filter(
+                    must=[
+                        rest.FieldCondition(
+                            key="user_id", match=rest.MatchValue(value=user_id)
+                        ),
+                        rest.FieldCondition(
+                            key="embedding_model_key",
+                            match=rest.MatchValue(value=model_key),
+                        ),
+                        rest.FieldCondition(
+                            key="minhash_bands",
+                            match=rest.MatchAny(
+                                any=band_keys[start : start + SCROLL_PAGE_SIZE]
+                            ),
+                        ),
+                    ],
+                    must_not=[
+                        rest.FieldCondition(
+                            key="file_id", match=rest.MatchValue(value=exclude_file_id)
+                        )
+                    ],
+                ),
+                limit=SCROLL_PAGE_SIZE,
+                offset=offset,
+                with_payload=["original_chunk_text"],
+                with_vectors=True,
+            )
+
+            records.update((str(record.id), record) for record in page)
+
+            if offset is None:
+                break
+
+    return list(records.values())
+
+
+def delete_points(q_client: QdrantClient, point_ids: list[str]) -> None:
+    for start in range(0, len(point_ids), SCROLL_PAGE_SIZE):
+        q_client.delete(
+            collection_name=QDRANT_COLLECTION_NAME,
+            points_selector=rest.PointIdsList(
+                points=point_ids[start : start + SCROLL_PAGE_SIZE]
+            ),
+            wait=True,
+        )
+
 
 def ensure_payload_indexes(q_client: QdrantClient) -> None:
     """
     Creates keyword payload indexes for filter fields if they don't already exist.
     Safe to call on every startup — Qdrant is idempotent about existing indexes.
     """
-    fields_to_index = ["user_id", "note_id", "file_id"]
+    fields_to_index = [
+        "user_id",
+        "note_id",
+        "file_id",
+        "minhash_bands",
+        "embedding_model_key",
+    ]
 
     for field in fields_to_index:
         try:
@@ -29,23 +151,112 @@ def ensure_payload_indexes(q_client: QdrantClient) -> None:
             print(f"⚠️ Could not create payload index for '{field}': {e}")
 
 
-def create_qdrant_collection(q_client: QdrantClient) -> None:
+def get_quantization_config(
+    quantization: str,
+) -> rest.ScalarQuantization | rest.BinaryQuantization | None:
+    # Quantized copies always stay in RAM; with on-disk originals they're
+    # what HNSW searches, and originals are only read to rescore.
+    if quantization == "scalar":
+        return rest.ScalarQuantization(
+            scalar=rest.ScalarQuantizationConfig(
+                type=rest.ScalarType.INT8, quantile=0.99, always_ram=True
+            )
+        )
+
+    if quantization == "binary":
+        return rest.BinaryQuantization(
+            binary=rest.BinaryQuantizationConfig(always_ram=True)
+        )
+
+    if quantization not in ("", "none"):
+        print(f"⚠️ Unknown QDRANT_QUANTIZATION={quantization}, using none.")
+
+    return None
+
+
+def get_hnsw_config() -> rest.HnswConfigDiff | None:
+    hnsw_m = os.getenv("QDRANT_HNSW_M", "").strip()
+    hnsw_ef_construct = os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "").strip()
+
+    if not hnsw_m and not hnsw_ef_construct:
+        return None
+
+    return rest.HnswConfigDiff(
+        m=int(hnsw_m) if hnsw_m else None,
+        ef_construct=int(hnsw_ef_construct) if hnsw_ef_construct else None,
+    )
+
+
+def get_collection_settings() -> tuple[str, bool]:
+    quantization = os.getenv("QDRANT_QUANTIZATION", "none").strip().lower()
+    on_disk_vectors = os.getenv("QDRANT_ON_DISK_VECTORS", "false").strip().lower()
+
+    return quantization, on_disk_vectors == "true"
+
+
+def migrate_qdrant_collection(q_client: QdrantClient) -> None:
+    """
+    Applies the configured quantization, on-disk and HNSW settings to an
+    existing collection in place. Qdrant rebuilds the affected segments in
+    the background, so the collection stays searchable meanwhile.
+    """
+
+    quantization, on_disk_vectors = get_collection_settings()
+    quantization_config = get_quantization_config(quantization)
+
+    q_client.update_collection(
+        collection_name=QDRANT_COLLECTION_NAME,
+        vectors_config={"": rest.VectorParamsDiff(on_disk=on_disk_vectors)},
+        hnsw_config=get_hnsw_config(),
+        quantization_config=quantization_config or rest.Disabled.DISABLED,
+    )
+
+    print(
+        f"♻️ Migrated Qdrant collection {QDRANT_COLLECTION_NAME}: quantization={quantization}, on_disk_vectors={on_disk_vectors}"
+    )
+
+
+def create_qdrant_collection(q_client: QdrantClient, vector_size: int) -> None:
+    """
+    Creates the collection sized for the embedding model, using the
+    QDRANT_QUANTIZATION / QDRANT_ON_DISK_VECTORS / QDRANT_HNSW_* settings.
+    An existing collection is left alone unless QDRANT_MIGRATE_COLLECTION
+    is true, in which case those settings are applied to it.
+    """
 
     try:
         q_client.get_collection(collection_name=QDRANT_COLLECTION_NAME)
 
+        if os.getenv("QDRANT_MIGRATE_COLLECTION", "false").strip().lower() == "true":
+            migrate_qdrant_collection(q_client)
+
     except UnexpectedResponse as e:
         print(
             f"❌ QdrantClient UnexpectedResponse Error in create_qdrant_collection: {e}"
         )
 
+        quantization, on_disk_vectors = get_collection_settings()
+
         q_client.create_collection(
             collection_name=QDRANT_COLLECTION_NAME,
-            vectors_config=VectorParams(size=384, distance=Distance.COSINE),
+            vectors_config=VectorParams(
+                size=vector_size, distance=Distance.COSINE, on_disk=on_disk_vectors
+            ),
+            hnsw_config=get_hnsw_config(),
+            quantization_config=get_quantization_config(quantization),
         )
         return None
 
 
+def get_collection_vector_size(collection_info: CollectionInfo) -> int | None:
+    vectors_config = collection_info.config.params.vectors
+
+    if isinstance(vectors_config, VectorParams):
+        return vectors_config.size
+
+    return None
+
+
 def get_qdrant_client() -> QdrantClient | None:
 
     try:
@@ -56,9 +267,17 @@ def get_qdrant_client() -> QdrantClient | None:
             raise ValueError(
                 "QDRANT_URL or QDRANT_API_KEY environment variables are not set."
             )
+        # QDRANT_PREFER_GRPC=true sends upserts over gRPC, which is cheaper to
+        # serialize than JSON for large vector batches.
+        prefer_grpc = os.getenv("QDRANT_PREFER_GRPC", "false").strip().lower() == "true"
+
         # Connect to Qdrant
         qdrant = QdrantClient(
-            url=qdrant_url, api_key=qdrant_api_key, cloud_inference=True
+            url=qdrant_url,
+            api_key=qdrant_api_key,
+            cloud_inference=True,
+            prefer_grpc=prefer_grpc,
+            grpc_port=int(os.getenv("QDRANT_GRPC_PORT", "6334")),
         )
 
         ensure_payload_indexes(qdrant)
@@ -70,6 +289,38 @@ def get_qdrant_client() -> QdrantClient | None:
         return None
 
 
+def get_qdrant_secret_generation() -> int:
+    """Changes only when the Qdrant URL or API key is invalidated."""
+
+    return get_secret_generation(*QDRANT_SECRET_NAMES)
+
+
+def refresh_qdrant_client(
+    q_client: QdrantClient | None, secret_generation: int
+) -> tuple[QdrantClient | None, int]:
+    """
+    For clients kept for the life of a process: rebuilds q_client once the
+    cached Qdrant credentials have been invalidated since secret_generation
+    (see get_qdrant_secret_generation()). Returns the client to use and the
+    generation it was built for. If the rebuild fails, the old client is
+    kept and the rebuild is tried again on the next call.
+    """
+
+    current_generation = get_qdrant_secret_generation()
+
+    if current_generation == secret_generation:
+        return q_client, secret_generation
+
+    refreshed_client = get_qdrant_client()
+
+    if refreshed_client is None:
+        return q_client, secret_generation
+
+    print("♻️ Rebuilt the Qdrant client with refreshed credentials.")
+
+    return refreshed_client, current_generation
+
+
 def get_qdrant_collection(q_client: QdrantClient) -> CollectionInfo | None:
 
     try:
@@ -0,0 +1,685 @@
+import json
+import os
+import re
+import threading
+import time
+import traceback
+import uuid
+
+import numpy as np
+from qdrant_client import QdrantClient
+
+from services.metrics.main import increment, set_gauge, time_stage
+from services.qdrant.main import (
+    QDRANT_COLLECTION_NAME,
+    delete_points,
+    get_file_point_ids,
+    get_qdrant_client,
+    invalidate_on_qdrant_auth_error,
+)
+from services.qdrant.writer import create_qdrant_writer, is_rejected_qdrant_write
+from services.utils.types.main import EmbedStatus, PendingUpload, SQSPayload
+
+QDRANT_SPOOL_MAX_MB = 1024
+QDRANT_SPOOL_FLUSH_POINTS = 2048
+QDRANT_SPOOL_FLUSH_INTERVAL_SECONDS = 1.0
+QDRANT_SPOOL_MAX_BACKOFF_SECONDS = 30.0
+
+# Data files without a manifest this old are left over from a crash
+# mid-write and are removed.
+ORPHAN_SECONDS = 3600
+
+MANIFEST_SUFFIX = ".json"
+VECTORS_SUFFIX = ".f32"
+RECORDS_SUFFIX = ".records"
+
+# Segments Qdrant refuses are moved here for inspection instead of being
+# retried forever.
+QUARANTINE_DIR = "quarantine"
+
+
+def get_spool_dir() -> str:
+    """QDRANT_SPOOL_DIR turns the write-ahead spool on; empty means off."""
+
+    return os.getenv("QDRANT_SPOOL_DIR", "").strip()
+
+
+def get_segment_prefix(message_id: str) -> str:
+    # Manifests are named <message id>.<segment id>.json so the segments of
+    # a message can be found by name.
+    return re.sub(r"[^A-Za-z0-9_-]", "_", message_id) or "message"
+
+
+def _fsync_dir(path: str) -> None:
+    dir_fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def get_spool_bytes(spool_dir: str) -> int:
+    total = 0
+
+    with os.scandir(spool_dir) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    continue
+
+                total += entry.stat().st_size
+            except FileNotFoundError:
+                # Flushed while we were looking.
+                continue
+
+    return total
+
+
+def list_manifests(spool_dir: str) -> list[str]:
+    """Committed segments' manifest names, oldest first."""
+
+    manifests = []
+
+    with os.scandir(spool_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith(MANIFEST_SUFFIX):
+                continue
+            try:
+                manifests.append((entry.stat().st_mtime, entry.name))
+            except FileNotFoundError:
+                continue
+
+    return [name for _, name in sorted(manifests)]
+
+
+def has_spooled_file(spool_dir: str, file_id: str) -> bool:
+    """Whether a committed segment of file_id is still waiting to be flushed."""
+
+    for manifest_name in list_manifests(spool_dir):
+        try:
+            manifest = read_manifest(spool_dir, manifest_name)
+        except (OSError, ValueError):
+            # Flushed meanwhile, or unreadable and discarded later.
+            continue
+
+        if manifest.get("file_id", "") == file_id:
+            return True
+
+    return False
+
+
+def write_segment(
+    spool_dir: str, sqs_payload: SQSPayload, pending_upload: PendingUpload
+) -> str:
+    """
+    Writes one message's points as a segment and returns its manifest name.
+
+    A segment is a raw row-major float32 matrix (<id>.f32, memory-mapped by
+    the flusher), one JSON record per point (<id>.records) and a manifest.
+    The data files are fsynced before the manifest is atomically renamed
+    into place, so a segment either has a manifest and is complete, or is
+    ignored.
+    """
+
+    segment_id = uuid.uuid4().hex
+    base_path = os.path.join(spool_dir, segment_id)
+
+    vectors = np.ascontiguousarray(pending_upload["vectors"], dtype=np.float32)
+    dimension = vectors.shape[1] if vectors.ndim == 2 else 0
+
+    with open(base_path + VECTORS_SUFFIX, "wb") as vectors_file:
+        vectors.tofile(vectors_file)
+        vectors_file.flush()
+        os.fsync(vectors_file.fileno())
+
+    with open(base_path + RECORDS_SUFFIX, "w", encoding="utf-8") as records_file:
+        for point_id, payload in zip(
+            pending_upload["point_ids"], pending_upload["payloads"]
+        ):
+            records_file.write(json.dumps({"id": point_id, "payload": payload}) + "\n")
+        records_file.flush()
+        os.fsync(records_file.fileno())
+
+    manifest_name = f"{get_segment_prefix(sqs_payload.get('message_id', ''))}.{segment_id}{MANIFEST_SUFFIX}"
+    manifest_path = os.path.join(spool_dir, manifest_name)
+
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(
+            {
+                "segment_id": segment_id,
+                "message_id": sqs_payload.get("message_id", ""),
+                "file_id": sqs_payload.get("file_id", ""),
+                "points": len(pending_upload["point_ids"]),
+                "dimension": dimension,
+                "current_point_ids": pending_upload["current_point_ids"],
+                "created_at": time.time(),
+            },
+            manifest_file,
+        )
+        manifest_file.flush()
+        os.fsync(manifest_file.fileno())
+
+    os.replace(manifest_path + ".tmp", manifest_path)
+    _fsync_dir(spool_dir)
+
+    return manifest_name
+
+
+def read_manifest(spool_dir: str, manifest_name: str) -> dict:
+    with open(
+        os.path.join(spool_dir, manifest_name), encoding="utf-8"
+    ) as manifest_file:
+        return json.load(manifest_file)
+
+
+def read_segment(
+    spool_dir: str, manifest_name: str
+) -> tuple[dict, list[str], np.ndarray, list[dict]]:
+    """Returns (manifest, point ids, vectors, payloads); vectors are memory-mapped."""
+
+    manifest = read_manifest(spool_dir, manifest_name)
+
+    base_path = os.path.join(spool_dir, manifest["segment_id"])
+
+    if manifest["points"] > 0:
+        vectors = np.memmap(
+            base_path + VECTORS_SUFFIX,
+            dtype=np.float32,
+            mode="r",
+            shape=(manifest["points"], manifest["dimension"]),
+        )
+    else:
+        vectors = np.empty((0, manifest["dimension"]), dtype=np.float32)
+
+    point_ids = []
+    payloads = []
+
+    with open(base_path + RECORDS_SUFFIX, encoding="utf-8") as records_file:
+        for line in records_file:
+            record = json.loads(line)
+            point_ids.append(record["id"])
+            payloads.append(record["payload"])
+
+    return manifest, point_ids, vectors, payloads
+
+
+def remove_segment(spool_dir: str, manifest_name: str, segment_id: str) -> None:
+    # The manifest goes first: without it the data files are just orphans.
+    for name in (
+        manifest_name,
+        segment_id + VECTORS_SUFFIX,
+        segment_id + RECORDS_SUFFIX,
+    ):
+        try:
+            os.remove(os.path.join(spool_dir, name))
+        except FileNotFoundError:
+            pass
+
+
+def quarantine_segment(spool_dir: str, manifest_name: str, segment_id: str) -> None:
+    quarantine_dir = os.path.join(spool_dir, QUARANTINE_DIR)
+    os.makedirs(quarantine_dir, exist_ok=True)
+
+    # Data files first, so the manifest never points at missing data.
+    for name in (
+        segment_id + VECTORS_SUFFIX,
+        segment_id + RECORDS_SUFFIX,
+        manifest_name,
+    ):
+        try:
+            os.replace(
+                os.path.join(spool_dir, name), os.path.join(quarantine_dir, name)
+            )
+        except FileNotFoundError:
+            pass
+
+
+def spool_pending_upload(
+    sqs_payload: SQSPayload, pending_upload: PendingUpload
+) -> bool:
+    """
+    Durably spools the points for the flusher to upload. Returns False when
+    the spool is off or already holds QDRANT_SPOOL_MAX_MB, in which case
+    the caller uploads directly.
+
+    A file with an older segment still spooled is spooled past the limit:
+    uploaded directly, its points would be overwritten by that segment's
+    flush and then deleted as stale.
+    """
+
+    spool_dir = get_spool_dir()
+
+    if not spool_dir:
+        return False
+
+    os.makedirs(spool_dir, exist_ok=True)
+
+    max_bytes = (
+        int(os.getenv("QDRANT_SPOOL_MAX_MB", str(QDRANT_SPOOL_MAX_MB))) * 1024 * 1024
+    )
+
+    if get_spool_bytes(spool_dir) >= max_bytes:
+        file_id = sqs_payload.get("file_id", "")
+
+        if not has_spooled_file(spool_dir, file_id):
+            print(
+                f"⚠️ Qdrant spool {spool_dir} is full; uploading file_id {file_id} directly."
+            )
+            return False
+
+        print(
+            f"⚠️ Qdrant spool {spool_dir} is full, but file_id {file_id} has an older segment in it; spooling anyway."
+        )
+
+    with time_stage("spool_write"):
+        manifest_name = write_segment(spool_dir, sqs_payload, pending_upload)
+
+    print(
+        f"✅ Spooled {len(pending_upload['point_ids'])} chunks for file_id {sqs_payload.get('file_id')} ({manifest_name})"
+    )
+
+    return True
+
+
+class SpoolFlusher:
+    """
+    Drains the write-ahead spool into Qdrant from a thread of the service
+    process. Workers in any process write segments; the flusher uploads
+    the oldest ones in batches of about flush_points points, then deletes
+    each file's stale points and removes the segments.
+
+    Results of spooled messages are held with hold() and come back from
+    take_flushed() once every segment of their message is in Qdrant. Only
+    then is the SQS message deleted. If Qdrant is unreachable, the
+    flusher backs off and retries, and the held messages stay in flight.
+    Segments Qdrant rejects are quarantined and their messages failed.
+    Segments left by a previous run are flushed on start-up.
+    """
+
+    def __init__(
+        self,
+        spool_dir: str,
+        flush_points: int = QDRANT_SPOOL_FLUSH_POINTS,
+        flush_interval_seconds: float = QDRANT_SPOOL_FLUSH_INTERVAL_SECONDS,
+        max_backoff_seconds: float = QDRANT_SPOOL_MAX_BACKOFF_SECONDS,
+    ):
+        self.spool_dir = spool_dir
+        self.flush_points = max(1, flush_points)
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+        self._lock = threading.Lock()
+        self._held: dict[str, list[EmbedStatus]] = {}
+        self._flushed: list[EmbedStatus] = []
+        self._failed_prefixes: dict[str, float] = {}
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._qdrant_client: QdrantClient | None = None
+        self._failures = 0
+        self._last_orphan_check = 0.0
+
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def _pending_prefixes(self) -> set[str]:
+        return {name.split(".", 1)[0] for name in list_manifests(self.spool_dir)}
+
+    def hold(self, results: list[EmbedStatus]) -> list[EmbedStatus]:
+        """
+        Holds every complete result whose message still has a segment in the
+        spool, and returns the rest, which can be finished right away.
+        """
+
+        ready = []
+
+        with self._lock:
+            pending = self._pending_prefixes()
+
+            for result in results:
+                prefix = get_segment_prefix(result.get("message_id", ""))
+
+                if self._failed_prefixes.pop(prefix, None) is not None:
+                    ready.append({**result, "process_status": "failed"})
+                elif result.get("process_status") == "complete" and prefix in pending:
+                    self._held.setdefault(prefix, []).append(result)
+                else:
+                    ready.append(result)
+
+        if len(ready) < len(results):
+            self._wake.set()
+
+        return ready
+
+    def take_flushed(self) -> list[EmbedStatus]:
+        """Held results whose points are now all in Qdrant."""
+
+        with self._lock:
+            flushed, self._flushed = self._flushed, []
+
+        return flushed
+
+    def _get_qdrant_client(self) -> QdrantClient:
+        if self._qdrant_client is None:
+            self._qdrant_client = get_qdrant_client()
+
+        if self._qdrant_client is None:
+            raise ValueError("❌ SpoolFlusher could not create a Qdrant client.")
+
+        return self._qdrant_client
+
+    def _upload(self, qdrant_client: QdrantClient, segments: list) -> int:
+        point_ids = [point_id for segment in segments for point_id in segment[2]]
+        payloads = [payload for segment in segments for payload in segment[4]]
+        vectors = np.concatenate([segment[3] for segment in segments])
+
+        with time_stage("qdrant_upsert"):
+            return create_qdrant_writer(qdrant_client, QDRANT_COLLECTION_NAME).write(
+                point_ids, vectors, payloads
+            )
+
+    def _spooled_current_ids(self, skipped_names: set[str]) -> dict[str, set[str]]:
+        """current_point_ids of every other segment still spooled, by file_id."""
+
+        spooled_ids: dict[str, set[str]] = {}
+
+        for manifest_name in list_manifests(self.spool_dir):
+            if manifest_name in skipped_names:
+                continue
+
+            try:
+                manifest = read_manifest(self.spool_dir, manifest_name)
+            except (OSError, ValueError):
+                # Flushed meanwhile, or unreadable and discarded later.
+                continue
+
+            spooled_ids.setdefault(manifest.get("file_id", ""), set()).update(
+                manifest.get("current_point_ids", [])
+            )
+
+        return spooled_ids
+
+    def flush_once(self) -> bool:
+        """Uploads the oldest segments; returns False when the spool was empty."""
+
+        manifest_names = list_manifests(self.spool_dir)
+
+        if len(manifest_names) == 0:
+            return False
+
+        segments = []
+        point_count = 0
+
+        for manifest_name in manifest_names:
+            try:
+                segment = read_segment(self.spool_dir, manifest_name)
+            except (OSError, ValueError, KeyError) as e:
+                self._discard_segment(manifest_name, e)
+                continue
+
+            segments.append((manifest_name, *segment))
+            point_count += segment[0]["points"]
+
+            if point_count >= self.flush_points:
+                break
+
+        if len(segments) == 0:
+            return True
+
+        qdrant_client = self._get_qdrant_client()
+
+        # A segment only carries its new/changed points; the rest of its
+        # current_point_ids were already in Qdrant when it was written. If
+        # one of those is gone by now (deleted as stale by an older
+        # message), uploading the segment would leave the file incomplete,
+        # so its message is failed and re-embedded on redelivery instead.
+        batch_point_ids: dict[str, set[str]] = {}
+
+        for _, manifest, point_ids, *_ in segments:
+            batch_point_ids.setdefault(manifest["file_id"], set()).update(point_ids)
+
+        stored_point_ids = {
+            file_id: get_file_point_ids(qdrant_client, file_id)
+            for file_id in batch_point_ids
+        }
+
+        verified = []
+
+        for segment in segments:
+            manifest_name, manifest = segment[:2]
+            file_id = manifest["file_id"]
+            missing_point_ids = (
+                set(manifest["current_point_ids"])
+                - batch_point_ids[file_id]
+                - stored_point_ids[file_id]
+            )
+
+            if len(missing_point_ids) > 0:
+                self._discard_segment(
+                    manifest_name,
+                    ValueError(
+                        f"{len(missing_point_ids)} unchanged points of file_id {file_id} are no longer in Qdrant"
+                    ),
+                )
+                continue
+
+            verified.append(segment)
+
+        # Segments are uploaded together per vector dimension. A group Qdrant
+        # rejects is retried segment by segment, so only the segments it
+        # actually refuses are quarantined; transient errors propagate and
+        # the whole flush is retried after a backoff.
+        by_dimension: dict[int, list] = {}
+
+        for segment in verified:
+            by_dimension.setdefault(segment[1]["dimension"], []).append(segment)
+
+        written = 0
+        uploaded = []
+
+        for group in by_dimension.values():
+            try:
+                written += self._upload(qdrant_client, group)
+                uploaded.extend(group)
+                continue
+            except Exception as e:
+                if not is_rejected_qdrant_write(e):
+                    raise
+                if len(group) == 1:
+                    self._discard_segment(group[0][0], e, quarantine=True)
+                    continue
+
+            for segment in group:
+                try:
+                    written += self._upload(qdrant_client, [segment])
+                    uploaded.append(segment)
+                except Exception as e:
+                    if not is_rejected_qdrant_write(e):
+                        raise
+                    self._discard_segment(segment[0], e, quarantine=True)
+
+        increment("embedding_points_upserted_total", written)
+
+        # The newest segment of a file describes what the file holds now;
+        # anything else stored for it, including points of older segments
+        # in this same batch, is stale. Points a newer segment still in the
+        # spool relies on are kept for it.
+        latest_current_ids: dict[str, list[str]] = {}
+
+        for _, manifest, *_ in uploaded:
+            latest_current_ids[manifest["file_id"]] = manifest["current_point_ids"]
+
+        spooled_ids = self._spooled_current_ids({segment[0] for segment in segments})
+
+        for file_id, current_point_ids in latest_current_ids.items():
+            stale_point_ids = sorted(
+                get_file_point_ids(qdrant_client, file_id)
+                - set(current_point_ids)
+                - spooled_ids.get(file_id, set())
+            )
+
+            if len(stale_point_ids) > 0:
+                delete_points(qdrant_client, stale_point_ids)
+
+        with self._lock:
+            for manifest_name, manifest, *_ in uploaded:
+                remove_segment(self.spool_dir, manifest_name, manifest["segment_id"])
+
+            pending = self._pending_prefixes()
+
+            for prefix in [prefix for prefix in self._held if prefix not in pending]:
+                self._flushed.extend(self._held.pop(prefix))
+
+        print(
+            f"✅ Flushed {written} spooled points from {len(uploaded)} segment(s) to Qdrant."
+        )
+
+        return True
+
+    def _discard_segment(
+        self, manifest_name: str, error: Exception, quarantine: bool = False
+    ) -> None:
+        """
+        Removes a segment that can't be read or uploaded, or with quarantine,
+        moves it to the spool's quarantine directory. Its messages are
+        released as failed, so they're left for SQS to redeliver instead of
+        deleted.
+        """
+
+        prefix, segment_id = manifest_name.split(".")[:2]
+
+        with self._lock:
+            if quarantine:
+                quarantine_segment(self.spool_dir, manifest_name, segment_id)
+                print(
+                    f"❌ Quarantined spool segment {manifest_name} rejected by Qdrant: {error}"
+                )
+            else:
+                remove_segment(self.spool_dir, manifest_name, segment_id)
+                print(f"❌ Discarded spool segment {manifest_name}: {error}")
+
+            held_results = self._held.pop(prefix, [])
+
+            for result in held_results:
+                self._flushed.append({**result, "process_status": "failed"})
+
+            # The message's result may not have been held yet; hold() fails
+            # it when it arrives.
+            if len(held_results) == 0:
+                self._failed_prefixes[prefix] = time.time()
+
+    def _remove_orphans(self) -> None:
+        now = time.time()
+
+        if now - self._last_orphan_check < ORPHAN_SECONDS:
+            return
+
+        self._last_orphan_check = now
+
+        with self._lock:
+            for prefix, failed_at in list(self._failed_prefixes.items()):
+                if now - failed_at > ORPHAN_SECONDS:
+                    del self._failed_prefixes[prefix]
+
+        committed = {name.split(".")[1] for name in list_manifests(self.spool_dir)}
+
+        with os.scandir(self.spool_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(MANIFEST_SUFFIX):
+                    continue
+
+                try:
+                    if entry.is_dir():
+                        continue
+
+                    if (
+                        entry.name.split(".")[0] not in committed
+                        and now - entry.stat().st_mtime > ORPHAN_SECONDS
+                    ):
+                        os.remove(entry.path)
+                        print(f"♻️ Removed orphaned spool file {entry.name}")
+                except FileNotFoundError:
+                    continue
+
+    def _report(self) -> None:
+        with self._lock:
+            held_messages = sum(len(results) for results in self._held.values())
+
+        set_gauge("embedding_spool_segments", len(list_manifests(self.spool_dir)))
+        set_gauge("embedding_spool_bytes", get_spool_bytes(self.spool_dir))
+        set_gauge("embedding_spool_held_messages", held_messages)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            flushed = False
+            delay = self.flush_interval_seconds
+
+            try:
+                self._remove_orphans()
+                flushed = self.flush_once()
+                self._failures = 0
+
+            except Exception as e:
+                if invalidate_on_qdrant_auth_error(e):
+                    self._qdrant_client = None
+
+                self._failures += 1
+                delay = min(
+                    self.max_backoff_seconds,
+                    self.flush_interval_seconds * 2**self._failures,
+                )
+
+                print(
+                    f"⚠️ Spool flush failed ({type(e).__name__}: {e}); retrying in {delay:.1f}s."
+                )
+                if not isinstance(e, OSError):
+                    traceback.print_exc()
+
+            self._report()
+
+            if flushed:
+                continue
+
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="qdrant-spool-flusher", daemon=True
+        )
+        self._thread.start()
+
+        print(f"✅ Qdrant write-ahead spool enabled in {self.spool_dir}")
+
+    def stop(self) -> None:
+        # Whatever is still spooled is flushed on the next start; its SQS
+        # messages were never deleted, so they are redelivered meanwhile.
+        self._stopped.set()
+        self._wake.set()
+
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+
+def create_spool_flusher() -> SpoolFlusher | None:
+    spool_dir = get_spool_dir()
+
+    if not spool_dir:
+        return None
+
+    return SpoolFlusher(
+        spool_dir,
+        flush_points=int(
+            os.getenv("QDRANT_SPOOL_FLUSH_POINTS", str(QDRANT_SPOOL_FLUSH_POINTS))
+        ),
+        flush_interval_seconds=float(
+            os.getenv(
+                "QDRANT_SPOOL_FLUSH_INTERVAL_SECONDS",
+                str(QDRANT_SPOOL_FLUSH_INTERVAL_SECONDS),
+            )
+        ),
+    )
@@ -0,0 +1,260 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+import numpy as np
+from qdrant_client import QdrantClient, models
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+QDRANT_UPSERT_BATCH_SIZE = 256
+QDRANT_UPSERT_MAX_BATCH_BYTES = 8 * 1024 * 1024
+QDRANT_UPSERT_PARALLELISM = 4
+QDRANT_UPSERT_MAX_RETRIES = 3
+QDRANT_UPSERT_RETRY_BACKOFF_SECONDS = 0.5
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_GRPC_CODES = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.ABORTED,
+}
+REJECTED_GRPC_CODES = {
+    grpc.StatusCode.INVALID_ARGUMENT,
+    grpc.StatusCode.FAILED_PRECONDITION,
+    grpc.StatusCode.OUT_OF_RANGE,
+}
+
+
+def is_transient_qdrant_error(error: Exception) -> bool:
+    # Connection resets, timeouts and the like surface as ResponseHandlingException.
+    if isinstance(error, ResponseHandlingException):
+        return True
+
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code in RETRYABLE_STATUS_CODES
+
+    if isinstance(error, grpc.RpcError):
+        return error.code() in RETRYABLE_GRPC_CODES
+
+    return False
+
+
+def is_rejected_qdrant_write(error: Exception) -> bool:
+    """
+    True when Qdrant (or the client's own validation) refused the points
+    themselves, e.g. a vector of the wrong dimension, so sending them again
+    can't succeed. Rejected credentials don't count: they're fixed by
+    rotating the key, not by changing the points.
+    """
+
+    if isinstance(error, UnexpectedResponse):
+        return (
+            400 <= error.status_code < 500
+            and error.status_code not in RETRYABLE_STATUS_CODES
+            and error.status_code not in (401, 403)
+        )
+
+    if isinstance(error, grpc.RpcError):
+        return error.code() in REJECTED_GRPC_CODES
+
+    return isinstance(error, ValueError)
+
+
+# One upload thread pool per process, shared by every writer.
+_upsert_executor: tuple[int, ThreadPoolExecutor] | None = None
+_upsert_executor_lock = threading.Lock()
+
+
+def get_upsert_executor() -> ThreadPoolExecutor:
+    global _upsert_executor
+
+    with _upsert_executor_lock:
+        if _upsert_executor is None or _upsert_executor[0] != os.getpid():
+            parallelism = int(
+                os.getenv("QDRANT_UPSERT_PARALLELISM", str(QDRANT_UPSERT_PARALLELISM))
+            )
+            _upsert_executor = (
+                os.getpid(),
+                ThreadPoolExecutor(
+                    max_workers=max(1, parallelism),
+                    thread_name_prefix="qdrant-upsert",
+                ),
+            )
+
+        return _upsert_executor[1]
+
+
+class QdrantBatchWriter:
+    """
+    Uploads points to Qdrant straight from a NumPy matrix.
+
+    Points are split into batches bounded both by point count and by an
+    estimate of the request size, and each batch only converts its own rows
+    to Python floats, so a huge document never materializes as one giant
+    list-of-lists request. Batches are sent concurrently on a shared thread
+    pool (over gRPC when the client was built with prefer_grpc).
+
+    With wait=False, every batch except the last is sent without waiting for
+    it to be applied; once all of them are acknowledged the last batch is
+    sent with wait=True. Qdrant applies a collection's updates in the order
+    it accepted them, so that final ack acts as a consistency barrier for
+    the whole write. Each batch is retried on transient errors with
+    exponential backoff; only a batch that keeps failing fails the write.
+    """
+
+    def __init__(
+        self,
+        qdrant_client: QdrantClient,
+        collection_name: str,
+        batch_size: int = QDRANT_UPSERT_BATCH_SIZE,
+        max_batch_bytes: int = QDRANT_UPSERT_MAX_BATCH_BYTES,
+        wait: bool = True,
+        max_retries: int = QDRANT_UPSERT_MAX_RETRIES,
+        retry_backoff_seconds: float = QDRANT_UPSERT_RETRY_BACKOFF_SECONDS,
+        executor: ThreadPoolExecutor | None = None,
+    ):
+        self.qdrant_client = qdrant_client
+        self.collection_name = collection_name
+        self.batch_size = max(1, batch_size)
+        self.max_batch_bytes = max(1, max_batch_bytes)
+        self.wait = wait
+        self.max_retries = max(0, max_retries)
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.executor = executor or get_upsert_executor()
+
+    def _batch_bounds(
+        self, vectors: np.ndarray, payloads: list[dict]
+    ) -> list[tuple[int, int]]:
+        # float32 vectors roughly double in size once serialized; payload
+        # size is dominated by the chunk text.
+        vector_bytes = (
+            vectors.shape[1] * vectors.itemsize * 2 if vectors.ndim == 2 else 0
+        )
+
+        bounds = []
+        start = 0
+        batch_bytes = 0
+
+        for index, payload in enumerate(payloads):
+            point_bytes = vector_bytes + len(
+                str(payload.get("original_chunk_text", ""))
+            )
+
+            if index > start and (
+                index - start >= self.batch_size
+                or batch_bytes + point_bytes > self.max_batch_bytes
+            ):
+                bounds.append((start, index))
+                start, batch_bytes = index, 0
+
+            batch_bytes += point_bytes
+
+        if start < len(payloads):
+            bounds.append((start, len(payloads)))
+
+        return bounds
+
+    def _upsert_batch(
+        self,
+        ids: list[str],
+        vectors: np.ndarray,
+        payloads: list[dict],
+        start: int,
+        end: int,
+        wait: bool,
+    ) -> None:
+        batch = models.Batch(
+            ids=ids[start:end],
+            vectors=vectors[start:end].tolist(),
+            payloads=payloads[start:end],
+        )
+
+        attempt = 0
+
+        while True:
+            try:
+                self.qdrant_client.upsert(
+                    collection_name=self.collection_name, points=batch, wait=wait
+                )
+                return
+
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient_qdrant_error(e):
+                    raise
+
+                attempt += 1
+                delay = self.retry_backoff_seconds * 2 ** (attempt - 1)
+                delay *= 1 + random.random()
+
+                print(
+                    f"⚠️ Transient {type(e).__name__} upserting points {start}-{end - 1} to Qdrant, retry {attempt}/{self.max_retries} in {delay:.2f}s: {e}"
+                )
+                time.sleep(delay)
+
+    def write(self, ids: list[str], vectors: np.ndarray, payloads: list[dict]) -> int:
+        """Upserts the points and returns how many were written."""
+
+        if len(ids) == 0:
+            return 0
+
+        bounds = self._batch_bounds(vectors, payloads)
+
+        if self.wait:
+            leading_bounds, barrier_bounds = bounds, None
+        else:
+            leading_bounds, barrier_bounds = bounds[:-1], bounds[-1]
+
+        futures = [
+            self.executor.submit(
+                self._upsert_batch, ids, vectors, payloads, start, end, self.wait
+            )
+            for start, end in leading_bounds
+        ]
+
+        # Surface the first failure only after every batch has finished, so
+        # no upload is still running against the caller's arrays.
+        errors = []
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(e)
+
+        if errors:
+            raise errors[0]
+
+        if barrier_bounds is not None:
+            self._upsert_batch(ids, vectors, payloads, *barrier_bounds, wait=True)
+
+        return len(ids)
+
+
+def create_qdrant_writer(
+    qdrant_client: QdrantClient, collection_name: str
+) -> QdrantBatchWriter:
+    return QdrantBatchWriter(
+        qdrant_client,
+        collection_name,
+        batch_size=int(
+            os.getenv("QDRANT_UPSERT_BATCH_SIZE", str(QDRANT_UPSERT_BATCH_SIZE))
+        ),
+        max_batch_bytes=int(
+            os.getenv(
+                "QDRANT_UPSERT_MAX_BATCH_BYTES", str(QDRANT_UPSERT_MAX_BATCH_BYTES)
+            )
+        ),
+        wait=os.getenv("QDRANT_UPSERT_WAIT", "true").strip().lower() == "true",
+        max_retries=int(
+            os.getenv("QDRANT_UPSERT_MAX_RETRIES", str(QDRANT_UPSERT_MAX_RETRIES))
+        ),
+        retry_backoff_seconds=float(
+            os.getenv(
+                "QDRANT_UPSERT_RETRY_BACKOFF_SECONDS",
+                str(QDRANT_UPSERT_RETRY_BACKOFF_SECONDS),
+            )
+        ),
+    )
@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from services.embedding.scheduler import EmbeddingScheduler
+from services.embedding.utils.main import get_embedd_model_name
+from services.metrics.main import increment, observe
+
+QUERY_EMBEDDING_PORT = 0
+QUERY_EMBEDDING_MAX_QUERIES = 64
+QUERY_EMBEDDING_MAX_CHARS = 2000
+QUERY_EMBEDDING_TIMEOUT_SECONDS = 10.0
+QUERY_EMBEDDING_THREADS = 1
+QUERY_EMBEDDING_WORKER_NICE = 5
+
+# Well above QUERY_EMBEDDING_MAX_QUERIES queries of QUERY_EMBEDDING_MAX_CHARS.
+MAX_REQUEST_BYTES = 1024 * 1024
+
+
+def get_query_port() -> int:
+    return int(os.getenv("QUERY_EMBEDDING_PORT", str(QUERY_EMBEDDING_PORT)))
+
+
+def is_query_endpoint_enabled() -> bool:
+    return get_query_port() > 0
+
+
+def get_query_threads() -> int:
+    return max(
+        1, int(os.getenv("QUERY_EMBEDDING_THREADS", str(QUERY_EMBEDDING_THREADS)))
+    )
+
+
+def lower_ingestion_priority() -> None:
+    """
+    Part of the ingestion worker initializers. With the query endpoint on,
+    worker processes run QUERY_EMBEDDING_WORKER_NICE steps nicer, so query
+    encodes in the service process get the CPU ahead of them.
+    """
+
+    if not is_query_endpoint_enabled():
+        return
+
+    nice = int(
+        os.getenv("QUERY_EMBEDDING_WORKER_NICE", str(QUERY_EMBEDDING_WORKER_NICE))
+    )
+
+    if nice <= 0:
+        return
+
+    try:
+        os.nice(nice)
+    except OSError as e:
+        print(f"⚠️ Could not lower the priority of worker {os.getpid()}: {e}")
+
+
+def parse_queries(body: Any) -> list[str]:
+    """
+    Accepts {"query": "..."} or {"queries": ["...", ...]}; raises ValueError
+    for anything else or for more/longer queries than allowed.
+    """
+
+    if not isinstance(body, dict):
+        raise ValueError("Expected a JSON object.")
+
+    queries = [body["query"]] if "query" in body else body.get("queries")
+
+    if not isinstance(queries, list) or len(queries) == 0:
+        raise ValueError('Expected "query" or a non-empty "queries" list.')
+
+    max_queries = int(
+        os.getenv("QUERY_EMBEDDING_MAX_QUERIES", str(QUERY_EMBEDDING_MAX_QUERIES))
+    )
+    max_chars = int(
+        os.getenv("QUERY_EMBEDDING_MAX_CHARS", str(QUERY_EMBEDDING_MAX_CHARS))
+    )
+
+    if len(queries) > max_queries:
+        raise ValueError(f"At most {max_queries} queries per request.")
+
+    for query in queries:
+        if not isinstance(query, str) or not query.strip():
+            raise ValueError("Every query must be a non-empty string.")
+
+        if len(query) > max_chars:
+            raise ValueError(f"Queries are limited to {max_chars} characters.")
+
+    return queries
+
+
+class _QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 drops connections from bursts of
+    # concurrent queries, which then wait a second for the SYN retry.
+    request_queue_size = 128
+
+    def __init__(
+        self, address: tuple[str, int], embedding_scheduler: EmbeddingScheduler
+    ):
+        super().__init__(address, _QueryHandler)
+        self.embedding_scheduler = embedding_scheduler
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    server: _QueryServer
+
+    def _send_json(self, status: int, response: dict) -> None:
+        body = json.dumps(response).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/healthz":
+            self.send_error(404)
+            return
+
+        self._send_json(
+            200,
+            {
+                "model": get_embedd_model_name(),
+                "dimension": self.server.embedding_scheduler.dimension,
+            },
+        )
+
+    def do_POST(self) -> None:
+        if self.path.split("?")[0] != "/embed":
+            self.send_error(404)
+            return
+
+        started = time.perf_counter()
+        status, response = self._embed()
+
+        self._send_json(status, response)
+
+        increment("embedding_query_requests_total", status=str(status))
+        observe("embedding_query_seconds", time.perf_counter() - started)
+
+    def _embed(self) -> tuple[int, dict]:
+        try:
+            content_length = int(self.headers.get("Content-Length") or 0)
+
+            if content_length > MAX_REQUEST_BYTES:
+                return 413, {
+                    "error": f"Requests are limited to {MAX_REQUEST_BYTES} bytes."
+                }
+
+            body = json.loads(self.rfile.read(content_length))
+            queries = parse_queries(body)
+        except ValueError as e:
+            # json.JSONDecodeError is a ValueError too.
+            return 400, {"error": str(e)}
+
+        timeout = float(
+            os.getenv(
+                "QUERY_EMBEDDING_TIMEOUT_SECONDS", str(QUERY_EMBEDDING_TIMEOUT_SECONDS)
+            )
+        )
+
+        try:
+            vectors = self.server.embedding_scheduler.submit(
+                queries, priority=True
+            ).result(timeout=timeout)
+        except RuntimeError as e:
+            # The scheduler has been stopped: the service is shutting down.
+            return 503, {"error": str(e)}
+        except FutureTimeoutError:
+            return 503, {"error": f"Embedding took longer than {timeout}s."}
+        except Exception as e:
+            print(
+                f"❌ Unexpected Exception embedding queries in the query endpoint: {e}"
+            )
+            return 500, {"error": "Embedding failed."}
+
+        response: dict[str, Any] = {
+            "model": get_embedd_model_name(),
+            "dimension": int(vectors.shape[1]),
+        }
+
+        if "query" in body:
+            response["vector"] = vectors[0].tolist()
+        else:
+            response["vectors"] = vectors.tolist()
+
+        return 200, response
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # One line per query would drown out the service's own logs.
+        return
+
+
+def start_query_server(
+    embedding_scheduler: EmbeddingScheduler,
+) -> ThreadingHTTPServer | None:
+    """
+    Serves POST /embed on QUERY_EMBEDDING_PORT (0, the default, turns it off).
+    Queries are submitted to embedding_scheduler as priority work, so
+    concurrent requests share micro-batched encode() calls that go ahead of
+    ingestion. Stop it with server.shutdown().
+    """
+
+    port = get_query_port()
+
+    if port <= 0:
+        return None
+
+    try:
+        server = _QueryServer(("0.0.0.0", port), embedding_scheduler)
+    except OSError as e:
+        print(f"❌ Could not start the query embedding server on port {port}: {e}")
+        return None
+
+    threading.Thread(
+        target=server.serve_forever, name="query-embedding-server", daemon=True
+    ).start()
+
+    print(f"✅ Serving query embeddings on :{port}/embed")
+
+    return server
@@ -0,0 +1,302 @@
+import collections
+import os
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+
+from services.aws.s3 import get_object_sizes
+from services.metrics.main import observe, set_gauge
+from services.utils.types.main import (
+    EmbedStatus,
+    ScheduledMessage,
+    SQSPayload,
+    size_class,
+)
+
+SCHEDULING_MAX_QUEUED_MESSAGES = 50
+SCHEDULING_SMALL_MB = 1.0
+SCHEDULING_LARGE_MB = 10.0
+SCHEDULING_AGING_MB_PER_SECOND = 0.05
+SCHEDULING_MAX_WAIT_SECONDS = 120
+
+# Every message costs at least this much, so many tiny notes from one user
+# still count against that user's share.
+MESSAGE_OVERHEAD_MB = 0.05
+
+# Recent completions per size class that the p95 gauge is computed over.
+COMPLETION_WINDOW = 500
+
+SIZE_CLASSES: tuple[size_class, ...] = ("small", "medium", "large", "unknown")
+
+
+def get_size_class_bounds() -> tuple[float, float]:
+    """(SCHEDULING_SMALL_MB, SCHEDULING_LARGE_MB)"""
+
+    return (
+        float(os.getenv("SCHEDULING_SMALL_MB", str(SCHEDULING_SMALL_MB))),
+        float(os.getenv("SCHEDULING_LARGE_MB", str(SCHEDULING_LARGE_MB))),
+    )
+
+
+def get_size_class(
+    size_bytes: int | None, small_mb: float, large_mb: float
+) -> size_class:
+    if size_bytes is None:
+        return "unknown"
+
+    size_mb = size_bytes / 1024**2
+
+    if size_mb < small_mb:
+        return "small"
+
+    if size_mb < large_mb:
+        return "medium"
+
+    return "large"
+
+
+class MessageScheduler:
+    """
+    Holds received SQS messages and decides which ones the workers get
+    next, instead of taking them in the order SQS returned them.
+
+    Each message is sized with a HEAD of its transcript_s3_key, and its cost
+    is the object size in MB. With policy "fair" the next message is the
+    one with the lowest
+
+        user's virtual time + cost - aging_mb_per_second * seconds waited
+
+    and dispatching it adds its cost to its user's virtual time. A user
+    whose queue was empty starts at the virtual time of the last dispatched
+    message, so idle time isn't banked as credit. The result is that one
+    user's short note goes ahead of another user's tenth long PDF, and each
+    user's small documents go before their large ones. Aging lets large
+    documents move up while they wait. A message that has waited
+    max_wait_seconds is dispatched next, oldest first.
+
+    Policy "fifo" dispatches in arrival order. It records the same
+    completion latencies, as a baseline for "fair".
+    """
+
+    def __init__(
+        self,
+        policy: str = "fair",
+        max_queued_messages: int = SCHEDULING_MAX_QUEUED_MESSAGES,
+        small_mb: float = SCHEDULING_SMALL_MB,
+        large_mb: float = SCHEDULING_LARGE_MB,
+        aging_mb_per_second: float = SCHEDULING_AGING_MB_PER_SECOND,
+        max_wait_seconds: float = SCHEDULING_MAX_WAIT_SECONDS,
+        size_reader: Callable[[list[str]], dict[str, int | None]] = get_object_sizes,
+    ):
+        self.policy = policy
+        self.max_queued_messages = max(1, max_queued_messages)
+        self.small_mb = small_mb
+        self.large_mb = large_mb
+        self.aging_mb_per_second = aging_mb_per_second
+        self.max_wait_seconds = max_wait_seconds
+        self._read_sizes = size_reader
+
+        self._lock = threading.Lock()
+        # user_id -> that user's messages waiting to be dispatched.
+        self._queued: dict[str, list[ScheduledMessage]] = {}
+        self._virtual_time: dict[str, float] = {}
+        self._system_virtual_time = 0.0
+        self._sequence = 0
+        # message_id -> dispatched message whose result isn't in yet.
+        self._dispatched: dict[str, ScheduledMessage] = {}
+        self._completions = {
+            size: collections.deque(maxlen=COMPLETION_WINDOW) for size in SIZE_CLASSES
+        }
+
+    @property
+    def queued_count(self) -> int:
+        with self._lock:
+            return sum(len(messages) for messages in self._queued.values())
+
+    def capacity(self) -> int:
+        """How many more messages can be received without going over max_queued_messages."""
+
+        return max(0, self.max_queued_messages - self.queued_count)
+
+    def add(self, sqs_msg_list: list[SQSPayload]) -> None:
+        sizes = self._read_sizes(
+            list({msg["transcript_s3_key"] for msg in sqs_msg_list})
+        )
+        received_at = time.monotonic()
+
+        with self._lock:
+            for msg in sqs_msg_list:
+                user_id = msg.get("user_id", "")
+                size_bytes = sizes.get(msg["transcript_s3_key"])
+
+                if user_id not in self._queued:
+                    self._virtual_time[user_id] = max(
+                        self._virtual_time.get(user_id, 0.0),
+                        self._system_virtual_time,
+                    )
+
+                self._queued.setdefault(user_id, []).append(
+                    {
+                        "sqs_payload": msg,
+                        "size_bytes": size_bytes,
+                        # Unknown sizes are costed like a mid-sized document.
+                        "cost": max(
+                            MESSAGE_OVERHEAD_MB,
+                            self.small_mb
+                            if size_bytes is None
+                            else size_bytes / 1024**2,
+                        ),
+                        "size_class": get_size_class(
+                            size_bytes, self.small_mb, self.large_mb
+                        ),
+                        "received_at": received_at,
+                        "sequence": self._sequence,
+                    }
+                )
+                self._sequence += 1
+
+            self._report()
+
+    def take(self, max_messages: int) -> list[SQSPayload]:
+        """Removes and returns up to max_messages messages in dispatch order."""
+
+        taken: list[SQSPayload] = []
+
+        with self._lock:
+            while len(taken) < max_messages and len(self._queued) > 0:
+                taken.append(self._pop_next(time.monotonic())["sqs_payload"])
+
+            self._report()
+
+        return taken
+
+    def _priority(self, message: ScheduledMessage, now: float) -> float:
+        user_id = message["sqs_payload"].get("user_id", "")
+        waited = now - message["received_at"]
+
+        return (
+            self._virtual_time[user_id]
+            + message["cost"]
+            - self.aging_mb_per_second * waited
+        )
+
+    def _pop_next(self, now: float) -> ScheduledMessage:
+        queued = [message for messages in self._queued.values() for message in messages]
+        oldest = min(queued, key=lambda message: message["sequence"])
+        waited = now - oldest["received_at"]
+
+        if self.policy == "fifo":
+            message = oldest
+        else:
+            message = min(
+                queued,
+                key=lambda message: (
+                    self._priority(message, now),
+                    message["sequence"],
+                ),
+            )
+
+            if message is not oldest and waited >= self.max_wait_seconds:
+                message = oldest
+                print(
+                    f"⚠️ Message {oldest['sqs_payload'].get('message_id')} waited {waited:.0f}s in the scheduler; dispatching it ahead of its fair share."
+                )
+
+        sqs_payload = message["sqs_payload"]
+        user_id = sqs_payload.get("user_id", "")
+
+        self._queued[user_id].remove(message)
+
+        if len(self._queued[user_id]) == 0:
+            del self._queued[user_id]
+
+        self._system_virtual_time = self._virtual_time[user_id]
+        self._virtual_time[user_id] += message["cost"]
+
+        # Idle users at or below the system virtual time would be moved up
+        # to it anyway when they come back.
+        for idle_user_id in [
+            other_id
+            for other_id, virtual_time in self._virtual_time.items()
+            if other_id not in self._queued
+            and virtual_time <= self._system_virtual_time
+        ]:
+            del self._virtual_time[idle_user_id]
+
+        self._dispatched[sqs_payload["message_id"]] = message
+
+        return message
+
+    def record_completion(self, results: list[EmbedStatus]) -> None:
+        """Observes receive-to-finish latency for every complete result."""
+
+        now = time.monotonic()
+
+        with self._lock:
+            for result in results:
+                message = self._dispatched.pop(result.get("message_id", ""), None)
+
+                if message is None or result.get("process_status") != "complete":
+                    continue
+
+                seconds = now - message["received_at"]
+                completions = self._completions[message["size_class"]]
+                completions.append(seconds)
+
+                observe(
+                    "embedding_completion_seconds",
+                    seconds,
+                    size_class=message["size_class"],
+                )
+                set_gauge(
+                    "embedding_completion_p95_seconds",
+                    float(np.percentile(completions, 95)),
+                    size_class=message["size_class"],
+                )
+
+    def _report(self) -> None:
+        counts = collections.Counter(
+            message["size_class"]
+            for messages in self._queued.values()
+            for message in messages
+        )
+
+        for size in SIZE_CLASSES:
+            set_gauge("embedding_scheduled_messages", counts[size], size_class=size)
+
+
+def create_message_scheduler() -> MessageScheduler | None:
+    """Returns None unless SCHEDULING_POLICY is fair or fifo."""
+
+    policy = os.getenv("SCHEDULING_POLICY", "off").strip().lower()
+
+    if policy not in ("fair", "fifo"):
+        if policy != "off":
+            print(
+                f"⚠️ Unknown SCHEDULING_POLICY {policy!r}; messages are not scheduled."
+            )
+
+        return None
+
+    small_mb, large_mb = get_size_class_bounds()
+
+    return MessageScheduler(
+        policy=policy,
+        max_queued_messages=int(
+            os.getenv(
+                "SCHEDULING_MAX_QUEUED_MESSAGES", str(SCHEDULING_MAX_QUEUED_MESSAGES)
+            )
+        ),
+        small_mb=small_mb,
+        large_mb=large_mb,
+        aging_mb_per_second=float(
+            os.getenv(
+                "SCHEDULING_AGING_MB_PER_SECOND", str(SCHEDULING_AGING_MB_PER_SECOND)
+            )
+        ),
+        max_wait_seconds=float(
+            os.getenv("SCHEDULING_MAX_WAIT_SECONDS", str(SCHEDULING_MAX_WAIT_SECONDS))
+        ),
+    )
@@ -1,5 +1,7 @@
 from typing import Literal, TypedDict
 
+import numpy as np
+
 
 class SQSPayload(TypedDict):
     original_filename: str
@@ -16,3 +18,59 @@ process_status = Literal["complete", "failed"]
 
 class EmbedStatus(SQSPayload):
     process_status: process_status
+
+
+class WorkerResult(TypedDict):
+    embed_status: EmbedStatus
+    worker_pid: int
+    tasks_completed: int
+    rss_bytes: int
+    private_bytes: int
+
+
+class PendingUpload(TypedDict):
+    point_ids: list[str]
+    payloads: list[dict]
+    vectors: np.ndarray
+    stale_point_ids: list[str]
+    # Every point the file has after this upload, unchanged ones included.
+    current_point_ids: list[str]
+
+
+size_class = Literal["small", "medium", "large", "unknown"]
+
+
+class ScheduledMessage(TypedDict):
+    sqs_payload: SQSPayload
+    # None when the HEAD request failed.
+    size_bytes: int | None
+    cost: float
+    size_class: size_class
+    # time.monotonic() when the message was received.
+    received_at: float
+    # Arrival order, also among messages of the same receive.
+    sequence: int
+
+
+class ScalingDecision(TypedDict):
+    workers: int
+    receive_batch_size: int
+    encode_batch_size: int
+    idle_sleep_seconds: float
+
+
+class StreamProgress(TypedDict):
+    file_id: str
+    chunks_seen: int
+    chunks_unchanged: int
+    batches_uploaded: int
+    points_uploaded: int
+    # Only collected with EMBED_STREAM_CLEANUP_ON_FAILURE=true.
+    uploaded_point_ids: list[str]
+
+
+class WorkerTopology(TypedDict):
+    processes: int
+    threads_per_process: int
+    # One CPU id list per worker slot; empty when workers aren't pinned.
+    cpu_sets: list[list[int]]
@@ -0,0 +1,280 @@
+import json
+import os
+import resource
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any
+
+from services.aws.s3 import get_s3_client
+from services.embedding.main import embed_and_upload
+from services.embedding.scheduler import create_embedding_scheduler
+from services.embedding.utils.main import get_embedd_model, handle_msg_feedback
+from services.metrics.main import (
+    flush_metrics,
+    get_metrics_queue,
+    get_private_bytes,
+    init_metrics_worker,
+    remove_gauges,
+)
+from services.qdrant.main import (
+    get_qdrant_client,
+    get_qdrant_secret_generation,
+    refresh_qdrant_client,
+)
+from services.query.main import lower_ingestion_priority
+from services.utils.types.main import EmbedStatus, WorkerResult, WorkerTopology
+from services.workers.topology import (
+    create_slot_counter,
+    init_topology_worker,
+    plan_worker_topology,
+)
+
+# Per-process resources loaded ONCE by init_embedding_worker() when a warm
+# worker starts, then reused for every message that worker handles.
+_worker_resources: dict[str, Any] = {}
+_worker_task_count = 0
+_worker_secret_generation = 0
+
+
+def get_process_rss_bytes() -> int:
+    """Returns the current resident set size of this process in bytes."""
+
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+    except (OSError, ValueError, IndexError):
+        # Non-Linux fallback: peak RSS is the best we can get (KB on Linux/BSD).
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def init_embedding_worker(
+    metrics_queue: Any = None,
+    topology: WorkerTopology | None = None,
+    slot_counter: Any = None,
+) -> None:
+    """ProcessPoolExecutor initializer that warms up a worker process."""
+
+    global _worker_secret_generation
+
+    init_metrics_worker(metrics_queue)
+    lower_ingestion_priority()
+
+    # Thread limits go in before the model loads its first kernels.
+    if topology is not None:
+        init_topology_worker(topology, slot_counter)
+
+    _worker_secret_generation = get_qdrant_secret_generation()
+    _worker_resources["embedding_model"] = get_embedd_model()
+    _worker_resources["qdrant_client"] = get_qdrant_client()
+    _worker_resources["s3_client"] = get_s3_client()
+
+    print(f"✅ Warm embedding worker {os.getpid()} initialized.")
+
+
+def warm_executor_worker(json_payload: str) -> WorkerResult:
+    global _worker_task_count, _worker_secret_generation
+
+    payload_dict = json.loads(json_payload)
+
+    # A previous message hit a Qdrant auth error and invalidated the cached
+    # credentials, so rebuild the client from freshly fetched secrets.
+    _worker_resources["qdrant_client"], _worker_secret_generation = (
+        refresh_qdrant_client(
+            _worker_resources["qdrant_client"], _worker_secret_generation
+        )
+    )
+
+    embed_status = embed_and_upload(payload_dict, **_worker_resources)
+
+    _worker_task_count += 1
+
+    flush_metrics()
+
+    return {
+        "embed_status": embed_status,
+        "worker_pid": os.getpid(),
+        "tasks_completed": _worker_task_count,
+        "rss_bytes": get_process_rss_bytes(),
+        "private_bytes": get_private_bytes(),
+    }
+
+
+class WarmWorkerPool:
+    """
+    Long-lived ProcessPoolExecutor whose workers keep the embedding model,
+    Qdrant client and s3 client loaded between SQS batches.
+
+    Workers are recycled (the whole pool is torn down and lazily rebuilt
+    before the next batch) once any worker has handled max_tasks_per_worker
+    messages or its RSS has grown past max_rss_mb. A value of 0 disables
+    that limit.
+    """
+
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        max_tasks_per_worker: int = 0,
+        max_rss_mb: int = 0,
+    ):
+        self.max_workers = max_workers
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self._executor: ProcessPoolExecutor | None = None
+        # pid -> (RSS, private bytes) as of each worker's latest message.
+        self.worker_memory: dict[int, tuple[int, int]] = {}
+
+    def start(self) -> None:
+        """Forks the workers now instead of on the first batch."""
+
+        # Forked pools start all of their workers on the first submit.
+        self._get_executor().submit(os.getpid).result()
+
+    def resize(self, max_workers: int) -> None:
+        """Changes the worker count; the pool is rebuilt before the next batch."""
+
+        if max_workers != self.max_workers:
+            self.shutdown()
+            self.max_workers = max_workers
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            topology = plan_worker_topology(self.max_workers)
+            self._executor = ProcessPoolExecutor(
+                max_workers=topology["processes"],
+                initializer=init_embedding_worker,
+                initargs=(get_metrics_queue(), topology, create_slot_counter()),
+            )
+        return self._executor
+
+    def _needs_recycle(self, worker_results: list[WorkerResult]) -> bool:
+        for result in worker_results:
+            if (
+                self.max_tasks_per_worker > 0
+                and result["tasks_completed"] >= self.max_tasks_per_worker
+            ):
+                print(
+                    f"♻️ Worker {result['worker_pid']} reached {result['tasks_completed']} tasks — recycling worker pool."
+                )
+                return True
+
+            if self.max_rss_bytes > 0 and result["rss_bytes"] >= self.max_rss_bytes:
+                print(
+                    f"♻️ Worker {result['worker_pid']} RSS of {result['rss_bytes'] // (1024 * 1024)}MB exceeded ceiling — recycling worker pool."
+                )
+                return True
+
+        return False
+
+    def map_payloads(self, json_payloads: list[str]) -> list[EmbedStatus]:
+        executor = self._get_executor()
+
+        try:
+            worker_results = list(executor.map(warm_executor_worker, json_payloads))
+
+        except BrokenProcessPool as e:
+            # A worker died mid-batch (e.g. OOM-killed). Every message in the
+            # batch is reported as failed so SQS redelivers it.
+            print(f"❌ BrokenProcessPool in WarmWorkerPool.map_payloads: {e}")
+            self.shutdown()
+            return [
+                handle_msg_feedback(json.loads(json_payload), "failed")
+                for json_payload in json_payloads
+            ]
+
+        for result in worker_results:
+            self.worker_memory[result["worker_pid"]] = (
+                result["rss_bytes"],
+                result["private_bytes"],
+            )
+
+        if self._needs_recycle(worker_results):
+            self.shutdown()
+
+        return [result["embed_status"] for result in worker_results]
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            self.worker_memory = {}
+
+            # The recycled workers' RSS gauges would otherwise linger.
+            remove_gauges("embedding_process_rss_bytes")
+            remove_gauges("embedding_process_private_bytes")
+
+
+class BatchedEmbeddingRunner:
+    """
+    Runs every message of a batch concurrently on threads inside the main
+    process. The model is loaded once and owned by an EmbeddingScheduler, so
+    chunks from all in-flight messages share the same encode() calls while
+    the threads overlap their s3 downloads and Qdrant upserts.
+    """
+
+    def __init__(self, max_concurrent_messages: int | None = None):
+        self.max_concurrent_messages = max_concurrent_messages
+
+        # One process owns the model, so its encode() calls get every CPU.
+        init_topology_worker(plan_worker_topology(1))
+
+        self.embedding_model = get_embedd_model()
+        self._secret_generation = get_qdrant_secret_generation()
+        self.qdrant_client = get_qdrant_client()
+        self.s3_client = get_s3_client()
+        self.embedding_scheduler = create_embedding_scheduler(self.embedding_model)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_messages,
+            thread_name_prefix="embedding-message",
+        )
+
+    def _embed_payload(self, json_payload: str) -> EmbedStatus:
+        return embed_and_upload(
+            json.loads(json_payload),
+            embedding_model=self.embedding_model,
+            qdrant_client=self.qdrant_client,
+            s3_client=self.s3_client,
+            embedding_scheduler=self.embedding_scheduler,
+        )
+
+    def map_payloads(self, json_payloads: list[str]) -> list[EmbedStatus]:
+        # Rebuilt between batches, never under a running message, once an
+        # auth error has invalidated the cached credentials.
+        self.qdrant_client, self._secret_generation = refresh_qdrant_client(
+            self.qdrant_client, self._secret_generation
+        )
+
+        return list(self._executor.map(self._embed_payload, json_payloads))
+
+    def resize(self, max_concurrent_messages: int) -> None:
+        # Threads are cheap to replace; the model and scheduler stay loaded.
+        if max_concurrent_messages == self.max_concurrent_messages:
+            return
+
+        self._executor.shutdown(wait=True)
+        self.max_concurrent_messages = max_concurrent_messages
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_messages,
+            thread_name_prefix="embedding-message",
+        )
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.embedding_scheduler.stop()
+
+
+def create_worker_pool() -> WarmWorkerPool:
+    pool_size = int(os.getenv("WORKER_POOL_SIZE", "0"))
+
+    return WarmWorkerPool(
+        max_workers=pool_size or None,
+        max_tasks_per_worker=int(os.getenv("WORKER_MAX_TASKS", "0")),
+        max_rss_mb=int(os.getenv("WORKER_MAX_RSS_MB", "0")),
+    )
+
+
+def create_batched_runner() -> BatchedEmbeddingRunner:
+    max_concurrent_messages = int(os.getenv("BATCHED_MAX_CONCURRENT_MESSAGES", "0"))
+
+    return BatchedEmbeddingRunner(max_concurrent_messages or None)
@@ -0,0 +1,425 @@
+import json
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from typing import Any
+
+from services.utils.types.main import WorkerTopology
+
+# Every native thread pool a worker might start reads one of these; they
+# are set for libraries loaded after the worker starts, threadpoolctl
+# covers the ones already loaded.
+THREAD_LIMIT_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+TOPOLOGY_CALIBRATION_TEXTS = 256
+TOPOLOGY_CALIBRATION_TIMEOUT_SECONDS = 600
+
+_last_topology: WorkerTopology | None = None
+_calibrated_processes: dict[int, int] = {}
+_topology_lock = threading.Lock()
+
+
+def _read_cgroup_cpu_quota() -> float | None:
+    """CPUs allowed by the container's CFS quota, or None when unlimited."""
+
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max", encoding="utf-8") as cpu_max:
+            quota, period = cpu_max.read().split()[:2]
+
+        if quota == "max":
+            return None
+
+        return int(quota) / int(period)
+
+    except (OSError, ValueError):
+        pass
+
+    try:
+        # cgroup v1
+        with open(
+            "/sys/fs/cgroup/cpu/cpu.cfs_quota_us", encoding="utf-8"
+        ) as quota_file:
+            quota_us = int(quota_file.read())
+        with open(
+            "/sys/fs/cgroup/cpu/cpu.cfs_period_us", encoding="utf-8"
+        ) as period_file:
+            period_us = int(period_file.read())
+
+        if quota_us <= 0 or period_us <= 0:
+            return None
+
+        return quota_us / period_us
+
+    except (OSError, ValueError):
+        return None
+
+
+def get_affinity_cpus() -> list[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        # No sched_getaffinity outside Linux.
+        return list(range(os.cpu_count() or 1))
+
+
+def get_cpu_budget() -> int:
+    """
+    How many CPUs this service may keep busy: WORKER_CPUS when set,
+    otherwise the CPUs it's allowed to run on, capped by the cgroup CPU
+    quota (a container limited to 2.5 CPUs on a 16-core host gets 2).
+    """
+
+    configured = int(os.getenv("WORKER_CPUS", "0"))
+
+    if configured > 0:
+        return configured
+
+    cpu_budget = len(get_affinity_cpus())
+    quota = _read_cgroup_cpu_quota()
+
+    if quota is not None:
+        cpu_budget = min(cpu_budget, max(1, math.floor(quota)))
+
+    return cpu_budget
+
+
+def _core_key(cpu: int) -> tuple[int, int, int]:
+    topology_dir = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+
+    try:
+        with open(f"{topology_dir}/physical_package_id", encoding="utf-8") as package:
+            package_id = int(package.read())
+        with open(f"{topology_dir}/core_id", encoding="utf-8") as core:
+            core_id = int(core.read())
+    except (OSError, ValueError):
+        return (0, cpu, cpu)
+
+    return (package_id, core_id, cpu)
+
+
+def get_worker_cpu_sets(processes: int) -> list[list[int]]:
+    """
+    Splits the allowed CPUs into one contiguous set per worker, ordered by
+    socket and physical core so hyperthread siblings land in the same set.
+    Empty unless WORKER_CPU_AFFINITY=true, or when there are fewer CPUs
+    than workers.
+    """
+
+    if os.getenv("WORKER_CPU_AFFINITY", "false").strip().lower() != "true":
+        return []
+
+    cpus = sorted(get_affinity_cpus(), key=_core_key)
+    set_size = len(cpus) // processes
+
+    if set_size == 0:
+        return []
+
+    return [cpus[slot * set_size : (slot + 1) * set_size] for slot in range(processes)]
+
+
+def _parse_topology_setting(setting: str) -> tuple[int, int] | None:
+    processes, separator, threads = setting.partition("x")
+
+    try:
+        if separator:
+            return int(processes), int(threads)
+    except ValueError:
+        pass
+
+    return None
+
+
+def plan_worker_topology(processes: int | None = None) -> WorkerTopology:
+    """
+    Decides how many worker processes to run and how many threads each one
+    gets, so processes × threads stays within get_cpu_budget().
+
+    An explicit process count (WORKER_POOL_SIZE, or the autoscaler's
+    current target) gets the budget split evenly between its workers.
+    Otherwise WORKER_TOPOLOGY picks: auto (one single-threaded worker per
+    CPU), calibrate (the fastest split measured for this model, see
+    calibrate_worker_topology()) or an explicit layout like 2x4.
+    """
+
+    cpu_budget = get_cpu_budget()
+    threads = None
+
+    if processes is None:
+        processes = int(os.getenv("WORKER_POOL_SIZE", "0")) or None
+
+    if processes is None:
+        setting = os.getenv("WORKER_TOPOLOGY", "auto").strip().lower()
+        explicit = _parse_topology_setting(setting)
+
+        if explicit is not None:
+            processes, threads = explicit
+
+            if processes * threads > cpu_budget:
+                print(
+                    f"⚠️ WORKER_TOPOLOGY={setting} needs {processes * threads} CPUs but only {cpu_budget} are available; threads per worker will be reduced."
+                )
+                threads = None
+
+        elif setting == "calibrate":
+            processes = get_calibrated_processes(cpu_budget)
+
+        else:
+            if setting != "auto":
+                print(f"⚠️ Unknown WORKER_TOPOLOGY={setting}, using auto.")
+            processes = cpu_budget
+
+    processes = max(1, processes)
+
+    if threads is None:
+        threads = max(1, cpu_budget // processes)
+
+    topology: WorkerTopology = {
+        "processes": processes,
+        "threads_per_process": max(1, threads),
+        "cpu_sets": get_worker_cpu_sets(processes),
+    }
+
+    _log_topology(topology, cpu_budget)
+
+    return topology
+
+
+def _log_topology(topology: WorkerTopology, cpu_budget: int) -> None:
+    global _last_topology
+
+    with _topology_lock:
+        if topology == _last_topology:
+            return
+        _last_topology = topology
+
+    pinned = " (pinned)" if topology["cpu_sets"] else ""
+
+    print(
+        f"✅ Worker topology: {topology['processes']} process(es) × {topology['threads_per_process']} thread(s){pinned} on {cpu_budget} CPU(s)."
+    )
+
+
+def apply_thread_limits(threads: int, cpu_set: list[int] | None = None) -> None:
+    """Caps torch, OpenMP and BLAS in this process at `threads` and optionally pins it to cpu_set."""
+
+    for name in THREAD_LIMIT_ENV_VARS:
+        os.environ[name] = str(threads)
+
+    import torch
+
+    torch.set_num_threads(threads)
+
+    try:
+        from threadpoolctl import threadpool_limits
+
+        # Without a `with` block the limits stay in place for the process.
+        threadpool_limits(limits=threads)
+    except ImportError:
+        pass
+
+    if cpu_set:
+        try:
+            os.sched_setaffinity(0, cpu_set)
+        except (AttributeError, OSError) as e:
+            print(f"⚠️ Could not pin worker {os.getpid()} to CPUs {cpu_set}: {e}")
+
+
+def create_slot_counter() -> Any:
+    """Shared counter workers draw their slot (and with it their CPU set) from."""
+
+    return multiprocessing.Value("i", 0)
+
+
+def init_topology_worker(topology: WorkerTopology, slot_counter: Any = None) -> None:
+    """Applies topology to the calling worker; part of the pool initializers."""
+
+    cpu_set = None
+
+    if topology["cpu_sets"] and slot_counter is not None:
+        with slot_counter.get_lock():
+            slot = slot_counter.value
+            slot_counter.value += 1
+
+        cpu_set = topology["cpu_sets"][slot % len(topology["cpu_sets"])]
+
+    apply_thread_limits(topology["threads_per_process"], cpu_set)
+
+
+def get_calibration_candidates(cpu_budget: int) -> list[tuple[int, int]]:
+    """(processes, threads) splits that use the whole budget, threads a power of two."""
+
+    candidates = []
+    threads = 1
+
+    while threads <= cpu_budget:
+        candidates.append((cpu_budget // threads, threads))
+        threads *= 2
+
+    if candidates[-1][1] != cpu_budget:
+        candidates.append((1, cpu_budget))
+
+    return candidates
+
+
+def get_calibration_texts(count: int) -> list[str]:
+    from services.embedding.backend import PARITY_SENTENCES
+
+    # Joined into passages about the length of a real chunk.
+    return [
+        " ".join(
+            PARITY_SENTENCES[(index + offset) % len(PARITY_SENTENCES)]
+            for offset in range(8)
+        )
+        for index in range(count)
+    ]
+
+
+def _calibration_worker(
+    threads: int,
+    cpu_set: list[int] | None,
+    text_count: int,
+    barrier: Any,
+    results: Any,
+) -> None:
+    from services.embedding.utils.main import get_embedd_model
+
+    apply_thread_limits(threads, cpu_set)
+
+    embedding_model = get_embedd_model()
+    texts = get_calibration_texts(text_count)
+
+    # Warm-up, so lazy allocation and kernel selection aren't timed.
+    embedding_model.encode(texts[:8])
+
+    # Every worker starts encoding at the same moment, like a busy pool.
+    barrier.wait()
+
+    started = time.perf_counter()
+    embedding_model.encode(texts)
+    results.put(time.perf_counter() - started)
+
+
+def measure_topology(processes: int, threads: int, total_texts: int) -> float:
+    """Texts per second when `processes` workers with `threads` threads each encode total_texts together."""
+
+    texts_per_worker = math.ceil(total_texts / processes)
+    cpu_sets = get_worker_cpu_sets(processes)
+    barrier = multiprocessing.Barrier(processes)
+    results: "multiprocessing.Queue[float]" = multiprocessing.Queue()
+
+    workers = [
+        multiprocessing.Process(
+            target=_calibration_worker,
+            args=(
+                threads,
+                cpu_sets[slot] if cpu_sets else None,
+                texts_per_worker,
+                barrier,
+                results,
+            ),
+            daemon=True,
+        )
+        for slot in range(processes)
+    ]
+
+    for worker in workers:
+        worker.start()
+
+    elapsed: list[float] = []
+    deadline = time.monotonic() + TOPOLOGY_CALIBRATION_TIMEOUT_SECONDS
+
+    try:
+        while len(elapsed) < processes:
+            try:
+                elapsed.append(results.get(timeout=1))
+                continue
+            except queue.Empty:
+                pass
+
+            # A worker that died before the barrier leaves the rest waiting.
+            if time.monotonic() > deadline or any(
+                worker.exitcode not in (None, 0) for worker in workers
+            ):
+                print(f"⚠️ Topology calibration of {processes}x{threads} failed.")
+                return 0.0
+    finally:
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+    return texts_per_worker * processes / max(elapsed)
+
+
+def _calibration_cache_path(cpu_budget: int) -> str:
+    from services.embedding.backend import get_embedding_backend, get_model_artifact_dir
+    from services.embedding.utils.main import get_embedd_model_name
+
+    return os.path.join(
+        get_model_artifact_dir(get_embedd_model_name()),
+        f"topology-{get_embedding_backend()}-{cpu_budget}cpu.json",
+    )
+
+
+def calibrate_worker_topology(cpu_budget: int) -> int:
+    """
+    Times every candidate split of cpu_budget with the configured model and
+    backend and returns the process count of the fastest one. Each
+    candidate loads the model in its own child processes, so the calling
+    process stays model-free. The result is cached in
+    EMBEDDING_MODEL_CACHE_DIR per model, backend and CPU budget.
+    """
+
+    cache_path = _calibration_cache_path(cpu_budget)
+
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as cache_file:
+            return json.load(cache_file)["processes"]
+
+    total_texts = int(
+        os.getenv("TOPOLOGY_CALIBRATION_TEXTS", str(TOPOLOGY_CALIBRATION_TEXTS))
+    )
+    throughput = {}
+
+    print(f"✅ Calibrating worker topology on {cpu_budget} CPU(s)...")
+
+    for processes, threads in get_calibration_candidates(cpu_budget):
+        throughput[f"{processes}x{threads}"] = measure_topology(
+            processes, threads, total_texts
+        )
+        print(
+            f"✅ Topology {processes}x{threads}: {throughput[f'{processes}x{threads}']:.1f} texts/sec"
+        )
+
+    best = max(throughput, key=lambda layout: throughput[layout])
+
+    if throughput[best] == 0.0:
+        print("⚠️ Topology calibration failed; using one worker per CPU.")
+        return cpu_budget
+
+    processes = int(best.split("x")[0])
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    with open(cache_path, "w", encoding="utf-8") as cache_file:
+        json.dump({"processes": processes, "throughput": throughput}, cache_file)
+
+    return processes
+
+
+def get_calibrated_processes(cpu_budget: int) -> int:
+    with _topology_lock:
+        if cpu_budget not in _calibrated_processes:
+            _calibrated_processes[cpu_budget] = calibrate_worker_topology(cpu_budget)
+
+        return _calibrated_processes[cpu_budget]